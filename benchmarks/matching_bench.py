@@ -0,0 +1,97 @@
+"""
+Micro-benchmark of the descriptor matching backends.
+
+Detects ORB features in two consecutive frames of a synthetic shaky clip for
+a range of max_feature_count values and times each matcher backend, including
+the extraction of the matched point coordinates. The former path (cross-check
+match, Python sort of the matches and point lists built per match) is timed
+as a reference. The number of matches and RANSAC inliers shows what each
+backend leaves for the motion estimation.
+
+Usage:
+    python -m benchmarks.matching_bench [--features 100 300 1000 3000] [--resolution 720p]
+                                        [--max-matches N] [--repeat 50]
+"""
+import argparse
+import time
+
+import cv2 as cv
+import numpy as np
+
+from stabilizer.frame_features import FrameFeatures
+from stabilizer.matcher import create_matcher
+from benchmarks.synthetic import RESOLUTIONS, SyntheticClip
+
+
+def legacy_match(prev, curr, bfm):
+    """
+    Former matching path of MotionEstimator.estimate, kept for comparison.
+    """
+    matches = bfm.match(prev.des, curr.des)
+    matches = sorted(matches, key=lambda x: x.distance)
+    prev_pts = np.float32([prev.kp[m.queryIdx].pt for m in matches]).reshape(-1, 1, 2)
+    curr_pts = np.float32([curr.kp[m.trainIdx].pt for m in matches]).reshape(-1, 1, 2)
+    return prev_pts, curr_pts
+
+
+def backend_match(prev, curr, matcher, max_count):
+    """
+    Matching path of MotionEstimator.estimate with the given backend.
+    """
+    query_idx, train_idx = matcher.match(prev.des, curr.des, max_count)
+    return prev.pts[query_idx].reshape(-1, 1, 2), curr.pts[train_idx].reshape(-1, 1, 2)
+
+
+def time_match(match, repeat):
+    """
+    Runs a matching function repeatedly.
+
+    Returns:
+        tuple: (milliseconds per call, matched point arrays of the last call)
+    """
+    start = time.perf_counter()
+    for _ in range(repeat):
+        points = match()
+    return 1000 * (time.perf_counter() - start) / repeat, points
+
+
+def count_inliers(prev_pts, curr_pts):
+    if len(prev_pts) < 3:
+        return 0
+    _, inliers = cv.estimateAffine2D(prev_pts, curr_pts, method=cv.RANSAC)
+    return 0 if inliers is None else int(np.sum(inliers))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare matching time of the matcher backends against the feature count.")
+    parser.add_argument("--features", type=int, nargs="+", default=[100, 300, 1000, 3000], help="max_feature_count values")
+    parser.add_argument("--resolution", default="720p", choices=list(RESOLUTIONS))
+    parser.add_argument("--max-matches", type=int, default=None, help="max_match_count of the backends")
+    parser.add_argument("--ratio", type=float, default=0.75, help="match_ratio of the ratio test backends")
+    parser.add_argument("--repeat", type=int, default=50, help="number of timed runs per backend")
+    args = parser.parse_args()
+
+    clip = SyntheticClip(RESOLUTIONS[args.resolution], 2)
+    frames = [clip.frame(0), clip.frame(1)]
+    backends = {name: create_matcher(name, args.ratio) for name in ["bf", "ratio", "flann"]}
+    bfm = cv.BFMatcher(cv.NORM_HAMMING, crossCheck=True)
+
+    print(f"{'features':>8} | {'backend':<7} | {'time':>11} | {'matches':>7} | {'inliers':>7}")
+    for feature_count in args.features:
+        orb = cv.ORB_create(nfeatures=feature_count)
+        prev, curr = (FrameFeatures(frame, 1.0, orb) for frame in frames)
+
+        runs = {"legacy": lambda: legacy_match(prev, curr, bfm)}
+        for name, matcher in backends.items():
+            runs[name] = lambda matcher=matcher: backend_match(prev, curr, matcher, args.max_matches)
+
+        for name, match in runs.items():
+            ms, (prev_pts, curr_pts) = time_match(match, args.repeat)
+            print(
+                f"{len(prev.kp):8d} | {name:<7} | {ms:8.3f} ms | {len(prev_pts):7d} | "
+                f"{count_inliers(prev_pts, curr_pts):7d}"
+            )
+
+
+if __name__ == "__main__":
+    main()
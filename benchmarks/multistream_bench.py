@@ -0,0 +1,109 @@
+"""
+Scaling benchmark of the multi-stream mode.
+
+Renders one synthetic shaky clip to a temporary video file, then stabilizes
+1, 2, 4 and 8 copies of it concurrently, one worker process per stream.
+Reports the aggregate throughput, the mean per-stream FPS and the scaling
+efficiency relative to a single stream.
+
+Usage:
+    python -m benchmarks.multistream_bench [--config config.json] [--streams 1 2 4 8]
+                                           [--frames 300] [--resolution 360p] [--opencv-threads 1]
+"""
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import cv2 as cv
+
+from multistream import run_streams
+import utils
+from benchmarks.synthetic import RESOLUTIONS, SyntheticClip
+
+# Settings forced for headless streams without per-frame logging
+BENCHMARK_OVERRIDES = {
+    "display_output": False,
+    "plot_trajectory": False,
+    "save_output_video_to": None,
+    "save_log_to": None,
+    "metrics_output_path": None,
+    "log_message": False,
+    "measure_performance": False,
+    "processing_mode": "multistream",
+}
+
+
+def write_clip(path, resolution, frame_count, seed):
+    """
+    Renders a synthetic clip to a lossless-enough MJPG video file.
+    """
+    clip = SyntheticClip(RESOLUTIONS[resolution], frame_count, seed=seed)
+    writer = cv.VideoWriter(path, cv.VideoWriter_fourcc(*"MJPG"), 25, clip.size)
+    for frame in clip:
+        writer.write(frame)
+    writer.release()
+
+
+def load_config(path, video_path, stream_count, opencv_threads):
+    """
+    Loads the configuration to benchmark (defaults if no path is given)
+    with stream_count streams reading the same video file.
+    """
+    config = {}
+    if path:
+        with open(path, "r") as f:
+            config = json.load(f)
+    config.update(BENCHMARK_OVERRIDES)
+    config["opencv_threads"] = opencv_threads
+    config["streams"] = [{"source_of_frames": "video", "input_video_path": video_path}] * stream_count
+    return utils.validate_config(config)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure how the multi-stream mode scales with the number of streams.")
+    parser.add_argument("--config", default="config.json", help="configuration to benchmark ('' for defaults)")
+    parser.add_argument("--streams", type=int, nargs="+", default=[1, 2, 4, 8], help="numbers of concurrent streams")
+    parser.add_argument("--frames", type=int, default=300, help="number of frames per stream")
+    parser.add_argument("--resolution", default="360p", choices=list(RESOLUTIONS))
+    parser.add_argument("--opencv-threads", type=int, default=1, help="OpenCV threads per stream (-1 keeps OpenCV's default)")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the texture and the camera motion")
+    args = parser.parse_args()
+
+    opencv_threads = None if args.opencv_threads < 0 else args.opencv_threads
+    directory = tempfile.mkdtemp()
+    try:
+        video_path = os.path.join(directory, "clip.avi")
+        write_clip(video_path, args.resolution, args.frames, args.seed)
+
+        print(f"{os.cpu_count()} CPU cores, {args.resolution}, {args.frames} frames per stream")
+        single_fps = None
+        for stream_count in args.streams:
+            config = load_config(args.config, video_path, stream_count, opencv_threads)
+
+            start = time.perf_counter()
+            results = run_streams(config["streams"], config["multistream_workers"])
+            elapsed = time.perf_counter() - start
+
+            total_fps = sum(result["frames"] for result in results) / elapsed
+            stream_fps = sum(result["fps"] for result in results) / len(results)
+            dropped = sum(result["dropped"] for result in results)
+            if single_fps is None and stream_count == 1:
+                single_fps = total_fps
+
+            scaling = ""
+            if single_fps:
+                speedup = total_fps / single_fps
+                scaling = f" | speedup {speedup:5.2f}x | efficiency {100 * speedup / stream_count:5.1f}%"
+            print(
+                f"{stream_count:3d} streams | {total_fps:8.1f} FPS total | {stream_fps:7.1f} FPS per stream | "
+                f"dropped {dropped}{scaling}"
+            )
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
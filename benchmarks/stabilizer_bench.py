@@ -0,0 +1,285 @@
+"""
+Accuracy and throughput benchmark of the Stabilizer on synthetic shaky clips.
+
+For every resolution a clip with known camera motion is generated and stabilized
+headless with the given configuration. The benchmark reports per-stage timings,
+end-to-end FPS, peak memory, the memory allocated per frame once warm, the error of the estimated motion and of the cumulated
+trajectory (drift) against the ground truth and the inter-frame transformation fidelity (ITF, mean PSNR of consecutive
+frames) of the input and of the stabilized output. Every resolution runs in a
+fresh process so the peak memory of one does not hide the others.
+
+Usage:
+    python -m benchmarks.stabilizer_bench [--config config.json] [--resolutions 360p 720p 1080p]
+                                          [--frames 300] [--image still.jpg] [--output results.json]
+"""
+import argparse
+import json
+import multiprocessing
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import cv2 as cv
+import numpy as np
+
+from stabilizer import Stabilizer
+from logger import Logger
+import utils
+from benchmarks.synthetic import RESOLUTIONS, SyntheticClip, load_texture
+
+# Settings forced for a headless run with stage timing
+BENCHMARK_OVERRIDES = {
+    "display_output": False,
+    "plot_trajectory": False,
+    "save_output_video_to": None,
+    "save_log_to": None,
+    "log_message": False,
+    "measure_performance": True,
+    "processing_mode": "serial",
+    # Frames come from the synthetic clip, not from the configured source
+    "source_of_frames": "video",
+    "input_video_path": "synthetic",
+}
+
+
+def load_config(path):
+    """
+    Loads the configuration to benchmark (defaults if no path is given)
+    and applies the benchmark overrides.
+    """
+    config = {}
+    if path:
+        with open(path, "r") as f:
+            config = json.load(f)
+    config.update(BENCHMARK_OVERRIDES)
+    return utils.validate_config(config)
+
+
+def peak_rss_mb():
+    """
+    Returns the peak resident memory of this process in MB.
+    """
+    try:
+        import resource
+    except ImportError:
+        # Windows has no resource module
+        import psutil
+        return psutil.Process().memory_info().peak_wset / 1024 / 1024
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in bytes on macOS and in kilobytes on Linux
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+
+def measure_allocations(config, clip, warmup=10, frames=50):
+    """
+    Measures the memory allocated while stabilizing frames once the stabilizer is warm,
+    in a separate untimed pass since tracing slows every allocation down. tracemalloc
+    sees Python objects and NumPy arrays, including those OpenCV returns, but not the
+    buffers OpenCV allocates internally.
+
+    Returns:
+        dict: Mean and largest bytes allocated and freed within a frame, and bytes still held after all frames.
+    """
+    frame_count = min(clip.frame_count, warmup + frames + 1)
+    stabilizer = Stabilizer(config, clip.frame(0), Logger(config))
+    for i in range(1, warmup + 1):
+        stabilizer.stabilize(clip.frame(i))
+
+    # Frames are rendered before tracing, so only the stabilizer is measured
+    inputs = [clip.frame(i) for i in range(warmup + 1, frame_count)]
+    transient = []
+    tracemalloc.start()
+    start, _ = tracemalloc.get_traced_memory()
+    for frame in inputs:
+        tracemalloc.reset_peak()
+        before, _ = tracemalloc.get_traced_memory()
+        stabilizer.stabilize(frame)
+        _, peak = tracemalloc.get_traced_memory()
+        transient.append(peak - before)
+    end, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    stabilizer.close()
+
+    return {
+        "frames": len(inputs),
+        "mean_per_frame_kb": float(np.mean(transient)) / 1024 if transient else None,
+        "max_per_frame_kb": float(np.max(transient)) / 1024 if transient else None,
+        "retained_kb": (end - start) / 1024,
+    }
+
+
+def fidelity_region(frame):
+    """
+    Central part of the frame converted to grayscale. Borders are left out so the
+    black areas uncovered by warping do not dominate the fidelity score.
+    """
+    h, w = frame.shape[:2]
+    y, x = h // 10, w // 10
+    return cv.cvtColor(frame[y:h - y, x:w - x], cv.COLOR_BGR2GRAY).astype(np.float32)
+
+
+def psnr(a, b):
+    mse = np.mean((a - b) ** 2)
+    return 100.0 if mse == 0 else 10 * np.log10(255 ** 2 / mse)
+
+
+def run_resolution(config, name, frame_count, image, seed):
+    """
+    Stabilizes one synthetic clip and measures it.
+
+    Returns:
+        dict: Results of the run.
+    """
+    size = RESOLUTIONS[name]
+    texture = load_texture(image) if image else None
+    clip = SyntheticClip(size, frame_count, texture=texture, seed=seed)
+
+    logger = Logger(config)
+    first_frame = clip.frame(0)
+    stabilizer = Stabilizer(config, first_frame, logger)
+
+    estimated = np.full((frame_count, 3), np.nan)
+    input_psnr = []
+    output_psnr = []
+    prev_input = prev_output = fidelity_region(first_frame)
+    elapsed = 0.0
+
+    for i in range(1, frame_count):
+        frame = clip.frame(i)
+
+        # Only the stabilizer is timed, rendering and scoring are not
+        start = time.perf_counter()
+        result = stabilizer.stabilize(frame)
+        elapsed += time.perf_counter() - start
+
+        if stabilizer.last_raw_motion is not None:
+            estimated[i] = stabilizer.last_raw_motion
+
+        curr_input = fidelity_region(frame)
+        input_psnr.append(psnr(prev_input, curr_input))
+        prev_input = curr_input
+
+        # With a smoothing lag, the output is delayed and the first frames produce none
+        if result is not None:
+            curr_output = fidelity_region(result)
+            output_psnr.append(psnr(prev_output, curr_output))
+            prev_output = curr_output
+
+    # Frames held back by a smoothing lag, every one is rendered into the same buffer
+    remaining = stabilizer.flush()
+    while True:
+        start = time.perf_counter()
+        result = next(remaining, None)
+        elapsed += time.perf_counter() - start
+        if result is None:
+            break
+        curr_output = fidelity_region(result)
+        output_psnr.append(psnr(prev_output, curr_output))
+        prev_output = curr_output
+    stabilizer.close()
+
+    # Error of the estimated motion against the ground truth, failed frames excluded
+    valid = ~np.isnan(estimated[1:, 0])
+    error = estimated[1:][valid] - clip.motion[1:][valid]
+    processed = frame_count - 1
+
+    # Drift of the cumulated trajectory, failed frames count as motionless like in the stabilizer
+    drift = np.cumsum(np.nan_to_num(estimated[1:]) - clip.motion[1:], axis=0)
+
+    allocations = measure_allocations(config, clip)
+
+    return {
+        "resolution": name,
+        "width": size[0],
+        "height": size[1],
+        "frames": processed,
+        "fps": processed / elapsed if elapsed > 0 else 0.0,
+        "peak_rss_mb": peak_rss_mb(),
+        "allocations": allocations,
+        "stages": {stage: histogram.summary() for stage, histogram in logger.stage_metrics.items()},
+        "estimation": {
+            "failed_frames": int(processed - np.count_nonzero(valid)),
+            "rmse_dx_px": float(np.sqrt(np.mean(error[:, 0] ** 2))) if len(error) else None,
+            "rmse_dy_px": float(np.sqrt(np.mean(error[:, 1] ** 2))) if len(error) else None,
+            "rmse_dr_deg": float(np.degrees(np.sqrt(np.mean(error[:, 2] ** 2)))) if len(error) else None,
+            "final_drift_px": float(np.hypot(*drift[-1, :2])) if processed else None,
+            "final_drift_deg": float(np.degrees(abs(drift[-1, 2]))) if processed else None,
+        },
+        "fidelity": {
+            "input_itf_db": float(np.mean(input_psnr)),
+            "output_itf_db": float(np.mean(output_psnr)),
+        },
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the stabilizer on synthetic clips with known motion.")
+    parser.add_argument("--config", default="config.json", help="configuration to benchmark ('' for defaults)")
+    parser.add_argument("--resolutions", nargs="+", default=list(RESOLUTIONS), choices=list(RESOLUTIONS))
+    parser.add_argument("--frames", type=int, default=300, help="number of frames per clip")
+    parser.add_argument("--image", default=None, help="still image used as texture instead of a random one")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the texture and the camera motion")
+    parser.add_argument("--output", default="benchmark_results.json", help="path of the JSON results")
+    args = parser.parse_args()
+
+    config = load_config(args.config)
+
+    results = []
+    context = multiprocessing.get_context("spawn")
+    for name in args.resolutions:
+        with context.Pool(1) as pool:
+            result = pool.apply(run_resolution, (config, name, args.frames, args.image, args.seed))
+        results.append(result)
+
+        estimation = result["estimation"]
+        print(
+            f"{name:>6} | {result['fps']:7.1f} FPS | peak RSS {result['peak_rss_mb']:7.1f} MB | "
+            f"RMSE dx {estimation['rmse_dx_px']:.3f} px, dy {estimation['rmse_dy_px']:.3f} px, "
+            f"dr {estimation['rmse_dr_deg']:.4f} deg | drift {estimation['final_drift_px']:.2f} px, "
+            f"{estimation['final_drift_deg']:.3f} deg | failed {estimation['failed_frames']} | "
+            f"ITF {result['fidelity']['input_itf_db']:.2f} -> {result['fidelity']['output_itf_db']:.2f} dB"
+        )
+        allocations = result["allocations"]
+        if allocations["frames"]:
+            print(
+                f"         allocated per warm frame: mean {allocations['mean_per_frame_kb']:.1f} KB, "
+                f"max {allocations['max_per_frame_kb']:.1f} KB, retained after "
+                f"{allocations['frames']} frames {allocations['retained_kb']:.1f} KB"
+            )
+        for stage, timing in result["stages"].items():
+            print(
+                f"         {stage:<10} mean {timing['mean_ms']:8.3f} ms | p50 {timing['p50_ms']:8.3f} ms | "
+                f"p95 {timing['p95_ms']:8.3f} ms | p99 {timing['p99_ms']:8.3f} ms"
+            )
+
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": git_commit(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_count": multiprocessing.cpu_count(),
+        "python": platform.python_version(),
+        "opencv": cv.__version__,
+        "frames": args.frames,
+        "seed": args.seed,
+        "image": args.image,
+        "config": config,
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+Startup benchmark: time from launching a fresh interpreter to the first stabilized frame.
+
+Every run starts a new Python process, which imports the modules of run.py, opens
+a synthetic source and stabilizes its second frame (the first one is the reference).
+The benchmark reports the median time until the imports are done and until the
+first stabilized frame, and which optional dependencies were loaded on the way.
+
+Usage:
+    python -m benchmarks.startup_bench [--runs 10] [--config config.json] [--resolution 720p]
+"""
+import argparse
+import json
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from benchmarks.synthetic import RESOLUTIONS
+
+# Optional dependencies that a headless run should not load
+OPTIONAL_MODULES = ["matplotlib", "psutil", "filterpy", "picamera2"]
+
+
+def child(config_path, resolution):
+    """
+    Runs in the benchmarked process: stabilizes the first frame and prints the
+    elapsed times since the interpreter started as JSON.
+    """
+    import run
+    imported = time.perf_counter()
+
+    from source import FrameSource
+    from stabilizer import Stabilizer
+    from logger import Logger
+    import utils
+
+    config = {}
+    if config_path:
+        with open(config_path, "r") as f:
+            config = json.load(f)
+    config.update({
+        "source_of_frames": "synthetic",
+        "synthetic_resolution": list(RESOLUTIONS[resolution]),
+        "synthetic_frame_count": 2,
+        "processing_mode": "serial",
+        "display_output": False,
+        "plot_trajectory": False,
+        "live_plot": False,
+    })
+    config = utils.validate_config(config)
+
+    logger = Logger(config)
+    source = FrameSource(config)
+    stabilizer = Stabilizer(config, source.read(), logger)
+    stabilizer.stabilize(source.read())
+    source.release()
+    stabilizer.close()
+    done = time.perf_counter()
+
+    print(json.dumps({
+        "imported": imported,
+        "first_frame": done,
+        "modules": [name for name in OPTIONAL_MODULES if name in sys.modules],
+    }))
+
+
+def run_once(config_path, resolution):
+    """
+    Launches one benchmarked process.
+
+    Returns:
+        tuple: (seconds to imports done, seconds to first stabilized frame, loaded optional modules)
+    """
+    # perf_counter is system-wide on Linux and Windows, so both processes share the clock
+    start = time.perf_counter()
+    output = subprocess.check_output(
+        [sys.executable, "-m", "benchmarks.startup_bench", "--child", "--config", config_path, "--resolution", resolution],
+        text=True,
+    )
+    result = json.loads(output.strip().splitlines()[-1])
+    return result["imported"] - start, result["first_frame"] - start, result["modules"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the time to the first stabilized frame of a fresh process.")
+    parser.add_argument("--runs", type=int, default=10, help="number of processes launched")
+    parser.add_argument("--config", default="", help="configuration to benchmark ('' for defaults)")
+    parser.add_argument("--resolution", default="360p", choices=list(RESOLUTIONS))
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.config, args.resolution)
+        return
+
+    imported, first_frame = [], []
+    for _ in range(args.runs):
+        t_imported, t_first_frame, modules = run_once(args.config, args.resolution)
+        imported.append(t_imported)
+        first_frame.append(t_first_frame)
+
+    print(f"imports done:           median {1000 * np.median(imported):7.1f} ms | max {1000 * np.max(imported):7.1f} ms")
+    print(f"first stabilized frame: median {1000 * np.median(first_frame):7.1f} ms | max {1000 * np.max(first_frame):7.1f} ms")
+    print(f"optional modules loaded: {', '.join(modules) or 'none'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+"""
+Synthetic shaky clips with known camera motion.
+
+A texture (or a still image) larger than the frame is viewed through a camera
+that pans slowly and jitters randomly in translation and rotation. Because the
+pose of every frame is known, the true inter-frame motion can be compared with
+the motion estimated by the stabilizer.
+"""
+import cv2 as cv
+import numpy as np
+
+# Named output resolutions (width, height)
+RESOLUTIONS = {
+    "360p": (640, 360),
+    "720p": (1280, 720),
+    "1080p": (1920, 1080),
+}
+
+
+def make_texture(size, seed=0):
+    """
+    Draws random filled rectangles and circles, which give plenty of corners.
+
+    Args:
+        size (tuple): (width, height) of the texture.
+        seed (int): Seed of the random generator.
+
+    Returns:
+        ndarray: BGR texture.
+    """
+    w, h = size
+    rng = np.random.default_rng(seed)
+    texture = np.full((h, w, 3), 127, dtype=np.uint8)
+
+    # Shape count and size grow with the texture so the density stays the same
+    scale = w / 640
+    for _ in range(int(700 * scale * scale)):
+        color = tuple(int(c) for c in rng.integers(0, 256, 3))
+        x, y = int(rng.integers(0, w)), int(rng.integers(0, h))
+        if rng.random() < 0.5:
+            dx, dy = (int(v * scale) for v in rng.integers(4, 40, 2))
+            cv.rectangle(texture, (x, y), (x + dx, y + dy), color, -1)
+        else:
+            cv.circle(texture, (x, y), int(rng.integers(3, 20) * scale), color, -1)
+
+    return texture
+
+
+def load_texture(path):
+    """
+    Loads a still image to be used as texture, SyntheticClip resizes it as needed.
+    """
+    image = cv.imread(path)
+    if image is None:
+        raise IOError(f"Failed to read image: {path}")
+    return image
+
+
+def generate_poses(frame_count, max_shift, max_rotation, pan=0.5, seed=0):
+    """
+    Generates the camera pose of every frame: a slow horizontal pan centered on
+    the middle frame plus random jitter.
+
+    Args:
+        frame_count (int): Number of frames.
+        max_shift (float): Standard deviation of the translation jitter in pixels.
+        max_rotation (float): Standard deviation of the rotation jitter in radians.
+        pan (float): Horizontal pan in pixels per frame.
+        seed (int): Seed of the random generator.
+
+    Returns:
+        ndarray: Poses (x, y, r) of shape (frame_count, 3).
+    """
+    rng = np.random.default_rng(seed)
+    poses = rng.normal(0, [max_shift, max_shift, max_rotation], size=(frame_count, 3))
+    poses[:, 0] += pan * (np.arange(frame_count) - frame_count / 2)
+    return poses
+
+
+def pose_matrix(pose, center):
+    """
+    Builds the 3x3 transform of a pose: rotation around the frame center plus translation.
+    """
+    x, y, r = pose
+    cos, sin = np.cos(r), np.sin(r)
+    cx, cy = center
+    return np.array([
+        [cos, -sin, cx - cos * cx + sin * cy + x],
+        [sin, cos, cy - sin * cx - cos * cy + y],
+        [0, 0, 1],
+    ])
+
+
+def true_motion(poses, center):
+    """
+    Computes the true motion between consecutive frames in the same form as
+    MotionEstimator.estimate: (dx, dy, dr) of the affine transform mapping
+    the previous frame onto the current one.
+
+    Returns:
+        ndarray: Motion of shape (frame_count, 3), the first row is zero.
+    """
+    motion = np.zeros((len(poses), 3))
+    prev = pose_matrix(poses[0], center)
+    for i in range(1, len(poses)):
+        curr = pose_matrix(poses[i], center)
+        T = curr @ np.linalg.inv(prev)
+        motion[i] = T[0, 2], T[1, 2], np.arctan2(T[1, 0], T[0, 0])
+        prev = curr
+    return motion
+
+
+class SyntheticClip:
+    def __init__(self, size, frame_count, max_shift=4.0, max_rotation=0.01, texture=None, seed=0):
+        """
+        A shaky clip rendered on demand from a texture with known camera poses.
+
+        Args:
+            size (tuple): (width, height) of the frames.
+            frame_count (int): Number of frames.
+            max_shift (float): Standard deviation of the translation jitter in pixels.
+            max_rotation (float): Standard deviation of the rotation jitter in radians.
+            texture (ndarray or None): Texture to view, a random one is drawn if None.
+            seed (int): Seed of the random generators.
+        """
+        self.size = size
+        self.frame_count = frame_count
+        w, h = size
+
+        # The texture is larger than the frame so the view never leaves it,
+        # even with the pan and 4-sigma translation and rotation jitter
+        pan = 0.5
+        margin = int(4 * max_shift + 0.5 * pan * frame_count + 2 * max_rotation * np.hypot(w, h)) + 16
+        texture_size = (w + 2 * margin, h + 2 * margin)
+        if texture is None:
+            texture = make_texture(texture_size, seed)
+        elif texture.shape[1::-1] != texture_size:
+            texture = cv.resize(texture, texture_size, interpolation=cv.INTER_AREA)
+        self.texture = texture
+        self.margin = margin
+
+        # Look at the middle of the texture
+        self.offset = np.array([[1, 0, -margin], [0, 1, -margin], [0, 0, 1]])
+
+        center = (w / 2, h / 2)
+        self.poses = generate_poses(frame_count, max_shift, max_rotation, pan, seed)
+        self.matrices = [pose_matrix(pose, center) for pose in self.poses]
+        self.motion = true_motion(self.poses, center)
+
+    def __len__(self):
+        return self.frame_count
+
+    def frame(self, index, out=None):
+        """
+        Renders one frame of the clip, into the given buffer if any.
+        """
+        M = (self.matrices[index] @ self.offset)[:2]
+        return cv.warpAffine(self.texture, M, self.size, dst=out, flags=cv.INTER_LINEAR)
+
+    def __iter__(self):
+        for i in range(self.frame_count):
+            yield self.frame(i)
@@ -0,0 +1,90 @@
+"""
+Micro-benchmark of the warp of a stabilized frame.
+
+Warps frames of a synthetic clip at every resolution with the full affine warp
+(linear and nearest interpolation) and with the translation-only fast path used for
+negligible rotations. Reports the cost of each and the largest difference of the
+fast path from the full warp of the same interpolation, borders excluded.
+
+Usage:
+    python -m benchmarks.warp_bench [--resolutions 360p 720p 1080p] [--frames 100] [--crop]
+"""
+import argparse
+import time
+
+import cv2 as cv
+import numpy as np
+
+from stabilizer.transform import crop_window, warp_frame
+from benchmarks.synthetic import RESOLUTIONS, SyntheticClip
+
+# Variants timed: name -> (interpolation, rotation_threshold)
+VARIANTS = {
+    "affine linear": (cv.INTER_LINEAR, 0.0),
+    "affine nearest": (cv.INTER_NEAREST, 0.0),
+    "shift linear": (cv.INTER_LINEAR, np.inf),
+    "shift nearest": (cv.INTER_NEAREST, np.inf),
+}
+
+
+def run_variant(frames, corrections, crop, interpolation, rotation_threshold):
+    """
+    Warps every frame into one preallocated output.
+
+    Returns:
+        tuple: (outputs of all frames, milliseconds per frame)
+    """
+    h, w = frames[0].shape[:2]
+    if crop is not None:
+        w, h = crop[2], crop[3]
+    out = np.empty((h, w) + frames[0].shape[2:], dtype=frames[0].dtype)
+    scratch = np.empty_like(frames[0])
+
+    start = time.perf_counter()
+    for frame, correction in zip(frames, corrections):
+        warp_frame(frame, correction, crop, out, interpolation, rotation_threshold, scratch)
+    elapsed = time.perf_counter() - start
+
+    # Outputs for the comparison, rendered again outside the timing
+    results = [warp_frame(frame, correction, crop, None, interpolation, rotation_threshold, scratch)
+               for frame, correction in zip(frames, corrections)]
+
+    return results, 1000 * elapsed / len(frames)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the cost of the full warp and of the translation-only fast path.")
+    parser.add_argument("--resolutions", nargs="+", default=list(RESOLUTIONS), choices=list(RESOLUTIONS))
+    parser.add_argument("--frames", type=int, default=100, help="number of frames warped per variant")
+    parser.add_argument("--crop", action="store_true", help="warp into a crop window with 30/10 px margins")
+    args = parser.parse_args()
+
+    # Random sub-pixel corrections without rotation, so every variant renders the same motion
+    rng = np.random.default_rng(0)
+    corrections = rng.normal(0, [4.0, 4.0, 0.0], size=(args.frames, 3))
+
+    for name in args.resolutions:
+        size = RESOLUTIONS[name]
+        clip = SyntheticClip(size, args.frames)
+        frames = list(clip)
+        crop = crop_window(*size, 30, 10) if args.crop else None
+
+        outputs = {}
+        costs = {}
+        print(f"{name:>6} ({size[0]}x{size[1]})")
+        for variant, (interpolation, rotation_threshold) in VARIANTS.items():
+            outputs[variant], costs[variant] = run_variant(frames, corrections, crop, interpolation, rotation_threshold)
+            line = f"         {variant:<15} {costs[variant]:8.3f} ms/frame"
+            if variant.startswith("shift"):
+                # Compared with the full warp of the same interpolation
+                reference = "affine " + variant.split()[1]
+                diff = max(
+                    np.max(cv.absdiff(a[16:-16, 16:-16], b[16:-16, 16:-16]))
+                    for a, b in zip(outputs[variant], outputs[reference])
+                )
+                line += f" | {costs[reference] / costs[variant]:5.1f}x faster | max difference {int(diff)}"
+            print(line)
+
+
+if __name__ == "__main__":
+    main()
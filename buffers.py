@@ -0,0 +1,36 @@
+import numpy as np
+
+
+class BufferPool:
+    def __init__(self):
+        """
+        Named arrays reused from frame to frame instead of being allocated anew.
+        Requests the pool cannot serve from an existing buffer are counted as misses.
+        Arrays allocated outside the pool, by OpenCV or NumPy temporaries, are not counted.
+        """
+        self.buffers = {}
+        self.misses = 0
+
+    def get(self, name, shape, dtype=np.uint8):
+        """
+        Returns the buffer with the given name, allocating it on first use
+        or when the requested shape or type changes.
+
+        Args:
+            name (str): Name of the buffer.
+            shape (tuple): Shape of the buffer.
+            dtype (type): Element type of the buffer.
+
+        Returns:
+            ndarray: Buffer of the requested shape, zero-filled when allocated.
+        """
+        buffer = self.buffers.get(name)
+        if buffer is None or buffer.shape != tuple(shape) or buffer.dtype != dtype:
+            buffer = np.zeros(shape, dtype=dtype)
+            self.buffers[name] = buffer
+            self.misses += 1
+        return buffer
+
+    def like(self, name, array):
+        """Returns the buffer with the given name with the shape and type of an array."""
+        return self.get(name, array.shape, array.dtype)
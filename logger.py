@@ -1,25 +1,45 @@
+import bisect
+import json
+import threading
 import time
-import psutil
+from collections import deque
 
 class Logger:
     def __init__(self, config):
         # Logging flags based on configuration
         self.log_msg = config["log_message"]  # Whether to log standard messages
         self.log_measure = config["measure_performance"]  # Whether to log performance metrics
-        
-        # Optional log file output
+        self.name = config["stream_name"]  # Name shown in messages, for telling streams apart
+
+        # Optional log file output, only the most recent messages are kept
         self.save_log_to = config["save_log_to"]
-        self.log_history = [] if self.save_log_to else None
+        self.log_history = deque(maxlen=config["log_history_size"]) if self.save_log_to else None
 
         # Frame tracking
         self.frame_counter = 1
         self.drop_count = 0
         self.success_count = 0
-        self.start_time = time.time()
+        self.total_drop_count = 0
+
+        # Start of the current FPS measurement window, set by the first processed frame
+        self.start_time = None
+        self.start_frame = self.frame_counter
 
-        # Setup process monitoring (for CPU and memory usage)
-        self.process = psutil.Process()
-        self.process.cpu_percent(interval=None)
+        # Per-stage latency histograms and optional periodic snapshots to a file
+        self.metrics_path = config["metrics_output_path"]
+        self.metrics_interval = config["metrics_interval"]
+        self.timing_enabled = self.log_measure or self.metrics_path is not None
+        self.stage_metrics = {}
+        self.metrics_lock = threading.Lock()
+        self.metrics_file = None
+
+        # Setup process monitoring (for CPU and memory usage), only reported with performance measurement
+        self.process = None
+        if self.log_measure:
+            # Imported here so psutil is only needed when performance is measured
+            import psutil
+            self.process = psutil.Process()
+            self.process.cpu_percent(interval=None)
 
     def log(self, msg, type = "INFO"):
         """
@@ -32,39 +52,137 @@ class Logger:
             return
 
         full = f"[{type}] [Frame {self.frame_counter}] {msg}"
+        if self.name is not None:
+            full = f"[{type}] [{self.name}] [Frame {self.frame_counter}] {msg}"
         print(full)
 
         # Save to history if logging to file is enabled
         if self.log_history is not None:
             self.log_history.append(full)
 
+    def measure(self, stage):
+        """
+        Returns a context manager timing one run of a processing stage.
+        Timing is only done if performance measurement or metric snapshots are enabled.
+        """
+        if not self.timing_enabled:
+            return _NO_TIMER
+        return StageTimer(self, stage)
+
+    def record_stage(self, stage, seconds):
+        """
+        Adds the duration of one run of a processing stage to its histogram.
+        """
+        with self.metrics_lock:
+            histogram = self.stage_metrics.get(stage)
+            if histogram is None:
+                histogram = self.stage_metrics[stage] = LatencyHistogram()
+            histogram.add(seconds)
+
+    def record_latency(self, timestamp):
+        """
+        Records the time from the capture of a frame, given as a time.perf_counter()
+        timestamp, until its output as the 'latency' stage.
+        """
+        if self.timing_enabled:
+            self.record_stage("latency", time.perf_counter() - timestamp)
+
     def update_status(self, success: bool):
         """
         Call this after processing each frame to update success/failure counters.
-        Logs performance every 100 frames if enabled.
+        Logs performance every 100 frames if enabled and writes metric snapshots.
         """
+        now = time.perf_counter()
+        if self.start_time is None:
+            self.start_time = now
+            self.start_frame = self.frame_counter
+
         self.frame_counter += 1
         if success:
             self.success_count += 1
         else:
             self.drop_count += 1
+            self.total_drop_count += 1
+
+        if self.metrics_path is not None and self.frame_counter % self.metrics_interval == 0:
+            self.write_metrics()
 
         # Every 100 frames, report performance metrics
         if self.frame_counter % 100 == 0 and self.log_measure:
-            elapsed = time.time() - self.start_time
-            fps = 100 / elapsed if elapsed > 0 else 0
+            # Throughput over the window, including display and encoding between frames
+            elapsed = now - self.start_time
+            fps = (self.frame_counter - self.start_frame) / elapsed if elapsed > 0 else 0
             cpu = self.process.cpu_percent() # Instantaneous CPU usage
             mem_mb = self.process.memory_info().rss / 1024 / 1024 # Memory in MB
             drop_rate = 100 * self.drop_count / (self.success_count + self.drop_count) if (self.success_count + self.drop_count) > 0 else 0
 
+            with self.metrics_lock:
+                stages = {stage: histogram.since("log") for stage, histogram in self.stage_metrics.items()}
+
+            # Throughput of the stabilizer alone, if it is timed separately
+            proc = ""
+            stabilize = stages.get("stabilize")
+            if stabilize is not None and stabilize["mean_ms"] > 0:
+                proc = f" | Stabilizer FPS: {1000 / stabilize['mean_ms']:.1f}"
+
             self.log(
-                f"Avg FPS: {fps:.1f} | CPU: {cpu:.1f}% | Mem: {mem_mb:.1f} MB | Dropped: {drop_rate:.1f}%",
+                f"Avg FPS: {fps:.1f}{proc} | CPU: {cpu:.1f}% | Mem: {mem_mb:.1f} MB | Dropped: {drop_rate:.1f}%",
                 "MEASURMENT"
             )
-            self.start_time = time.time()
+            for stage, stats in stages.items():
+                self.log(f"{stage}: {describe(stats)}", "MEASURMENT")
+
+            self.start_time = now
+            self.start_frame = self.frame_counter
             self.drop_count = 0
             self.success_count = 0
 
+    def write_metrics(self):
+        """
+        Appends the per-stage latencies since the previous snapshot to the metrics file,
+        as a JSON line or as CSV rows depending on its extension.
+        """
+        is_csv = self.metrics_path.endswith(".csv")
+        if self.metrics_file is None:
+            try:
+                self.metrics_file = open(self.metrics_path, "w")
+            except Exception as e:
+                print(f"[ERROR] Failed to open metrics file: {e}")
+                self.metrics_path = None
+                return
+            if is_csv:
+                self.metrics_file.write("frame,time,stage,count,mean_ms,p50_ms,p95_ms,p99_ms,max_ms\n")
+
+        with self.metrics_lock:
+            stages = {stage: histogram.since("file") for stage, histogram in self.stage_metrics.items()}
+
+        now = time.time()
+        if is_csv:
+            for stage, s in stages.items():
+                self.metrics_file.write(
+                    f"{self.frame_counter},{now:.3f},{stage},{s['count']},{s['mean_ms']:.3f},"
+                    f"{s['p50_ms']:.3f},{s['p95_ms']:.3f},{s['p99_ms']:.3f},{s['max_ms']:.3f}\n"
+                )
+        else:
+            self.metrics_file.write(json.dumps({"frame": self.frame_counter, "time": now, "stages": stages}) + "\n")
+        self.metrics_file.flush()
+
+    def close(self):
+        """
+        Writes the last metric snapshot, logs the latency summary of all stages
+        and saves the log history.
+        """
+        if self.metrics_path is not None:
+            self.write_metrics()
+        if self.metrics_file is not None:
+            self.metrics_file.close()
+            self.metrics_file = None
+
+        for stage, histogram in self.stage_metrics.items():
+            self.log(f"Total {stage}: {describe(histogram.summary())}", "MEASURMENT")
+
+        self.save_log()
+
     def save_log(self):
         """
         Save the log history to a file if logging was enabled and a path is set.
@@ -76,4 +194,126 @@ class Logger:
                 f.write("\n".join(self.log_history))
             print(f"[INFO] Log saved to {self.save_log_to}")
         except Exception as e:
-            print(f"[ERROR] Failed to save log: {e}")
\ No newline at end of file
+            print(f"[ERROR] Failed to save log: {e}")
+
+
+class LatencyHistogram:
+    """
+    Fixed-memory latency histogram with logarithmic buckets from 1 us to 10 s,
+    each about 6% wide. Percentiles are accurate to the bucket width.
+    """
+    EDGES = [1e-6 * 10 ** (i / 40) for i in range(7 * 40 + 1)]
+
+    def __init__(self):
+        self.counts = [0] * (len(self.EDGES) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+        # Histogram state at the start of each reporting period: mark -> (counts, count, total)
+        self.marks = {}
+
+    def add(self, seconds):
+        self.counts[bisect.bisect_left(self.EDGES, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def bucket_value(self, i):
+        """Representative value of a bucket: geometric center of its edges."""
+        if i == 0:
+            return self.EDGES[0]
+        if i == len(self.EDGES):
+            return self.max
+        return (self.EDGES[i - 1] * self.EDGES[i]) ** 0.5
+
+    def percentile(self, p, counts):
+        total = sum(counts)
+        if total == 0:
+            return 0.0
+        rank = p / 100 * total
+        cumulative = 0
+        for i, c in enumerate(counts):
+            cumulative += c
+            if c > 0 and cumulative >= rank:
+                return self.bucket_value(i)
+        return self.max
+
+    def stats(self, counts, count, total, max_seconds):
+        # Bucket centers can lie above the largest sample, never report more than it
+        p50, p95, p99 = (min(self.percentile(p, counts), max_seconds) for p in (50, 95, 99))
+        return {
+            "count": count,
+            "mean_ms": 1000 * total / count if count else 0.0,
+            "p50_ms": 1000 * p50,
+            "p95_ms": 1000 * p95,
+            "p99_ms": 1000 * p99,
+            "max_ms": 1000 * max_seconds,
+        }
+
+    def summary(self):
+        """Statistics of the whole run."""
+        return self.stats(self.counts, self.count, self.total, self.max)
+
+    def since(self, mark):
+        """
+        Statistics of the period since the previous call with the same mark,
+        then starts a new period for that mark. The maximum is estimated from
+        the highest non-empty bucket.
+        """
+        previous = self.marks.get(mark)
+        if previous is None:
+            counts, count, total = self.counts, self.count, self.total
+        else:
+            counts = [c - p for c, p in zip(self.counts, previous[0])]
+            count = self.count - previous[1]
+            total = self.total - previous[2]
+
+        highest = max((i for i, c in enumerate(counts) if c > 0), default=None)
+        max_seconds = 0.0 if highest is None else min(self.bucket_value(highest), self.max)
+
+        self.marks[mark] = (list(self.counts), self.count, self.total)
+        return self.stats(counts, count, total, max_seconds)
+
+
+def describe(stats):
+    """Formats statistics of a LatencyHistogram for the log."""
+    return (
+        f"n {stats['count']} | mean {stats['mean_ms']:.2f} ms | p50 {stats['p50_ms']:.2f} ms | "
+        f"p95 {stats['p95_ms']:.2f} ms | p99 {stats['p99_ms']:.2f} ms | max {stats['max_ms']:.2f} ms"
+    )
+
+
+class StageTimer:
+    """
+    Context manager measuring the duration of one processing stage.
+    """
+    __slots__ = ("logger", "stage", "start")
+
+    def __init__(self, logger, stage):
+        self.logger = logger
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.logger.record_stage(self.stage, time.perf_counter() - self.start)
+        return False
+
+
+class _NoTimer:
+    """
+    Context manager that does nothing, used when measurement is disabled.
+    """
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NO_TIMER = _NoTimer()
@@ -0,0 +1,168 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+
+# Settings that change the estimated motion, part of the cache key
+ESTIMATOR_KEYS = [
+    "resize_ratio",
+    "analysis_width",
+    "static_scene_threshold",
+    "max_feature_count",
+    "motion_estimation_method",
+    "klt_min_track_count",
+    "feature_grid",
+    "feature_grid_overlap",
+    "matcher",
+    "match_ratio",
+    "max_match_count",
+    "keyframe_mode",
+    "keyframe_min_inliers",
+    "keyframe_min_overlap",
+    "estimation_interval",
+    "estimation_max_motion",
+]
+
+# One record per frame of the video, the first frame has no motion
+RECORD_DTYPE = np.dtype([("dx", "<f8"), ("dy", "<f8"), ("dr", "<f8"), ("ok", "?"), ("inliers", "<i4")])
+
+
+def file_fingerprint(path, sample_size=4 << 20):
+    """
+    Returns an identifier of a file's content that does not require reading all of it:
+    its size and modification time with a SHA-256 digest of its first and last sample_size bytes.
+    """
+    stat = os.stat(path)
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        digest.update(f.read(sample_size))
+        if stat.st_size > sample_size:
+            f.seek(max(stat.st_size - sample_size, sample_size))
+            digest.update(f.read(sample_size))
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": digest.hexdigest()}
+
+
+def cache_path(config):
+    """
+    Path of the motion cache of the input video. The name contains a hash of the video's
+    fingerprint and of the estimator settings, so a cache is never used for another input
+    or other settings. Only the start and the end of the video are read for it.
+
+    Args:
+        config (dict): Dictionary containing stabilization parameters.
+
+    Returns:
+        str: Path of the cache file, which may not exist yet.
+    """
+    video_path = config["input_video_path"]
+    key = json.dumps({
+        "video": file_fingerprint(video_path),
+        "settings": {name: config[name] for name in ESTIMATOR_KEYS},
+    }, sort_keys=True)
+    digest = hashlib.sha256(key.encode()).hexdigest()[:16]
+
+    directory = config["motion_cache_dir"] or os.path.dirname(os.path.abspath(video_path))
+    return os.path.join(directory, f"{os.path.basename(video_path)}.{digest}.motion.npy")
+
+
+class MotionCache:
+    def __init__(self, path):
+        """
+        Raw per-frame motion of a video, replayed from a memory-mapped .npy file
+        if it exists, otherwise recorded so it can be saved for the next run.
+
+        Args:
+            path (str): Path of the cache file returned by cache_path.
+        """
+        self.path = path
+        self.records = None
+        if os.path.exists(path):
+            self.records = np.load(path, mmap_mode="r")
+
+        # The first frame is the reference and has no motion
+        self.index = 1
+        self.recorded = [(0.0, 0.0, 0.0, True, 0)]
+
+    @property
+    def is_loaded(self):
+        return self.records is not None
+
+    def replay(self):
+        """
+        Returns the motion of the next frame: (dx, dy, dr), or None if its estimation
+        failed or the cache holds no more frames.
+        """
+        if self.index >= len(self.records):
+            return None
+        dx, dy, dr, ok, _ = self.records[self.index].tolist()
+        self.index += 1
+        return (dx, dy, dr) if ok else None
+
+    def to_arrays(self, frame_count):
+        """
+        Returns the loaded motion of frame_count frames as arrays. Frames the cache
+        does not hold count as failed.
+
+        Returns:
+            tuple: (motion, success, inliers) arrays of shape (frame_count, 3), (frame_count,) and (frame_count,).
+        """
+        motion = np.zeros((frame_count, 3))
+        success = np.zeros(frame_count, dtype=bool)
+        inliers = np.zeros(frame_count, dtype=np.int32)
+
+        n = min(frame_count, len(self.records))
+        records = self.records[:n]
+        motion[:n, 0] = records["dx"]
+        motion[:n, 1] = records["dy"]
+        motion[:n, 2] = records["dr"]
+        success[:n] = records["ok"]
+        inliers[:n] = records["inliers"]
+        return motion, success, inliers
+
+    def record(self, motion, inlier_count):
+        """
+        Appends the motion of the next frame.
+
+        Args:
+            motion (tuple or None): (dx, dy, dr) motion, None if estimation failed.
+            inlier_count (int): Number of RANSAC inliers of the estimate.
+        """
+        if motion is None:
+            self.recorded.append((0.0, 0.0, 0.0, False, inlier_count))
+        else:
+            self.recorded.append((*motion, True, inlier_count))
+
+    def save(self):
+        """
+        Writes the recorded motion to the cache file.
+        """
+        records = np.array(self.recorded, dtype=RECORD_DTYPE)
+        save_records(self.path, records)
+
+
+def save_arrays(path, motion, success, inliers):
+    """
+    Writes the motion of a whole video, as returned by MotionCache.to_arrays, to a cache file.
+    """
+    records = np.zeros(len(motion), dtype=RECORD_DTYPE)
+    records["dx"] = motion[:, 0]
+    records["dy"] = motion[:, 1]
+    records["dr"] = motion[:, 2]
+    records["ok"] = success
+    records["inliers"] = inliers
+    save_records(path, records)
+
+
+def save_records(path, records):
+    """
+    Writes a structured array of RECORD_DTYPE to a cache file. The file is replaced
+    at once, so an interrupted write never leaves a partial cache.
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    temp_path = path + ".tmp"
+    with open(temp_path, "wb") as f:
+        np.save(f, records)
+    os.replace(temp_path, path)
@@ -0,0 +1,89 @@
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2 as cv
+
+from visualizer import TrajectoryPlotter
+from logger import Logger
+
+
+def run_stream(config):
+    """
+    Stabilizes one stream with its own source, stabilizer and logger.
+    Runs in a worker process.
+
+    Args:
+        config (dict): Validated configuration of the stream.
+
+    Returns:
+        dict: Name, processed and dropped frame counts, seconds and FPS of the stream.
+    """
+    # Imported here since run imports this module
+    from run import process_stream
+
+    # Worker processes do not inherit the OpenCV thread setting of the main process
+    if config["opencv_threads"] is not None:
+        cv.setNumThreads(config["opencv_threads"])
+
+    plotter = TrajectoryPlotter(config)
+    logger = Logger(config)
+
+    start = time.perf_counter()
+    process_stream(config, plotter, logger)
+    elapsed = time.perf_counter() - start
+    logger.close()
+    plotter.close()
+
+    frames = logger.frame_counter - 1
+    return {
+        "stream": config["stream_name"],
+        "frames": frames,
+        "dropped": logger.total_drop_count,
+        "seconds": elapsed,
+        "fps": frames / elapsed if elapsed > 0 else 0.0,
+    }
+
+
+def run_streams(streams, workers=None):
+    """
+    Stabilizes several streams concurrently, each in a worker process.
+
+    Args:
+        streams (list): Validated configurations of the streams.
+        workers (int or None): Number of worker processes, one per stream if None.
+            With fewer workers than streams, the remaining streams wait for a free worker.
+
+    Returns:
+        list: Results of run_stream in the order of the streams.
+    """
+    with ProcessPoolExecutor(max_workers=workers or len(streams)) as executor:
+        futures = [executor.submit(run_stream, stream) for stream in streams]
+        return [future.result() for future in futures]
+
+
+def process_multistream(config, logger):
+    """
+    Stabilizes all streams of a 'multistream' configuration and reports
+    the FPS and dropped frames of each. Returns whether the display output
+    is enabled, which it never is for streams.
+    """
+    streams = config["streams"]
+    logger.log(f"Stabilizing {len(streams)} streams...")
+
+    start = time.perf_counter()
+    results = run_streams(streams, config["multistream_workers"])
+    elapsed = time.perf_counter() - start
+
+    for result in results:
+        processed = result["frames"]
+        drop_rate = 100 * result["dropped"] / processed if processed > 0 else 0
+        logger.log(
+            f"{result['stream']}: {processed} frames in {result['seconds']:.1f} s | "
+            f"FPS: {result['fps']:.1f} | Dropped: {result['dropped']} ({drop_rate:.1f}%)",
+            "MEASURMENT"
+        )
+
+    total = sum(result["frames"] for result in results)
+    logger.log(f"All streams: {total} frames in {elapsed:.1f} s | FPS: {total / elapsed:.1f}", "MEASURMENT")
+
+    return False
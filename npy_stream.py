@@ -0,0 +1,56 @@
+import struct
+
+import numpy as np
+
+# Size of the .npy header written before the records, large enough for any record count
+HEADER_SIZE = 256
+
+
+def npy_header(dtype, count):
+    """
+    Builds a fixed-size .npy header of a 1D array, so it can be rewritten in place
+    once the number of records is known.
+
+    Raises:
+        ValueError: If the description of the array does not fit in HEADER_SIZE bytes.
+    """
+    header = "{'descr': %r, 'fortran_order': False, 'shape': (%d,), }" % (np.lib.format.dtype_to_descr(dtype), count)
+    # Magic string, header length and the final newline take the other 11 bytes
+    if len(header) > HEADER_SIZE - 11:
+        raise ValueError(f"The .npy header of {dtype} does not fit in {HEADER_SIZE} bytes.")
+    header = header.ljust(HEADER_SIZE - 11) + "\n"
+    return np.lib.format.magic(1, 0) + struct.pack("<H", len(header)) + header.encode("latin1")
+
+
+class NpyStreamWriter:
+    def __init__(self, path, dtype):
+        """
+        Appends records to a 1D .npy file of unknown final length. The header is
+        completed on close, the file can then be memory-mapped with np.load.
+
+        Args:
+            path (str): Path of the file.
+            dtype (np.dtype): Structured type of the records.
+        """
+        self.dtype = np.dtype(dtype)
+        self.count = 0
+        self.file = open(path, "wb")
+        self.file.write(npy_header(self.dtype, 0))
+
+    def write(self, records):
+        """Appends an array of records."""
+        self.file.write(records.tobytes())
+        self.count += len(records)
+
+    def write_bytes(self, data, count=1):
+        """Appends the raw bytes of count records."""
+        self.file.write(data)
+        self.count += count
+
+    def close(self):
+        if self.file is None:
+            return
+        self.file.seek(0)
+        self.file.write(npy_header(self.dtype, self.count))
+        self.file.close()
+        self.file = None
@@ -0,0 +1,309 @@
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2 as cv
+import numpy as np
+
+from stabilizer import create_motion_estimator
+from stabilizer.smoother import gaussian_smooth, rts_smooth
+from stabilizer.transform import INTERPOLATIONS, crop_window, warp_frame
+from stabilizer.frame_format import reduce_frame
+from motion_cache import MotionCache, cache_path, save_arrays
+from logger import Logger
+import utils
+
+
+# Capture kept by a worker process after its chunk, by video path: (capture, number of its next frame,
+# last frame read or None). Chunks are handed out in order, so the next chunk of a worker usually lies
+# ahead of its capture
+_readers = {}
+
+# Whether seeking by frame number was exact in this process, by video path
+_exact_seek = {}
+
+
+def open_at(path, index):
+    """
+    Returns a capture of a video positioned at the given frame, reusing the capture this
+    process kept after its previous chunk. Seeking by frame number is not exact for every
+    codec and container, so the position is checked after every seek. Once a seek was off,
+    the video is only read forward: the frames before the index are grabbed without decoding
+    them into images, from the kept capture if it is not past the index, otherwise from the
+    first frame, the only position known to be exact.
+
+    Args:
+        path (str): Path of the video file.
+        index (int): Number of the next frame to read.
+
+    Returns:
+        cv.VideoCapture: Opened capture, to be handed back with keep_reader.
+    """
+    capture, position, _ = _readers.pop(path, (None, 0, None))
+    if capture is not None and position == index:
+        return capture
+    if capture is None and index == 0:
+        return cv.VideoCapture(path)
+
+    if _exact_seek.get(path, True):
+        if capture is None:
+            capture = cv.VideoCapture(path)
+        capture.set(cv.CAP_PROP_POS_FRAMES, index)
+        _exact_seek[path] = int(capture.get(cv.CAP_PROP_POS_FRAMES)) == index
+        if _exact_seek[path]:
+            return capture
+
+        # Where a seek that was off left the capture is unknown
+        capture.release()
+        capture = None
+
+    if capture is None or position > index:
+        if capture is not None:
+            capture.release()
+        capture, position = cv.VideoCapture(path), 0
+    for _ in range(index - position):
+        if not capture.grab():
+            break
+    return capture
+
+
+def keep_reader(path, capture, index, last_frame=None):
+    """
+    Keeps the capture of a video for the next chunk of this process.
+
+    Args:
+        path (str): Path of the video file.
+        capture (cv.VideoCapture): Capture returned by open_at.
+        index (int): Number of the next frame the capture reads.
+        last_frame (ndarray or None): Frame index - 1, if the next chunk may need it.
+    """
+    previous = _readers.pop(path, None)
+    if previous is not None:
+        previous[0].release()
+    _readers[path] = (capture, index, last_frame)
+
+
+def kept_frame(path, index):
+    """
+    Returns frame index - 1 if the capture kept by this process reads frame index next
+    and holds the frame before it, otherwise None.
+    """
+    _, position, last_frame = _readers.get(path, (None, 0, None))
+    return last_frame if position == index else None
+
+
+def estimate_chunk(config, start, end):
+    """
+    Estimates the motion of frames [start, end) of the input video relative to
+    their previous frame. Runs in a worker process.
+
+    Returns:
+        tuple: (motion, success, inliers) arrays of shape (end - start, 3), (end - start,) and (end - start,).
+    """
+    motion = np.zeros((end - start, 3))
+    success = np.zeros(end - start, dtype=bool)
+    inliers = np.zeros(end - start, dtype=np.int32)
+
+    # Motion of the first chunk frame is relative to the frame before it, which the previous
+    # chunk of this process may have read last. Otherwise the chunk starts one frame earlier
+    path = config["input_video_path"]
+    prev = kept_frame(path, start) if start > 0 else None
+    if prev is not None:
+        capture = open_at(path, start)
+    else:
+        capture = open_at(path, max(start - 1, 0))
+        ret, prev = capture.read()
+        if not ret:
+            capture.release()
+            return motion, success, inliers
+    last_frame = prev
+
+    # Motion is estimated on frames reduced to the analysis width, if set and smaller than the frames
+    analysis_width = config["analysis_width"]
+    if analysis_width is not None and analysis_width >= prev.shape[1]:
+        analysis_width = None
+    input_scale = 1.0
+    if analysis_width is not None:
+        input_scale = analysis_width / prev.shape[1]
+        prev = reduce_frame(prev, "bgr", analysis_width)
+
+    estimator = create_motion_estimator(config, prev, input_scale=input_scale)
+    logger = Logger(config)
+
+    # The very first frame of the video has no motion
+    first = start
+    if start == 0:
+        success[0] = True
+        first = 1
+
+    position = first
+    for i in range(first, end):
+        ret, frame = capture.read()
+        if not ret:
+            break
+        position = i + 1
+        last_frame = frame
+        if analysis_width is not None:
+            frame = reduce_frame(frame, "bgr", analysis_width)
+        raw_motion = estimator.estimate(frame, logger)
+        if raw_motion is not None:
+            motion[i - start] = raw_motion
+            success[i - start] = True
+            inliers[i - start] = estimator.inlier_count
+
+    # The next chunk of this process continues from the capture, unless reading failed
+    if position == end:
+        keep_reader(path, capture, end, last_frame)
+    else:
+        capture.release()
+    estimator.close()
+    return motion, success, inliers
+
+
+def warp_chunk(config, start, corrections):
+    """
+    Warps, crops and composes frames [start, start + len(corrections)) of the input video.
+    Runs in a worker process.
+
+    Returns:
+        list: Output frames in order.
+    """
+    capture = open_at(config["input_video_path"], start)
+    fused_crop = config["crop_result"] and config["fused_warp_crop"]
+    interpolation = INTERPOLATIONS[config["warp_interpolation"]]
+    rotation_threshold = np.deg2rad(config["warp_rotation_threshold"])
+    scratch = None
+
+    results = []
+    for corrective_motion in corrections:
+        ret, frame = capture.read()
+        if not ret:
+            break
+        if rotation_threshold > 0 and scratch is None:
+            scratch = np.empty_like(frame)
+        if fused_crop:
+            # Render only the crop window
+            h, w = frame.shape[:2]
+            crop = crop_window(w, h, config["margin_x"], config["margin_y"])
+            result = warp_frame(frame, corrective_motion, crop, None, interpolation, rotation_threshold, scratch)
+        else:
+            result = warp_frame(frame, corrective_motion, None, None, interpolation, rotation_threshold, scratch)
+            result = utils.crop_stabilized_frame(config, result)
+        results.append(utils.compose_result(config, result, frame))
+
+    # The next batch of this process continues from the capture, unless reading failed
+    if len(results) == len(corrections):
+        keep_reader(config["input_video_path"], capture, start + len(results))
+    else:
+        capture.release()
+    return results
+
+
+def smooth_trajectory(config, trajectory):
+    """
+    Smooths the whole raw trajectory with the configured non-causal smoother.
+    """
+    if config["offline_smoother"] == "rts":
+        return rts_smooth(trajectory, config["kalman_Q"], config["kalman_R"])
+    return gaussian_smooth(trajectory, config["offline_smoothing_sigma"])
+
+
+def process_offline(config, plotter, logger):
+    """
+    Stabilizes a video file in two passes. Pass 1 estimates the motion of all frames
+    in parallel chunks, then the whole trajectory is smoothed at once. Pass 2 warps
+    the frames in parallel chunks, which are displayed and written in order.
+    Returns whether the display output is enabled.
+    """
+    capture = cv.VideoCapture(config["input_video_path"])
+    if not capture.isOpened():
+        raise IOError(f"Failed to open video file: {config['input_video_path']}")
+    frame_count = int(capture.get(cv.CAP_PROP_FRAME_COUNT))
+    w = int(capture.get(cv.CAP_PROP_FRAME_WIDTH))
+    h = int(capture.get(cv.CAP_PROP_FRAME_HEIGHT))
+    capture.release()
+
+    if frame_count <= 0:
+        raise IOError("Failed to determine the number of frames of the input video.")
+
+    workers = config["offline_workers"] or os.cpu_count()
+    chunk_size = config["offline_chunk_size"]
+    chunks = [(start, min(start + chunk_size, frame_count)) for start in range(0, frame_count, chunk_size)]
+
+    logger.log(f"Offline stabilization of {frame_count} frames using {workers} workers...")
+    if config["analysis_width"] is not None and config["analysis_width"] >= w:
+        logger.log(f"'analysis_width' {config['analysis_width']} is not smaller than the frame width {w}, "
+                   "motion is estimated on the full frame.", "WARN")
+
+    # The offline estimation ignores the estimation interval and the quality controller,
+    # its motion is that of a serial run without them
+    motion_cache = None
+    if config["motion_cache"]:
+        motion_cache = MotionCache(cache_path({**config, "estimation_interval": 1, "estimation_max_motion": None}))
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        if motion_cache is not None and motion_cache.is_loaded:
+            # Pass 1 was done by a previous run
+            motion, success, inliers = motion_cache.to_arrays(frame_count)
+            logger.log(f"Motion loaded from {motion_cache.path}, {np.count_nonzero(~success)} frame(s) failed.")
+        else:
+            # Pass 1: estimate the raw motion of every frame
+            futures = [executor.submit(estimate_chunk, config, start, end) for start, end in chunks]
+            results = [future.result() for future in futures]
+            motion = np.concatenate([result[0] for result in results])
+            success = np.concatenate([result[1] for result in results])
+            inliers = np.concatenate([result[2] for result in results])
+
+            logger.log(f"Motion estimated, {np.count_nonzero(~success)} frame(s) failed.")
+            if motion_cache is not None:
+                save_arrays(motion_cache.path, motion, success, inliers)
+                logger.log(f"Motion saved to {motion_cache.path}")
+
+        # Smooth the whole trajectory and compute the clamped corrections
+        raw = np.cumsum(motion, axis=0)
+        smooth = smooth_trajectory(config, raw)
+        limits = np.array([config["max_horizontal_shift"], config["max_vertical_shift"], np.deg2rad(config["max_rotation"])])
+        corrections = np.clip(smooth - raw, -limits, limits)
+
+        for i in range(frame_count):
+            plotter.collect((*raw[i], *smooth[i]))
+
+        # Pass 2: warp the frames in batches. Every warped frame is held by the parent until
+        # it is written, so batches are sized to keep all workers busy without more than
+        # the budget of frames in flight
+        budget = config["offline_max_frames_in_flight"]
+        batch_size = max(1, min(chunk_size, budget // workers))
+        max_pending = max(1, budget // batch_size)
+        batches = [(start, min(start + batch_size, frame_count)) for start in range(0, frame_count, batch_size)]
+
+        writer = utils.init_video_writer(config, (w, h))
+        is_display_on = config["display_output"]
+        pending = deque()
+        next_batch = 0
+
+        try:
+            while next_batch < len(batches) or pending:
+                while next_batch < len(batches) and len(pending) < max_pending:
+                    start, end = batches[next_batch]
+                    pending.append(executor.submit(warp_chunk, config, start, corrections[start:end]))
+                    next_batch += 1
+
+                for result in pending.popleft().result():
+                    # Display the frame if enabled
+                    if is_display_on:
+                        cv.imshow("Live", result)
+
+                    # Write the stabilized frame to the output video if enabled
+                    if writer is not None:
+                        writer.write(result)
+
+                    # Exit the loop if the user pressed the ESC key
+                    if utils.check_esc(is_display_on):
+                        for future in pending:
+                            future.cancel()
+                        return is_display_on
+        finally:
+            if writer is not None:
+                writer.release()
+
+    return is_display_on
@@ -0,0 +1,221 @@
+import queue
+import threading
+import time
+from collections import deque
+
+import utils
+
+# Marker passed down the queues once a stage has no more frames
+_END = object()
+
+
+class PipelineRunner:
+    def __init__(self, config, source, stabilizer, plotter, logger, writer):
+        """
+        Runs capture, motion estimation, warp/crop and display/encode as separate
+        stages connected by bounded queues.
+
+        Capture, estimation and output keep state between frames, so each of them
+        runs in a single thread. Warping is stateless and can use several threads;
+        the output stage restores the original frame order.
+
+        Args:
+            config (dict): Validated configuration.
+            source (FrameSource): Source of input frames.
+            stabilizer (Stabilizer): Stabilizer initialized with the first frame.
+            plotter (TrajectoryPlotter): Trajectory collector.
+            logger (Logger): Logger instance for messages and measurements.
+            writer (cv.VideoWriter or None): Output video writer.
+        """
+        self.config = config
+        self.source = source
+        self.stabilizer = stabilizer
+        self.plotter = plotter
+        self.logger = logger
+        self.writer = writer
+
+        self.warp_threads = config["pipeline_warp_threads"]
+        queue_size = config["pipeline_queue_size"]
+
+        # Bounded queues between the stages provide backpressure
+        self.captured = queue.Queue(maxsize=queue_size)
+        self.estimated = queue.Queue(maxsize=queue_size)
+        self.warped = queue.Queue(maxsize=queue_size)
+
+        # Capture timestamps of the frames in flight, appended by capture and taken by output in frame order
+        self.timestamps = deque()
+
+        # Set when the run should stop early (ESC pressed or a stage failed)
+        self.stop_event = threading.Event()
+        self.error = None
+
+    def run(self):
+        """
+        Processes all frames of the source.
+
+        Returns:
+            bool: Whether the display output is enabled.
+        """
+        threads = [threading.Thread(target=self._run_stage, args=(self._capture,), daemon=True),
+                   threading.Thread(target=self._run_stage, args=(self._estimate,), daemon=True)]
+        for _ in range(self.warp_threads):
+            threads.append(threading.Thread(target=self._run_stage, args=(self._warp,), daemon=True))
+
+        for thread in threads:
+            thread.start()
+
+        # Display must stay in the main thread
+        try:
+            is_display_on = self._output()
+        finally:
+            self.stop_event.set()
+            for thread in threads:
+                thread.join()
+
+        if self.error is not None:
+            raise self.error
+
+        return is_display_on
+
+    def _run_stage(self, stage):
+        # Stop the whole pipeline if any of the stages fails
+        try:
+            stage()
+        except Exception as e:
+            self.error = e
+            self.stop_event.set()
+
+    def _put(self, q, item):
+        # Block while the queue is full, but give up once the pipeline is stopping
+        while not self.stop_event.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, q):
+        # Block while the queue is empty, return None once the pipeline is stopping
+        while not self.stop_event.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return None
+
+    def _capture(self):
+        index = 0
+        while not self.stop_event.is_set():
+            with self.logger.measure("capture"):
+                frame = self.source.read()
+            if frame is None:
+                break
+            self.timestamps.append(self.source.timestamp)
+            if not self._put(self.captured, (index, frame, self.source.analysis)):
+                return
+            index += 1
+        self._put(self.captured, _END)
+
+    def _estimate(self):
+        while True:
+            item = self._get(self.captured)
+            if item is None or item is _END:
+                break
+            index, frame, analysis = item
+
+            # Estimation and smoothing depend on the previous frame, so they run in order.
+            # Being the sequential stage, it is what the quality controller has to keep in budget
+            start = time.perf_counter()
+            corrective_motion = self.stabilizer.estimate_correction(frame, analysis)
+            self.stabilizer.adapt(time.perf_counter() - start)
+            self.plotter.collect(self.stabilizer.export_trajectory_data())
+
+            if not self._put(self.estimated, (index, frame, corrective_motion)):
+                return
+
+        # Every warp worker needs its own end marker
+        for _ in range(self.warp_threads):
+            self._put(self.estimated, _END)
+
+    def _warp(self):
+        while True:
+            item = self._get(self.estimated)
+            if item is None or item is _END:
+                break
+            index, frame, corrective_motion = item
+
+            # Failed frames are resolved by the output stage, which knows the last result
+            result = None
+            if corrective_motion is not None:
+                result = self.stabilizer.warp(frame, corrective_motion)
+                if self.stabilizer.crop is None:
+                    with self.logger.measure("crop"):
+                        result = utils.crop_stabilized_frame(self.config, result)
+
+            if not self._put(self.warped, (index, frame, result)):
+                return
+        self._put(self.warped, _END)
+
+    def _output(self):
+        is_display_on = self.config["display_output"]
+
+        # Frame shown when motion estimation fails, same as Stabilizer.last_stable
+        last_result = self.stabilizer.last_stable
+        if self.stabilizer.crop is None:
+            last_result = utils.crop_stabilized_frame(self.config, last_result)
+
+        # Warp workers may finish out of order, keep results until their turn comes
+        pending = {}
+        next_index = 0
+        finished_workers = 0
+
+        while finished_workers < self.warp_threads:
+            item = self._get(self.warped)
+            if item is None:
+                break
+            if item is _END:
+                finished_workers += 1
+                continue
+
+            index, frame, result = item
+            pending[index] = (frame, result)
+
+            while next_index in pending:
+                frame, result = pending.pop(next_index)
+                next_index += 1
+
+                if result is None:
+                    result = last_result
+                last_result = result
+
+                # Optionally display the original and stabilized frame side by side
+                with self.logger.measure("display"):
+                    is_display_on, shown = utils.show_result(self.config, result, frame)
+                    is_esc = utils.check_esc(is_display_on)
+
+                # Write the stabilized frame to the output video if enabled
+                if self.writer is not None:
+                    with self.logger.measure("encode"):
+                        self.writer.write(shown)
+                self.logger.record_latency(self.timestamps.popleft())
+
+                # Periodically report how full the queues between stages are
+                if next_index % 100 == 0:
+                    self._log_queue_depth(len(pending))
+
+                # Exit the loop if the user pressed the ESC key
+                if is_esc:
+                    self.stop_event.set()
+                    return is_display_on
+
+        return is_display_on
+
+    def _log_queue_depth(self, reorder_depth):
+        maxsize = self.captured.maxsize
+        self.logger.log(
+            f"Queue depth | Capture: {self.captured.qsize()}/{maxsize} | "
+            f"Estimate: {self.estimated.qsize()}/{maxsize} | "
+            f"Warp: {self.warped.qsize()}/{maxsize} | Reorder: {reorder_depth}",
+            "MEASURMENT"
+        )
@@ -1,71 +1,195 @@
+from collections import deque
+
 import cv2 as cv
 
+from buffers import BufferPool
+from motion_cache import MotionCache, cache_path
 from stabilizer import Stabilizer
+from stabilizer.frame_format import frame_size
 from source import FrameSource
+from pipeline import PipelineRunner
 from visualizer import TrajectoryPlotter
 from logger import Logger
 import utils
 
 
-def main():
-    # Load and validate the configuration from a JSON file
-    config = utils.load_and_validate_config("config.json")
+def process_serial(config, source, stabilizer, plotter, logger, writer, pool):
+    """
+    Read, stabilize, display and write frames one by one in a single loop.
+    Frames are read and composed into buffers of the pool, allocated from the first frame.
+    With a smoothing lag, frames are read into the ring buffer of the stabilizer and output
+    lag frames later, the last ones once the source is exhausted.
+    Returns whether the display output is enabled.
+    """
+    is_display_on = config["display_output"]
+    frame_buffer = pool.buffers["frame"]
+    canvas = pool.buffers.get("canvas")
+
+    # Pool misses after the first processed frame, expected to be none
+    warm_misses = None
+
+    # Capture timestamps of the frames not output yet, several with a smoothing lag
+    timestamps = deque()
+
+    def output(result, raw, timestamp):
+        """
+        Crops, displays and writes a stabilized frame and records its latency since capture.
+        Returns whether ESC was pressed.
+        """
+        nonlocal is_display_on
+
+        # Collect trajectory data for plotting if nedded, redrawing the live plot from time to time
+        with logger.measure("plot"):
+            plotter.collect(stabilizer.export_trajectory_data())
+
+        # Optionally crop the stabilized frame, unless the stabilizer already warped into the crop
+        if stabilizer.crop is None:
+            with logger.measure("crop"):
+                result = utils.crop_stabilized_frame(config, result)
 
-    # Initialize the video/frame source (camera or video file)
-    source = FrameSource(config) 
+        # Optionally display the original and stabilized frame side by side
+        with logger.measure("display"):
+            is_display_on, result = utils.show_result(config, result, raw, canvas)
+            is_esc = utils.check_esc(is_display_on)
 
-    # Initialize the trajectory visualizer and logger
-    plotter = TrajectoryPlotter(config)
-    logger = Logger(config)
-    
-    # Initialize the stabilizer with the first frame
-    first_frame = source.read()
-    stabilizer = Stabilizer(config, first_frame, logger)
+        # Write the stabilized frame to the output video if enabled
+        if writer is not None:
+            with logger.measure("encode"):
+                writer.write(result)
 
-    # Prepare the video writer if needed
-    h, w = first_frame.shape[:2]
-    writer = utils.init_video_writer(config, (w, h))
+        logger.record_latency(timestamp)
+        return is_esc
 
     # Main loop for reading, stabilizing, and writing frames
     while True:
         # Read the next frame
-        curr = source.read()
+        with logger.measure("capture"):
+            curr = source.read(frame_buffer if stabilizer.lag == 0 else stabilizer.input_buffer())
         if curr is None:
+            # Output the frames still waiting for their look-ahead window
+            for result in stabilizer.flush():
+                if output(result, stabilizer.delayed_raw, timestamps.popleft()):
+                    break
             break
+        timestamps.append(source.timestamp)
         
         # Stabilize the current frame
-        result = stabilizer.stabilize(curr)
+        with logger.measure("stabilize"):
+            result = stabilizer.stabilize(curr, source.analysis)
 
-        # Collect trajectory data for plotting if nedded
-        plotter.collect(stabilizer.export_trajectory_data())
+        # No frame is output while the ring buffer of a smoothing lag fills
+        if result is None:
+            continue
 
-        # Optionally crop the stabilized frame
-        result = utils.crop_stabilized_frame(config, result)
+        is_esc = output(result, curr if stabilizer.lag == 0 else stabilizer.delayed_raw, timestamps.popleft())
 
-        # Optionally display the original and stabilized frame side by side
-        is_display_on, result = utils.show_result(config, result, curr)
-
-        # Write the stabilized frame to the output video if enabled
-        if writer is not None:
-            writer.write(result)
+        if warm_misses is None:
+            warm_misses = pool.misses
 
         # Exit the loop if the user pressed the ESC key
-        if utils.check_esc(is_display_on):
+        if is_esc:
             break
+
+    if warm_misses is not None:
+        logger.log(
+            f"Buffer pool: {pool.misses} miss(es), {pool.misses - warm_misses} after the first frame",
+            "MEASURMENT"
+        )
+    return is_display_on
+
+
+def process_stream(config, plotter, logger):
+    """
+    Stabilize frames from the configured source as they arrive.
+    Returns whether the display output is enabled.
+    """
+    # Initialize the video/frame source (camera or video file)
+    source = FrameSource(config) 
     
-    # Release the video source
-    source.release()
+    # Initialize the stabilizer with the first frame
+    first_frame = source.read()
+    if first_frame is None:
+        raise IOError("Failed to read the first frame.")
+    pool = BufferPool()
 
-    # Close display windows if needed
-    if is_display_on:
-        cv.destroyAllWindows()
+    # Replay the raw motion of a previous run with the same video and estimator settings,
+    # or record it for the next run
+    motion_cache = None
+    if config["motion_cache"]:
+        motion_cache = MotionCache(cache_path(config))
+        if motion_cache.is_loaded:
+            logger.log(f"Replaying the motion of {len(motion_cache.records)} frames from {motion_cache.path}")
+
+    stabilizer = Stabilizer(config, first_frame, logger, pool, motion_cache, source.analysis)
+
+    # Prepare the video writer if needed
+    w, h = frame_size(first_frame, config["frame_format"])
+    writer = utils.init_video_writer(config, (w, h))
+
+    # Process frames either in one loop or in a multi-threaded pipeline
+    if config["processing_mode"] == "pipeline":
+        runner = PipelineRunner(config, source, stabilizer, plotter, logger, writer)
+        is_display_on = runner.run()
+    else:
+        # Buffers of the serial loop, sized from the first frame
+        pool.like("frame", first_frame)
+        if config["show_combined"]:
+            pool.get("canvas", (h, 2 * w) + stabilizer.last_stable.shape[2:], first_frame.dtype)
+        is_display_on = process_serial(config, source, stabilizer, plotter, logger, writer, pool)
+    
+    # Frames the grabber replaced by newer ones while the stabilizer was busy
+    if source.grabber is not None:
+        logger.log(f"Camera grabber dropped {source.dropped} frame(s) to stay on the newest one.", "MEASURMENT")
+
+    # Save the recorded motion only if the whole video was read and every frame read was estimated.
+    # A pipeline stopped early may have read the end of the video without estimating the last frames
+    if (motion_cache is not None and not motion_cache.is_loaded and source.ended
+            and len(motion_cache.recorded) == source.frames_read):
+        motion_cache.save()
+        logger.log(f"Motion of {len(motion_cache.recorded)} frames saved to {motion_cache.path}")
+
+    # Release the video source and the threads of the stabilizer
+    source.release()
+    stabilizer.close()
 
     # Release the video writer if it was initialized
     if writer is not None:
         writer.release()
 
-    # Save log data to file
-    logger.save_log()
+    return is_display_on
+
+
+def main():
+    # Load and validate the configuration from a JSON file
+    config = utils.load_and_validate_config("config.json")
+
+    # Limit the number of threads OpenCV uses internally if requested
+    if config["opencv_threads"] is not None:
+        cv.setNumThreads(config["opencv_threads"])
+
+    # Initialize the trajectory visualizer and logger
+    plotter = TrajectoryPlotter(config)
+    logger = Logger(config)
+
+    # The process pool modes are imported only when selected, which keeps startup short
+    if config["processing_mode"] == "offline":
+        # Stabilize the whole video file in two parallel passes
+        from offline import process_offline
+        is_display_on = process_offline(config, plotter, logger)
+    elif config["processing_mode"] == "multistream":
+        # Stabilize every configured stream in its own worker process
+        from multistream import process_multistream
+        is_display_on = process_multistream(config, logger)
+    else:
+        is_display_on = process_stream(config, plotter, logger)
+
+    # Close display windows if needed
+    if is_display_on:
+        cv.destroyAllWindows()
+
+    # Write the last metrics and save log data to file
+    logger.close()
+    plotter.close()
 
     # Show the estimated trajectory plot after processing
     plotter.display()
@@ -1,72 +1,401 @@
-import cv2 as cv
+import importlib.util
+import threading
 import time
+
+import cv2 as cv
+import numpy as np
+
+from npy_stream import NpyStreamWriter
 from utils import IS_WINDOWS
 
-# Import Picamera2 only if not running on Windows
-if not IS_WINDOWS:
-    from picamera2 import Picamera2
-else:
-    Picamera2 = None
 
-class FrameSource:
+class OpenCVFileSource:
     def __init__(self, config):
-        self.capture = None
-        self.picam2 = None
-
-        # Select the source of frames: video file or live camera
-        if config["source_of_frames"] == "video":
-            video_path = config["input_video_path"]
-            self.capture = cv.VideoCapture(video_path)
-            if not self.capture.isOpened():
-                raise IOError(f"Failed to open video file: {video_path}")
-
-        elif config["source_of_frames"] == "camera":
-            # Use OpenCV VideoCapture on Windows
-            if IS_WINDOWS:
-                self.capture = cv.VideoCapture(0)
-                if not self.capture.isOpened():
-                    raise IOError("Failed to open camera using OpenCV")
-            # Use Picamera2 on non-Windows platforms (e.g., Raspberry Pi)
-            else:
-                try:
-                    self.picam2 = Picamera2()
-                    video_config = self.picam2.create_video_configuration(
-                        main={
-                            "size": tuple(config["picamera2_resolution"]),
-                            "format": "RGB888",
-                        },
-                        controls={"FrameRate": config["picamera2_fps"]},
-                    )
-                    self.picam2.configure(video_config)
-                    self.picam2.start()
-                    time.sleep(1) # Allow camera to warm up
-                except Exception as e:
-                    raise RuntimeError(f"Failed to initialize Picamera2: {e}")
-        else:
-            raise ValueError(f"Unknown input source: {config['source_of_frames']}")
-
-    def read(self):
-        # Read frame from OpenCV VideoCapture
-        if self.capture:
-            ret, frame = self.capture.read()
-            if not ret:
-                print("Failed to read frame")
+        # Read frames from a video file
+        video_path = config["input_video_path"]
+        self.capture = cv.VideoCapture(video_path)
+        if not self.capture.isOpened():
+            raise IOError(f"Failed to open video file: {video_path}")
+
+    def read(self, out=None):
+        # Read frame from OpenCV VideoCapture, into the given buffer if any
+        ret, frame = self.capture.read(image=out)
+        if not ret:
+            print("Failed to read frame")
+            return None
+        return frame
+
+    def release(self):
+        self.capture.release()
+
+
+class OpenCVDeviceSource(OpenCVFileSource):
+    def __init__(self, config):
+        # Read frames from a camera through OpenCV
+        self.capture = cv.VideoCapture(config["camera_index"])
+        if not self.capture.isOpened():
+            raise IOError("Failed to open camera using OpenCV")
+
+
+class Picamera2Source:
+    def __init__(self, config):
+        # Imported here so Picamera2 is only needed when this backend is selected
+        try:
+            from picamera2 import Picamera2
+        except ImportError as e:
+            raise RuntimeError(f"Picamera2 is not available, set 'camera_backend' to 'opencv' to use another camera: {e}")
+
+        # With YUV420 the ISP skips the RGB conversion, the Y plane is the luma the motion
+        # estimation needs and only the warp converts to BGR
+        frame_format = "YUV420" if config["frame_format"] == "yuv420" else "RGB888"
+
+        # With an analysis width, the ISP also scales the frames down to a second "lores" stream
+        # of the same field of view, whose Y plane the motion is estimated on
+        lores = None
+        if config["analysis_width"] is not None:
+            w, h = config["picamera2_resolution"]
+            analysis_w = config["analysis_width"]
+            lores = {"size": (analysis_w, 2 * round(analysis_w * h / w / 2)), "format": "YUV420"}
+
+        # Y plane of the lores stream of the last frame, None without it
+        self.analysis = None
+
+        try:
+            self.picam2 = Picamera2()
+            video_config = self.picam2.create_video_configuration(
+                main={
+                    "size": tuple(config["picamera2_resolution"]),
+                    "format": frame_format,
+                },
+                lores=lores,
+                controls={"FrameRate": config["picamera2_fps"]},
+            )
+            # Planar frames must have rows without padding to be viewed as one I420 array
+            if frame_format == "YUV420" or lores is not None:
+                self.picam2.align_configuration(video_config)
+            self.picam2.configure(video_config)
+            self.lores_size = video_config["lores"]["size"] if lores is not None else None
+            self.picam2.start()
+            time.sleep(1) # Allow camera to warm up
+        except Exception as e:
+            raise RuntimeError(f"Failed to initialize Picamera2: {e}")
+
+    def read(self, out=None):
+        # Read a frame from Picamera2, with the lores frame of the same request if configured
+        try:
+            if self.lores_size is None:
+                return self.picam2.capture_array()
+            (frame, lores), _ = self.picam2.capture_arrays(["main", "lores"])
+            w, h = self.lores_size
+            self.analysis = lores[:h, :w]
             return frame
-        # Read a frame from Picamera2
-        elif self.picam2:
-            try:
-                frame = self.picam2.capture_array()
-                return frame
-            except Exception as e:
-                print(f"Error capturing frame from Picamera2: {e}")
-                return None
+        except Exception as e:
+            print(f"Error capturing frame from Picamera2: {e}")
+            return None
+
+    def release(self):
+        self.picam2.stop()
+
+
+class SyntheticSource:
+    def __init__(self, config):
+        # Shaky clip with known motion rendered on the fly, no camera or file needed
+        from benchmarks.synthetic import SyntheticClip
+
+        self.clip = SyntheticClip(tuple(config["synthetic_resolution"]), config["synthetic_frame_count"])
+        self.index = 0
+
+        # With a frame rate, frames are captured on a fixed schedule like a camera,
+        # and frames not read in time are queued like in a camera driver
+        self.fps = config["synthetic_fps"]
+        self.start = None
+        self.timestamp = None
+
+    def read(self, out=None):
+        if self.index >= len(self.clip):
+            return None
+
+        if self.fps is not None:
+            now = time.perf_counter()
+            if self.start is None:
+                self.start = now
+            self.timestamp = self.start + self.index / self.fps
+            if self.timestamp > now:
+                time.sleep(self.timestamp - now)
+
+        frame = self.clip.frame(self.index, out)
+        self.index += 1
+        return frame
+
+    def release(self):
+        pass
+
+
+class RawReplaySource:
+    def __init__(self, config):
+        # Frames recorded with 'record_raw_to', memory-mapped so nothing is decoded or copied
+        path = config["input_raw_path"]
+        self.records = np.load(path, mmap_mode="r")
+        if self.records.dtype.names != ("timestamp", "frame"):
+            raise IOError(f"Not a raw frame recording: {path}")
+        self.frames = self.records["frame"]
+        self.index = 0
+
+        # The recording must hold frames of the configured format, I420 frames are single-channel
+        # arrays 1.5 times as high as the picture
+        shape = self.frames.shape[1:]
+        if config["frame_format"] == "yuv420":
+            valid = len(shape) == 2 and shape[0] % 3 == 0 and shape[1] % 2 == 0
         else:
-            print("Video source is not initialized.")
+            valid = len(shape) == 3 and shape[2] == 3
+        if not valid:
+            raise ValueError(f"Frames of shape {shape} in {path} do not match 'frame_format' = '{config['frame_format']}'.")
+
+    def read(self, out=None):
+        # Returns a read-only view of the frame in the file, out is not needed
+        if self.index >= len(self.records):
             return None
+        frame = self.frames[self.index]
+        self.index += 1
+        return frame
+
+    def release(self):
+        self.records = self.frames = None
+
+
+class RawRecorder:
+    def __init__(self, path):
+        """
+        Records frames with their capture timestamps to a .npy file of fixed-size records,
+        replayed by RawReplaySource. The shape and type of the first frame apply to all.
+
+        Args:
+            path (str): Path of the recording.
+        """
+        self.path = path
+        self.writer = None
+
+    def write(self, frame, timestamp):
+        if self.writer is None:
+            dtype = np.dtype([("timestamp", "<f8"), ("frame", frame.dtype, frame.shape)])
+            self.writer = NpyStreamWriter(self.path, dtype)
+            self.frame_dtype = dtype["frame"]
+        elif frame.shape != self.frame_dtype.shape or frame.dtype != self.frame_dtype.base:
+            raise ValueError(f"Frame of shape {frame.shape} does not match the recording of shape {self.frame_dtype.shape}.")
+
+        self.writer.write_bytes(np.float64(timestamp).tobytes() + np.ascontiguousarray(frame).tobytes())
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+# Source backends by name. A backend imports its dependencies only when it is created,
+# so only the selected one has to be installed
+SOURCE_BACKENDS = {
+    "opencv_file": OpenCVFileSource,
+    "opencv_device": OpenCVDeviceSource,
+    "picamera2": Picamera2Source,
+    "synthetic": SyntheticSource,
+    "raw": RawReplaySource,
+}
+
+
+def register_source(name, backend):
+    """
+    Adds a source backend. It is created with the configuration and must provide
+    read(out=None), returning a frame or None, and release().
+    """
+    SOURCE_BACKENDS[name] = backend
+
+
+def source_backend(config):
+    """
+    Returns the name of the source backend selected by the configuration.
+    """
+    source = config["source_of_frames"]
+    if source == "video":
+        return "opencv_file"
+    if source == "camera":
+        backend = config["camera_backend"]
+        if backend == "auto":
+            # Picamera2 where it is installed, which is checked without importing it
+            use_picamera2 = not IS_WINDOWS and importlib.util.find_spec("picamera2") is not None
+            return "picamera2" if use_picamera2 else "opencv_device"
+        return "picamera2" if backend == "picamera2" else "opencv_device"
+    return source
+
+
+def capture_time(backend):
+    """
+    Capture time of the frame a backend just read. Backends knowing it better than
+    the time read() returned, e.g. from a queue, provide it as a 'timestamp' attribute.
+    """
+    timestamp = getattr(backend, "timestamp", None)
+    return timestamp if timestamp is not None else time.perf_counter()
+
+
+class LatestFrameGrabber:
+    def __init__(self, backend):
+        """
+        Reads frames from a live source on a background thread into a triple buffer,
+        so the camera never waits for processing and read() returns the newest frame.
+        Frames replaced before they were read are counted as dropped.
+
+        Args:
+            backend: Source backend providing read(out=None).
+        """
+        self.backend = backend
+        self.slots = [None, None, None]
+        self.timestamps = [0.0, 0.0, 0.0]
+        self.analyses = [None, None, None]
+
+        # Analysis frame of the last frame read, if the backend provides them
+        self.analysis = None
+
+        # Slot being written by the grabber, newest complete frame and slot being read.
+        # The indices are swapped under the lock, the frames themselves are never shared
+        self.write_slot, self.latest_slot, self.read_slot = 0, 1, 2
+        self.fresh = False
+        self.ended = False
+        self.stopped = False
+        self.error = None
+        self.dropped = 0
+        self.condition = threading.Condition()
+
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        try:
+            self.grab()
+        except Exception as e:
+            # Handed to the consumer, which would otherwise wait for a frame forever
+            self.error = e
+        finally:
+            with self.condition:
+                self.ended = True
+                self.condition.notify()
+
+    def grab(self):
+        while not self.stopped:
+            frame = self.backend.read(self.slots[self.write_slot])
+            timestamp = capture_time(self.backend)
+            analysis = getattr(self.backend, "analysis", None)
+
+            with self.condition:
+                if frame is None:
+                    return
+
+                # Publish the frame, replacing the newest one if it was not read
+                self.slots[self.write_slot] = frame
+                self.timestamps[self.write_slot] = timestamp
+                self.analyses[self.write_slot] = analysis
+                self.write_slot, self.latest_slot = self.latest_slot, self.write_slot
+                if self.fresh:
+                    self.dropped += 1
+                self.fresh = True
+                self.condition.notify()
+
+    def read(self, out=None):
+        """
+        Waits for a frame newer than the last one read and copies it into out.
+
+        Returns:
+            tuple: (frame, capture timestamp from time.perf_counter()), or (None, None)
+            once the source has no more frames.
+
+        Raises:
+            RuntimeError: If reading from the backend failed.
+        """
+        with self.condition:
+            while not self.fresh and not self.ended:
+                self.condition.wait()
+            if not self.fresh:
+                if self.error is not None:
+                    raise RuntimeError(f"Frame grabber stopped: {self.error}") from self.error
+                return None, None
+            self.read_slot, self.latest_slot = self.latest_slot, self.read_slot
+            self.fresh = False
+            frame = self.slots[self.read_slot]
+            timestamp = self.timestamps[self.read_slot]
+            analysis = self.analyses[self.read_slot]
+
+        # The grabber does not write the read slot until the next read, so it is copied
+        # outside the lock. The copy lets callers keep the frame as long as they need
+        self.analysis = analysis.copy() if analysis is not None else None
+        if out is None:
+            return frame.copy(), timestamp
+        np.copyto(out, frame)
+        return out, timestamp
+
+    def release(self):
+        # The backend is released only once the thread is done with it. Reads return
+        # within a frame period, after which the thread sees the stop flag
+        self.stopped = True
+        self.thread.join()
+        self.backend.release()
+
+
+class FrameSource:
+    def __init__(self, config):
+        # Select the source of frames: video file, live camera or synthetic clip
+        name = source_backend(config)
+        backend = SOURCE_BACKENDS.get(name)
+        if backend is None:
+            raise ValueError(f"Unknown input source: {name}")
+        self.backend = backend(config)
+
+        # Optionally capture live frames on a background thread, always handing out the newest
+        self.grabber = None
+        if config["camera_grabber"]:
+            self.grabber = LatestFrameGrabber(self.backend)
+
+        # Set once the source has no more frames, i.e. at the end of a video file
+        self.ended = False
+
+        # Number of frames read so far, the first one included
+        self.frames_read = 0
+
+        # Capture time of the last frame read, from time.perf_counter()
+        self.timestamp = None
+
+        # Low-resolution grayscale version of the last frame read if the backend provides one,
+        # e.g. a hardware-scaled camera stream. Otherwise the stabilizer reduces the frame itself
+        self.analysis = None
+
+        # Optionally record every frame read, for replaying it without decoding
+        self.recorder = None
+        if config["record_raw_to"] is not None:
+            self.recorder = RawRecorder(config["record_raw_to"])
+
+    @property
+    def dropped(self):
+        """Number of frames the grabber replaced by newer ones before they were read."""
+        return self.grabber.dropped if self.grabber is not None else 0
+
+    def read(self, out=None):
+        # Read the next frame, into the given buffer if the backend supports it
+        if self.grabber is not None:
+            frame, self.timestamp = self.grabber.read(out)
+            self.analysis = self.grabber.analysis
+        else:
+            frame = self.backend.read(out)
+            self.timestamp = capture_time(self.backend)
+            self.analysis = getattr(self.backend, "analysis", None)
+        if frame is None:
+            self.ended = True
+            return None
+        self.frames_read += 1
+        if self.recorder is not None:
+            self.recorder.write(frame, self.timestamp)
+        return frame
 
     def release(self):
         # Release resources
-        if self.capture:
-            self.capture.release()
-        if self.picam2:
-            self.picam2.stop()
+        if self.recorder is not None:
+            self.recorder.close()
+        if self.grabber is not None:
+            self.grabber.release()
+        else:
+            self.backend.release()
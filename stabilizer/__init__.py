@@ -1,23 +1,71 @@
+import time
 import numpy as np
 from .estimator import MotionEstimator
-from .smoother import MotionFilter
-from .transform import warp_frame
+from .tracker import KLTMotionEstimator
+from .frame_features import TiledORB
+from .matcher import create_matcher
+from .smoother import MotionFilter, FixedLagSmoother
+from .quality import QualityController
+from .transform import INTERPOLATIONS, crop_window, warp_frame
+from .frame_format import frame_size, luma, reduce_frame, to_bgr
+from .frame_features import analysis_size
+from buffers import BufferPool
+
+
+def create_motion_estimator(config, first_frame, pool=None, input_scale=1.0):
+    """
+    Creates the motion estimator selected by 'motion_estimation_method' in the configuration.
+
+    Args:
+        config (dict): Dictionary containing stabilization parameters.
+        first_frame (ndarray): The initial video frame used for feature tracking.
+        pool (BufferPool or None): Pool of the reused analysis buffers.
+        input_scale (float): Size of the analysed frames relative to the output frames.
+
+    Returns:
+        MotionEstimator: ORB matching or KLT tracking motion estimator.
+    """
+    resize_ratio = config["resize_ratio"] # Downscale factor for processing speed
+    static_scene_threshold = config["static_scene_threshold"] # Threshold for skipping static scenes
+    max_feature_count = config["max_feature_count"]
+
+    if config["motion_estimation_method"] == "klt":
+        min_track_count = config["klt_min_track_count"] # Re-detect corners below this number of tracks
+        return KLTMotionEstimator(first_frame, resize_ratio, static_scene_threshold, max_feature_count, min_track_count, pool,
+                                  input_scale)
+
+    # Optionally detect ORB features tile by tile in parallel threads
+    detector = None
+    if config["feature_grid"] is not None:
+        detector = TiledORB(max_feature_count, config["feature_grid"], config["feature_grid_overlap"], config["feature_threads"])
+
+    # Optionally match against a keyframe kept while it is matched and visible well enough
+    keyframe = None
+    if config["keyframe_mode"]:
+        keyframe = (config["keyframe_min_inliers"], config["keyframe_min_overlap"])
+
+    matcher = create_matcher(config["matcher"], config["match_ratio"])
+    return MotionEstimator(first_frame, resize_ratio, static_scene_threshold, max_feature_count, pool, detector,
+                           matcher, config["max_match_count"], keyframe, input_scale)
 
 
 class Stabilizer:
-    def __init__(self, config, first_frame, logger):
+    def __init__(self, config, first_frame, logger, pool=None, motion_cache=None, analysis=None):
         """
         Initialize the video stabilizer with configuration parameters, the first frame,
         and a logger instance.
 
         Args:
             config (dict): Dictionary containing stabilization parameters.
-            first_frame (ndarray): The initial video frame used for feature tracking.
+            first_frame (ndarray): The initial video frame used for feature tracking, in the
+                configured frame_format.
             logger (Logger): Logger instance for messages and measurements.
+            pool (BufferPool or None): Pool of the buffers reused from frame to frame.
+            motion_cache (MotionCache or None): Raw motion replayed instead of being estimated
+                if it is loaded, otherwise recorded.
+            analysis (ndarray or None): Low-resolution grayscale version of the first frame
+                provided by the source, which the motion is then estimated on.
         """
-        resize_ratio = config["resize_ratio"] # Downscale factor for processing speed
-        static_scene_threshold = config["static_scene_threshold"] # Threshold for skipping static scenes
-        max_feature_count = config["max_feature_count"]
         max_x = config["max_horizontal_shift"] # Max allowed horizontal correction in pixels
         max_y = config["max_vertical_shift"] # Max allowed vertical correction in pixels
         max_r = np.deg2rad(config["max_rotation"]) # Max allowed rotation in radians
@@ -25,51 +73,365 @@ class Stabilizer:
         R = config["kalman_R"]
 
         self.logger = logger
+        self.pool = pool if pool is not None else BufferPool()
+
+        # Frames are estimated on their luma and converted to BGR only to be warped
+        self.frame_format = config["frame_format"]
+        first_bgr = to_bgr(first_frame, self.frame_format)
+        self.bgr = self.pool.like("bgr", first_bgr) if first_bgr is not first_frame else None
+
+        # Motion is estimated on a low-resolution analysis frame, from the source if it has one
+        # (e.g. a hardware-scaled camera stream), otherwise reduced to 'analysis_width' here.
+        # Estimated translations are scaled back to the frame
+        w, h = frame_size(first_frame, self.frame_format)
+        self.analysis_width = config["analysis_width"]
+        if self.analysis_width is not None and self.analysis_width >= w:
+            self.logger.log(f"'analysis_width' {self.analysis_width} is not smaller than the frame width {w}, "
+                            "motion is estimated on the full frame.", "WARN")
+            self.analysis_width = None
+        if analysis is None:
+            analysis = self.analysis_frame(first_frame)
 
         # Initialize motion estimator
-        self.motion_estimator = MotionEstimator(first_frame, resize_ratio, static_scene_threshold, max_feature_count)
+        self.motion_estimator = create_motion_estimator(config, analysis, self.pool, analysis.shape[1] / w)
+        self.motion_cache = motion_cache
         
         # Initialize the Kalman filter-based motion smoother
-        self.motion_filter = MotionFilter(Q, R, max_x, max_y, max_r)
+        self.motion_filter = MotionFilter(Q, R, max_x, max_y, max_r, config["smoother_backend"])
         
+        # With fused cropping, frames are warped directly into the crop window
+        self.crop = None
+        if config["crop_result"] and config["fused_warp_crop"]:
+            self.crop = crop_window(w, h, config["margin_x"], config["margin_y"])
+
+        # Interpolation of the warp, corrections rotating less than the threshold are applied as a shift
+        self.interpolation = INTERPOLATIONS[config["warp_interpolation"]]
+        self.rotation_threshold = np.deg2rad(config["warp_rotation_threshold"])
+        self.warp_scratch = self.pool.like("warp_scratch", first_bgr) if self.rotation_threshold > 0 else None
+
+        # Preallocated output of stabilize()
+        if self.crop is not None:
+            self.output = self.pool.get("stabilized", (self.crop[3], self.crop[2]) + first_bgr.shape[2:])
+        else:
+            self.output = self.pool.like("stabilized", first_bgr)
+
         # Store last successfully stabilized frame
-        self.last_stable = first_frame
+        self.last_stable = first_bgr
+        if self.crop is not None:
+            x, y, crop_w, crop_h = self.crop
+            self.last_stable = first_bgr[y:y+crop_h, x:x+crop_w].copy()
+
+        # Raw motion of the last frame, None if its estimation failed
+        self.last_raw_motion = None
+
+        # Motion is estimated on every estimation_interval-th frame, or more often if it is fast.
+        # The frames in between are assumed to move at the last measured rate
+        self.estimation_interval = config["estimation_interval"]
+        self.estimation_max_motion = config["estimation_max_motion"]
+        self.interval = self.estimation_interval
+        self.frames_since_estimate = 0
+        self.motion_rate = np.zeros(3)
+        self.extrapolated = np.zeros(3)
+        self.frame_extent = max(h, w) / 2
+
+        # With a smoothing lag, frames wait in a ring buffer until the lag frames after them
+        # are known, then they are smoothed with a centered window and output
+        self.lag = config["smoothing_lag"]
+        if self.lag > 0:
+            self.lag_smoother = FixedLagSmoother(self.lag, max_x, max_y, max_r)
+            self.lag_smoother.add(None)
+            self.ring = [self.pool.like(f"lag_frame{i}", first_frame) for i in range(self.lag + 1)]
+            self.ring_failed = [False] * (self.lag + 1)
+            self.frame_index = 0
+            self.delayed_raw = None
+
+        # Optionally trade estimation precision for speed to hold the target frame rate
+        self.quality = None
+        if config["target_fps"] is not None:
+            self.quality = QualityController(config["target_fps"], config["resize_ratio"], config["max_feature_count"])
         
         self.logger.log("Starting video stabilization...")
 
-    def stabilize(self, curr):
+    def stabilize(self, curr, analysis=None):
         """
         Stabilizes the current frame by estimating and correcting its motion.
 
         Args:
             curr (ndarray): Current video frame to be stabilized.
+            analysis (ndarray or None): Analysis frame of the current frame from the source,
+                reduced from the frame if None.
+
+        Returns:
+            ndarray: The stabilized frame. With a smoothing lag, the stabilized frame
+            lag frames back, or None while the ring buffer fills.
+        """
+        if self.lag > 0:
+            return self.stabilize_delayed(curr, analysis)
+
+        start = time.perf_counter()
+
+        # Compute correction needed to stabilize the frame
+        corrective_motion = self.estimate_correction(curr, analysis)
+
+        # If motion estimation fails, return the last stabilized frame
+        if corrective_motion is not None:
+            # Apply transformation to stabilize the frame into the preallocated output
+            self.last_stable = self.warp(curr, corrective_motion, self.output, self.warp_scratch, self.bgr)
+
+        self.adapt(time.perf_counter() - start)
+        return self.last_stable
+
+    def input_buffer(self):
+        """
+        Returns the ring buffer slot of the next frame with a smoothing lag. Frames
+        read into it directly are not copied by stabilize().
+        """
+        return self.ring[(self.frame_index + 1) % len(self.ring)]
+
+    def stabilize_delayed(self, curr, analysis=None):
+        """
+        Estimates the motion of the current frame, stores it in the ring buffer and
+        outputs the frame whose look-ahead window it completes.
+
+        Args:
+            curr (ndarray): Current video frame to be stabilized.
+            analysis (ndarray or None): Analysis frame of the current frame from the source,
+                reduced from the frame if None.
+
+        Returns:
+            ndarray or None: The stabilized frame lag frames back, or None while the ring buffer fills.
+        """
+        start = time.perf_counter()
+
+        self.frame_index += 1
+        slot = self.frame_index % len(self.ring)
+        frame = self.ring[slot]
+        if curr is not frame:
+            np.copyto(frame, curr)
+
+        raw_motion = self.measure_motion(frame, analysis)
+        self.last_raw_motion = raw_motion
+        self.logger.update_status(raw_motion is not None)
+
+        self.lag_smoother.add(raw_motion)
+        self.ring_failed[slot] = raw_motion is None
+
+        result = None
+        if self.frame_index > self.lag:
+            result = self.render_delayed(self.frame_index - self.lag)
+
+        self.adapt(time.perf_counter() - start)
+        return result
+
+    def flush(self):
+        """
+        Outputs the frames still held in the ring buffer at the end of the stream,
+        smoothed with the frames that follow them.
+
+        Yields:
+            ndarray: The remaining stabilized frames in order.
+        """
+        if self.lag == 0:
+            return
+        for index in range(max(self.frame_index - self.lag + 1, 1), self.frame_index + 1):
+            yield self.render_delayed(index)
+
+    def render_delayed(self, index):
+        """
+        Smooths and warps a frame of the ring buffer. Frames whose motion estimation
+        failed are replaced by the last stabilized frame.
+
+        Args:
+            index (int): Frame number, at most lag frames before the current frame.
 
         Returns:
             ndarray: The stabilized frame.
         """
+        slot = index % len(self.ring)
+        self.delayed_raw = self.ring[slot]
+
+        with self.logger.measure("smoothing"):
+            corrective_motion = self.lag_smoother.compute_correction(index)
+
+        if not self.ring_failed[slot]:
+            self.last_stable = self.warp(self.delayed_raw, corrective_motion, self.output, self.warp_scratch, self.bgr)
+        return self.last_stable
+
+    def estimate_correction(self, curr, analysis=None):
+        """
+        Estimates the motion of the current frame and updates the smoothed trajectory.
+        Must be called once per frame, in frame order.
+
+        Args:
+            curr (ndarray): Current video frame.
+            analysis (ndarray or None): Analysis frame of the current frame from the source,
+                reduced from the frame if None.
+
+        Returns:
+            tuple or None: Corrective motion (dx, dy, dr) or None if estimation failed.
+        """
         # Estimate raw motion between previous and current frame
-        raw_motion = self.motion_estimator.estimate(curr, self.logger)
+        raw_motion = self.measure_motion(curr, analysis)
+        self.last_raw_motion = raw_motion
+
+        # Log frame success/failure for stats
+        self.logger.update_status(raw_motion is not None)
 
-        # If motion estimation fails, return the last stabilized frame
         if raw_motion is None:
-            return self.last_stable
-        
+            return None
+
         # Update motion history and apply smoothing
-        self.motion_filter.cumulate(raw_motion)
-        self.motion_filter.smooth()
+        with self.logger.measure("smoothing"):
+            self.motion_filter.cumulate(raw_motion)
+            self.motion_filter.smooth()
+            corrective_motion = self.motion_filter.compute_correction()
 
-        # Compute correction needed to stabilize the frame
-        corrective_motion = self.motion_filter.compute_correction()
-        
-        # Apply transformation to stabilize the frame
-        stabilized_frame = warp_frame(curr, corrective_motion)
-        self.last_stable = stabilized_frame
+        return corrective_motion
 
-        # Log frame success/failure for stats
-        self.logger.update_status(raw_motion != None)
+    def measure_motion(self, curr, analysis=None):
+        """
+        Returns the motion of the current frame from the motion cache if it is loaded,
+        otherwise estimates it and records it in the cache, if any.
+
+        Args:
+            curr (ndarray): Current video frame.
+            analysis (ndarray or None): Analysis frame of the current frame from the source,
+                reduced from the frame if None.
+
+        Returns:
+            tuple or None: (dx, dy, dr) motion or None if estimation failed.
+        """
+        if self.motion_cache is not None and self.motion_cache.is_loaded:
+            return self.motion_cache.replay()
+
+        if analysis is None:
+            analysis = self.analysis_frame(curr)
+        motion = self.estimate_motion(analysis)
+        if self.motion_cache is not None:
+            # Extrapolated frames have no inliers of their own
+            inlier_count = self.motion_estimator.inlier_count if self.frames_since_estimate == 0 else 0
+            self.motion_cache.record(motion, inlier_count)
+        return motion
+
+    def analysis_frame(self, frame):
+        """
+        Returns the image the motion of a frame is estimated on when the source provides
+        none: its luma, reduced to 'analysis_width' if set. The reduced frame is written
+        into a buffer reused for the next frame, the estimator copies what it keeps.
+
+        Args:
+            frame (ndarray): Video frame in the configured frame format.
+
+        Returns:
+            ndarray: Luma or BGR frame, or the grayscale analysis frame.
+        """
+        if self.analysis_width is None:
+            return luma(frame, self.frame_format)
+
+        w, h = frame_size(frame, self.frame_format)
+        gray = self.pool.get("analysis_full", (h, w)) if frame.ndim == 3 else None
+        out = self.pool.get("analysis_frame", analysis_size((h, w), self.analysis_width / w))
+        with self.logger.measure("reduce"):
+            return reduce_frame(frame, self.frame_format, self.analysis_width, gray, out)
+
+    def estimate_motion(self, curr):
+        """
+        Runs the motion estimator on the frames selected by the estimation interval and
+        extrapolates the motion of the frames in between. The motion of an estimated frame
+        is what the estimate adds to the motion already extrapolated since the previous one,
+        so the cumulated trajectory matches the estimates.
+
+        Args:
+            curr (ndarray): Analysis frame, luma or BGR version of the current video frame.
+
+        Returns:
+            tuple or None: (dx, dy, dr) motion or None if estimation failed.
+        """
+        if self.estimation_interval == 1:
+            return self.motion_estimator.estimate(curr, self.logger)
+
+        self.frames_since_estimate += 1
+        if self.frames_since_estimate < self.interval:
+            self.extrapolated += self.motion_rate
+            return tuple(self.motion_rate)
+
+        # The estimator still references the last estimated frame, so the motion covers all frames since
+        raw_motion = self.motion_estimator.estimate(curr, self.logger)
+        frames = self.frames_since_estimate
+        self.frames_since_estimate = 0
+
+        if raw_motion is None:
+            # The estimator starts again from this frame, nothing is known about the rate
+            self.motion_rate[:] = 0
+            self.extrapolated[:] = 0
+            return None
+
+        motion = tuple(np.subtract(raw_motion, self.extrapolated))
+        np.divide(raw_motion, frames, out=self.motion_rate)
+        self.extrapolated[:] = 0
+
+        # Estimate more often when the motion over the interval would grow too large
+        if self.estimation_max_motion is not None:
+            dx, dy, dr = self.motion_rate
+            speed = np.hypot(dx, dy) + abs(dr) * self.frame_extent
+            interval = self.estimation_max_motion / speed if speed > 0 else self.estimation_interval
+            self.interval = int(min(max(interval, 1), self.estimation_interval))
+
+        return motion
+
+    def adapt(self, seconds):
+        """
+        Passes the processing time of a frame to the quality controller, if enabled,
+        and applies the operating point it chooses to the motion estimator.
+
+        Args:
+            seconds (float): Processing time of the frame.
+        """
+        if self.quality is None:
+            return
+
+        point = self.quality.update(seconds)
+        if point is None:
+            return
+
+        self.motion_estimator.set_operating_point(*point)
+        resize_ratio, max_feature_count, ransac_max_iters = point
+        self.logger.log(
+            f"Operating point {self.quality.level}: resize ratio {resize_ratio:.2f} | "
+            f"features {max_feature_count} | RANSAC iterations {ransac_max_iters} | "
+            f"avg frame time {1000 * self.quality.average:.1f} ms",
+            "MEASURMENT"
+        )
+
+    def warp(self, frame, corrective_motion, out=None, scratch=None, bgr=None):
+        """
+        Applies the corrective motion to a frame, cropping it if fused cropping is on.
+        Holds no state, so it can be called from several threads at once.
+
+        Args:
+            frame (ndarray): Video frame to be warped.
+            corrective_motion (tuple): (dx, dy, dr) returned by estimate_correction.
+            out (ndarray or None): Preallocated output buffer of the output size.
+            scratch (ndarray or None): Preallocated buffer of the frame size used by the
+                translation-only fast path. Allocated as needed if None.
+            bgr (ndarray or None): Preallocated buffer of the BGR conversion of a YUV420
+                frame. Allocated as needed if None.
+
+        Returns:
+            ndarray: The stabilized frame.
+        """
+        if self.frame_format != "bgr":
+            with self.logger.measure("convert"):
+                frame = to_bgr(frame, self.frame_format, bgr)
+
+        with self.logger.measure("warp"):
+            return warp_frame(frame, corrective_motion, self.crop, out, self.interpolation,
+                              self.rotation_threshold, scratch)
+
+    def close(self):
+        """Releases the threads of the motion estimator, if any."""
+        self.motion_estimator.close()
 
-        return stabilized_frame
-    
     def export_trajectory_data(self):
         """
         Exports both the raw and smoothed motion trajectories for plotting.
@@ -77,4 +439,6 @@ class Stabilizer:
         Returns:
             tuple: (raw_trajectory, smoothed_trajectory)
         """
+        if self.lag > 0:
+            return self.lag_smoother.get_raw_and_smoothed_trajectory()
         return self.motion_filter.get_raw_and_smoothed_trajectory()
\ No newline at end of file
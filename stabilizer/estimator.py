@@ -1,11 +1,38 @@
 import cv2 as cv
 import numpy as np
-from .frame_features import FrameFeatures
+from .frame_features import FrameFeatures, TiledORB, analysis_size
+from .matcher import CrossCheckMatcher
+from buffers import BufferPool
 from collections import deque
 
+# Width of the luma thumbnail compared by the static scene check
+STATIC_CHECK_WIDTH = 80
+
+
+def relative_motion(pose, prev_pose):
+    """
+    Computes the motion from the previous to the current frame given the poses of both
+    relative to the same keyframe, i.e. the transform pose @ inverse(prev_pose).
+
+    Args:
+        pose (tuple): (dx, dy, dr) of the current frame relative to the keyframe.
+        prev_pose (tuple): (dx, dy, dr) of the previous frame relative to the keyframe.
+
+    Returns:
+        tuple: (dx, dy, dr) motion between the frames.
+    """
+    dx, dy, dr = pose
+    prev_dx, prev_dy, prev_dr = prev_pose
+
+    # Translation of the previous pose, rotated by the rotation between the frames
+    rotation = dr - prev_dr
+    sin, cos = np.sin(rotation), np.cos(rotation)
+    return dx - (cos * prev_dx - sin * prev_dy), dy - (sin * prev_dx + cos * prev_dy), rotation
+
 
 class MotionEstimator:
-    def __init__(self, first_frame, resize_ratio, static_scene_threshold, max_feature_count):
+    def __init__(self, first_frame, resize_ratio, static_scene_threshold, max_feature_count, pool=None, detector=None,
+                 matcher=None, max_match_count=None, keyframe=None, input_scale=1.0):
         """
         Initializes the motion estimator using ORB feature detection and affine transformation.
 
@@ -14,23 +41,61 @@ class MotionEstimator:
             resize_ratio (float): Ratio to downscale frames for faster processing.
             static_scene_threshold (float): Threshold for detecting if the scene is static.
             max_feature_count (int): Maximum number of ORB features to detect per frame.
+            pool (BufferPool or None): Pool of the reused analysis buffers.
+            detector (TiledORB or None): Feature detector to use instead of a single ORB.
+            matcher (object or None): Descriptor matcher from create_matcher, cross-checked
+                brute force if None.
+            max_match_count (int or None): Only the best matches up to this number are used.
+            keyframe (tuple or None): (min_inliers, min_overlap) to match frames against a keyframe,
+                which is replaced when fewer inliers remain or it overlaps the frame less. If None,
+                every frame is matched against the previous one.
+            input_scale (float): Size of the analysed frames relative to the output frames,
+                translations are scaled back by it.
         """
-        self.orb = cv.ORB_create(nfeatures=max_feature_count)
-        self.bfm = cv.BFMatcher(cv.NORM_HAMMING, crossCheck=True)
+        self.orb = detector if detector is not None else cv.ORB_create(nfeatures=max_feature_count)
+        self.matcher = matcher if matcher is not None else CrossCheckMatcher()
+        self.max_match_count = max_match_count
         self.resize_ratio = resize_ratio
+        self.input_scale = input_scale
+        self.ransac_max_iters = 2000 # OpenCV's default
+        self.pool = pool if pool is not None else BufferPool()
 
-        # Extract features from the first frame
-        self.prev = FrameFeatures(first_frame, resize_ratio, self.orb)
+        # Extract features from the first frame, the reference the next frame is matched against
+        self.prev = FrameFeatures(first_frame, resize_ratio, self.orb, *self.analysis_buffers(first_frame, None))
+
+        # In keyframe mode the reference is kept over several frames,
+        # the pose of the previous frame relative to it gives the inter-frame motion
+        self.keyframe = keyframe
+        self.keyframe_pose = (0.0, 0.0, 0.0)
+        self.frame_shape = first_frame.shape
+
+        # RANSAC inliers of the last estimate, 0 if it failed or was skipped
+        self.inlier_count = 0
+
+        self.init_static_check(first_frame, static_scene_threshold)
+
+    def init_static_check(self, first_frame, static_scene_threshold):
+        """
+        Sets up the static scene check, which compares luma thumbnails of consecutive frames.
 
+        Args:
+            first_frame (ndarray): The initial frame.
+            static_scene_threshold (float): Threshold for detecting if the scene is static, 0 disables the check.
+        """
         # Threshold to decide whether the scene is static
         self.static_scene_threshold = static_scene_threshold
 
-         # Moving window of absolute frame differences for static scene detection
+         # Moving window of absolute frame differences for static scene detection, and its sum
         self.abs_diff_win = deque(maxlen=10)
+        self.abs_diff_sum = 0.0
 
         # Tracks whether the previous state was static
         self.was_static = False
 
+        self.prev_thumb = None
+        if static_scene_threshold > 0:
+            self.prev_thumb = self.luma_thumbnail(first_frame)
+
     def estimate(self, curr_frame, logger):
         """
         Estimates 2D motion (translation + rotation) between the current and previous frame.
@@ -42,84 +107,255 @@ class MotionEstimator:
         Returns:
             tuple or None: (dx, dy, dr) motion or None if estimation failed.
         """
+        self.inlier_count = 0
+
+        # Skip all feature work while the scene is static, keeping the last analysed features
+        if self.check_static_scene(curr_frame, logger):
+            return 0, 0, 0
+
          # Extract keypoints and descriptors for the current frame
-        curr = FrameFeatures(curr_frame, self.resize_ratio, self.orb)
+        with logger.measure("features"):
+            buffers = self.analysis_buffers(curr_frame, self.prev.resized_gs)
+            curr = FrameFeatures(curr_frame, self.resize_ratio, self.orb, *buffers)
 
-        # Check descriptor validity
+        # Check descriptor validity, a reference without descriptors is replaced
         if self.prev.des is None or curr.des is None:
             logger.log("Descriptor(s) is None.", "WARN")
+            if self.prev.des is None:
+                self.set_reference(curr)
             return None
         
-         # Match descriptors between previous and current frame
-        matches = self.bfm.match(self.prev.des, curr.des)
-        if len(matches) < 10:
+         # Match descriptors between the reference and current frame, keeping the best ones
+        with logger.measure("matching"):
+            query_idx, train_idx = self.matcher.match(self.prev.des, curr.des, self.max_match_count)
+        if len(query_idx) < 10:
             logger.log("Too few matches.", "WARN")
-            self.prev = curr
+            self.set_reference(curr)
             return None
-        
-         # Sort matches by descriptor distance (smaller is better)
-        matches = sorted(matches, key=lambda x: x.distance)
 
-         # Extract matched keypoint coordinates
-        prev_pts = np.float32([self.prev.kp[m.queryIdx].pt for m in matches]).reshape(-1, 1, 2)
-        curr_pts = np.float32([curr.kp[m.trainIdx].pt for m in matches]).reshape(-1, 1, 2)
+         # Gather matched keypoint coordinates
+        prev_pts = self.prev.pts[query_idx].reshape(-1, 1, 2)
+        curr_pts = curr.pts[train_idx].reshape(-1, 1, 2)
+
+        # Bring the previous features to the current scale if the operating point changed
+        if self.prev.scale != curr.scale:
+            prev_pts *= curr.scale / self.prev.scale
         
+        # Estimate the motion between the matched points
+        motion = self.estimate_affine(prev_pts, curr_pts, logger)
+        if motion is None:
+            self.set_reference(curr)
+            return None
+        dx_raw, dy_raw, dr_raw, inliers = motion
+
+        if self.keyframe is None:
+            self.set_reference(curr)
+            return dx_raw, dy_raw, dr_raw
+
+        # Motion since the previous frame follows from both poses relative to the keyframe,
+        # so estimation errors do not add up while the keyframe is kept
+        pose = (dx_raw, dy_raw, dr_raw)
+        motion = relative_motion(pose, self.keyframe_pose)
+        self.update_keyframe(curr, pose, self.inlier_count, logger)
+        return motion
+
+    def set_reference(self, curr):
+        """Makes the given frame features the reference the next frame is matched against."""
+        self.prev = curr
+        self.keyframe_pose = (0.0, 0.0, 0.0)
+
+    def update_keyframe(self, curr, pose, inlier_count, logger):
+        """
+        Keeps the keyframe while enough of its features are matched and it still overlaps
+        the frame enough, otherwise the current frame becomes the new keyframe.
+
+        Args:
+            curr (FrameFeatures): Features of the current frame.
+            pose (tuple): (dx, dy, dr) of the current frame relative to the keyframe.
+            inlier_count (int): Number of RANSAC inliers of the pose.
+            logger (Logger): Logger instance to report keyframe changes.
+        """
+        min_inliers, min_overlap = self.keyframe
+        # The pose is in pixels of the output frames, not of the analysed ones
+        h, w = (size / self.input_scale for size in self.frame_shape[:2])
+        overlap = max(1 - abs(pose[0]) / w, 0) * max(1 - abs(pose[1]) / h, 0)
+
+        if inlier_count >= min_inliers and overlap >= min_overlap:
+            self.keyframe_pose = pose
+            return
+
+        logger.log(f"New keyframe ({inlier_count} inliers, {100 * overlap:.0f}% overlap).")
+        self.set_reference(curr)
+
+    def close(self):
+        """Releases the threads of a tiled detector, if any."""
+        if isinstance(self.orb, TiledORB):
+            self.orb.close()
+
+    def set_operating_point(self, resize_ratio, max_feature_count, ransac_max_iters):
+        """
+        Changes the precision of the estimation at runtime. The ORB detector is
+        reconfigured in place, features of the previous frame are rescaled on the next estimate.
+
+        Args:
+            resize_ratio (float): Ratio to downscale frames for faster processing.
+            max_feature_count (int): Maximum number of ORB features to detect per frame.
+            ransac_max_iters (int): Maximum number of RANSAC iterations.
+        """
+        self.resize_ratio = resize_ratio
+        self.ransac_max_iters = ransac_max_iters
+        if self.orb.getMaxFeatures() != max_feature_count:
+            self.orb.setMaxFeatures(max_feature_count)
+
+    def analysis_buffers(self, image, prev_gs):
+        """
+        Returns the buffers for the full-size and the scaled grayscale version of a frame.
+        Two scaled buffers alternate, so the previous grayscale frame stays intact.
+
+        Args:
+            image (ndarray): Frame to be analysed.
+            prev_gs (ndarray or None): Scaled grayscale previous frame.
+
+        Returns:
+            tuple: (full-size gray, scaled gray) buffers.
+        """
+        size = analysis_size(image.shape, self.resize_ratio)
+        gray = self.pool.get("analysis_gray0", size)
+        if gray is prev_gs:
+            gray = self.pool.get("analysis_gray1", size)
+
+        # Only a BGR frame that is downscaled needs the full-size grayscale step
+        full = None
+        if image.ndim == 3 and self.resize_ratio != 1.0:
+            full = self.pool.get("analysis_luma", image.shape[:2], image.dtype)
+        return full, gray
+
+    def estimate_affine(self, prev_pts, curr_pts, logger):
+        """
+        Estimates translation and rotation between two sets of corresponding points.
+
+        Args:
+            prev_pts (ndarray): Points in the previous frame, shape (N, 1, 2).
+            curr_pts (ndarray): Corresponding points in the current frame, shape (N, 1, 2).
+            logger (Logger): Logger instance to report warnings.
+
+        Returns:
+            tuple or None: (dx, dy, dr, inliers) with translation scaled to the original
+            resolution and the RANSAC inlier mask, or None if estimation failed.
+        """
         # Estimate affine transformation using RANSAC to filter outliers
-        T_raw, inlies = cv.estimateAffine2D(prev_pts, curr_pts, method=cv.RANSAC)
+        with logger.measure("ransac"):
+            T_raw, inlies = cv.estimateAffine2D(prev_pts, curr_pts, method=cv.RANSAC, maxIters=self.ransac_max_iters)
 
         # Validate the transform
         if T_raw is None or not np.isfinite(T_raw).all():
             logger.log("Estimated affine transform is not valid.", "WARN")
-            self.prev = curr
             return None
         
         if inlies is None or np.sum(inlies) < 10:
             logger.log("Too few inliers — skipping the frame.", "WARN")
-            self.prev = curr
             return None
+        self.inlier_count = int(np.count_nonzero(inlies))
 
          # Extract translation and rotation from the transform
         dx_raw = T_raw[0, 2]
         dy_raw = T_raw[1, 2]
         dr_raw = np.arctan2(T_raw[1, 0], T_raw[0, 0])
 
-        # Scale translation back to original resolution
-        dx_raw /= self.resize_ratio
-        dy_raw /= self.resize_ratio
+        # Scale translation back to the resolution of the output frames
+        dx_raw /= self.resize_ratio * self.input_scale
+        dy_raw /= self.resize_ratio * self.input_scale
+
+        return dx_raw, dy_raw, dr_raw, inlies
+
+    def luma_thumbnail(self, frame):
+        """
+        Downsamples a frame to a small grayscale thumbnail for the static scene check.
+        Two buffers alternate, so the previous thumbnail stays intact.
+
+        Args:
+            frame (ndarray): Input BGR frame or single-channel luma.
+
+        Returns:
+            ndarray: Grayscale thumbnail STATIC_CHECK_WIDTH pixels wide.
+        """
+        h, w = frame.shape[:2]
+        size = (max(round(h * STATIC_CHECK_WIDTH / w), 1), STATIC_CHECK_WIDTH)
+        thumb = self.pool.get("thumbnail0", size)
+        if thumb is self.prev_thumb:
+            thumb = self.pool.get("thumbnail1", size)
+
+        # The luma is resized directly, a BGR frame is converted once it is small
+        if frame.ndim == 2:
+            return cv.resize(frame, size[::-1], dst=thumb, interpolation=cv.INTER_AREA)
+        small = cv.resize(frame, size[::-1], dst=self.pool.get("thumbnail_bgr", size + frame.shape[2:], frame.dtype),
+                          interpolation=cv.INTER_AREA)
+        return cv.cvtColor(small, cv.COLOR_BGR2GRAY, dst=thumb)
+
+    def check_static_scene(self, curr_frame, logger):
+        """
+        Cheap test run before any feature work: compares the luma thumbnail of the frame
+        with that of the previous frame. Disabled if static_scene_threshold is 0.
+
+        Args:
+            curr_frame (ndarray): The new frame.
+            logger (Logger): Logger instance to report scene status.
 
-        # Detect static scene using mean absolute difference
-        if self.is_static_scene(curr):
-            self.prev = curr
-            self.last_valid_motion = 0, 0, 0
+        Returns:
+            bool: True if scene is considered static.
+        """
+        if self.prev_thumb is None:
+            return False
+
+        with logger.measure("static_check"):
+            thumb = self.luma_thumbnail(curr_frame)
+            is_static = self.is_static_scene(thumb, self.prev_thumb)
+            self.prev_thumb = thumb
+        return self.update_scene_state(is_static, logger)
+
+    def update_scene_state(self, is_static, logger):
+        """
+        Logs transitions between static and dynamic scenes.
+
+        Args:
+            is_static (bool): Result of is_static_scene for the current frame.
+            logger (Logger): Logger instance to report scene status.
+
+        Returns:
+            bool: True if scene is considered static.
+        """
+        if is_static:
             if not self.was_static:
                 logger.log("Static scene detected.")
                 self.was_static = True
-            return 0, 0, 0
+            return True
 
         if self.was_static:
             logger.log("Dynamic scene detected.")
             self.was_static = False
-
-        self.prev = curr
-        return dx_raw, dy_raw, dr_raw
+        return False
     
-    def is_static_scene(self, curr):
+    def is_static_scene(self, curr_gs, prev_gs):
         """
         Determines if the scene is static based on grayscale frame difference.
 
         Args:
-            curr (FrameFeatures): Features of the current frame.
+            curr_gs (ndarray): Grayscale thumbnail of the current frame.
+            prev_gs (ndarray): Grayscale thumbnail of the previous frame.
 
         Returns:
             bool: True if scene is considered static.
         """
-        # Compute absolute difference between grayscale resized frames
-        abs_diff = cv.absdiff(curr.resized_gs, self.prev.resized_gs)
-        abs_diff = np.mean(abs_diff)
+        # Compute absolute difference between the thumbnails
+        abs_diff = cv.absdiff(curr_gs, prev_gs, dst=self.pool.like("abs_diff", curr_gs))
+        abs_diff = cv.mean(abs_diff)[0]
 
-        # Add to moving average window
+        # Add to moving average window, keeping its sum up to date
+        if len(self.abs_diff_win) == self.abs_diff_win.maxlen:
+            self.abs_diff_sum -= self.abs_diff_win[0]
         self.abs_diff_win.append(abs_diff)
+        self.abs_diff_sum += abs_diff
 
         # Return True if enough values are available and mean is low
         is_full = len(self.abs_diff_win) == self.abs_diff_win.maxlen
-        return is_full and np.mean(self.abs_diff_win) < self.static_scene_threshold
\ No newline at end of file
+        return is_full and self.abs_diff_sum / len(self.abs_diff_win) < self.static_scene_threshold
\ No newline at end of file
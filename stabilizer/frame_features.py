@@ -1,16 +1,155 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
 import cv2 as cv
+import numpy as np
+
+def analysis_size(shape, scale):
+    """
+    Returns the (height, width) of an image of the given shape after resizing
+    it by the scale, rounded the same way as cv.resize.
+    """
+    h, w = shape[:2]
+    return round(h * scale), round(w * scale)
+
+def to_analysis_gray(image, scale, gray=None, out=None):
+    """
+    Converts the input image to grayscale and downscales it for motion analysis.
+    Converting first leaves a single channel to resize, which is averaged over the
+    area of every output pixel so small scales do not alias. A single-channel image,
+    such as the Y plane of a YUV420 frame, is already the luma and is only resized.
+
+    Args:
+        image (ndarray): Input BGR frame or single-channel luma.
+        scale (float): Scaling factor for resizing the frame.
+        gray (ndarray or None): Preallocated buffer for the full-size grayscale frame.
+        out (ndarray or None): Preallocated buffer for the scaled grayscale result.
+
+    Returns:
+        ndarray: Scaled grayscale image.
+    """
+    if image.ndim == 3:
+        if scale == 1.0:
+            return cv.cvtColor(image, cv.COLOR_BGR2GRAY, dst=out)
+        image = cv.cvtColor(image, cv.COLOR_BGR2GRAY, dst=gray)
+    elif scale == 1.0:
+        # The luma usually views a frame buffer the source reuses, the result must outlive it
+        if out is None:
+            return image.copy()
+        np.copyto(out, image)
+        return out
+    return cv.resize(image, (0, 0), fx=scale, fy=scale, dst=out, interpolation=cv.INTER_AREA)
+
+class TiledORB:
+    def __init__(self, max_feature_count, grid, overlap, threads=None):
+        """
+        ORB detector splitting the image into a grid of overlapping tiles, which are
+        processed in parallel threads (OpenCV releases the GIL). Every cell keeps at most
+        its share of the features, so they are spread over the whole image. Offers the
+        detectAndCompute, getMaxFeatures and setMaxFeatures methods of cv.ORB.
+
+        Args:
+            max_feature_count (int): Maximum number of features over all cells.
+            grid (tuple): Number of (columns, rows) of the grid.
+            overlap (int): Pixels by which tiles extend into their neighbours, so features
+                near cell borders are not lost to the ORB border margin.
+            threads (int or None): Number of threads, one per cell up to the CPU count if None.
+        """
+        self.cols, self.rows = grid
+        self.overlap = overlap
+
+        # ORB instances are not shared between threads, every cell has its own
+        self.orbs = [cv.ORB_create() for _ in range(self.cols * self.rows)]
+        self.setMaxFeatures(max_feature_count)
+
+        self.executor = ThreadPoolExecutor(max_workers=threads or min(len(self.orbs), os.cpu_count() or 1))
+
+        # Tiles by image size, the analysis size changes only with the operating point
+        self.tiles = {}
+
+    def getMaxFeatures(self):
+        return self.max_feature_count
+
+    def setMaxFeatures(self, max_feature_count):
+        self.max_feature_count = max_feature_count
+        per_cell = -(-max_feature_count // len(self.orbs))
+        for orb in self.orbs:
+            orb.setMaxFeatures(per_cell)
+
+    def get_tiles(self, shape):
+        """
+        Returns the tiles of an image shape as (tile_x0, tile_y0, tile_x1, tile_y1,
+        cell_x0, cell_y0, cell_x1, cell_y1), the tile being the cell plus the overlap.
+        """
+        tiles = self.tiles.get(shape)
+        if tiles is None:
+            h, w = shape
+            tiles = []
+            for row in range(self.rows):
+                for col in range(self.cols):
+                    x0, x1 = w * col // self.cols, w * (col + 1) // self.cols
+                    y0, y1 = h * row // self.rows, h * (row + 1) // self.rows
+                    tiles.append((
+                        max(x0 - self.overlap, 0), max(y0 - self.overlap, 0),
+                        min(x1 + self.overlap, w), min(y1 + self.overlap, h),
+                        x0, y0, x1, y1,
+                    ))
+            self.tiles[shape] = tiles
+        return tiles
+
+    def detect_tile(self, orb, image, tile):
+        """
+        Detects features in one tile and keeps those inside its cell, in image coordinates.
+        """
+        tx0, ty0, tx1, ty1, x0, y0, x1, y1 = tile
+        kp, des = orb.detectAndCompute(image[ty0:ty1, tx0:tx1], None)
+
+        keep = []
+        for i, k in enumerate(kp):
+            x, y = k.pt[0] + tx0, k.pt[1] + ty0
+            if x0 <= x < x1 and y0 <= y < y1:
+                k.pt = (x, y)
+                keep.append(i)
+        if not keep:
+            return [], None
+        return [kp[i] for i in keep], des[keep]
+
+    def detectAndCompute(self, image, mask):
+        """
+        Detects keypoints and computes their descriptors tile by tile.
+
+        Returns:
+            tuple: (keypoints, descriptors) merged over all cells, descriptors are None
+            if no keypoint was found.
+        """
+        tiles = self.get_tiles(image.shape[:2])
+        results = list(self.executor.map(lambda orb, tile: self.detect_tile(orb, image, tile), self.orbs, tiles))
+
+        kp = [k for cell_kp, _ in results for k in cell_kp]
+        des = [cell_des for _, cell_des in results if cell_des is not None]
+        return kp, np.concatenate(des) if des else None
+
+    def close(self):
+        """Stops the threads of the detector."""
+        self.executor.shutdown()
 
 class FrameFeatures:
-    def __init__(self, image, scale, orb):
+    def __init__(self, image, scale, orb, gray=None, out=None):
         """
         Extracts ORB features from a scaled grayscale version of the input image.
 
         Args:
             scale (float): Scaling factor for resizing the frame.
             orb (cv.ORB): Pre-initialized OpenCV ORB feature detector.
+            gray (ndarray or None): Preallocated buffer for the full-size grayscale frame.
+            out (ndarray or None): Preallocated buffer for the scaled grayscale frame.
         """
-        # Resize the input image and convert it to grayscale
-        self.resized_gs = cv.cvtColor(cv.resize(image, (0, 0), fx=scale, fy=scale), cv.COLOR_BGR2GRAY)
+        # Convert the input image to grayscale and resize it
+        self.scale = scale
+        self.resized_gs = to_analysis_gray(image, scale, gray, out)
 
         # Detect ORB keypoints and compute descriptors
-        self.kp, self.des = orb.detectAndCompute(self.resized_gs, None)
\ No newline at end of file
+        self.kp, self.des = orb.detectAndCompute(self.resized_gs, None)
+
+        # Keypoint coordinates as an (N, 2) array, indexed by the matches
+        self.pts = cv.KeyPoint_convert(self.kp) if len(self.kp) else np.empty((0, 2), dtype=np.float32)
@@ -0,0 +1,58 @@
+import cv2 as cv
+from .frame_features import to_analysis_gray
+
+# Layouts of the frames handed to the stabilizer, selected by 'frame_format'.
+# A yuv420 frame is an I420 array of shape (height * 3 / 2, width): the full Y plane
+# followed by the quarter-size U and V planes
+FRAME_FORMATS = ["bgr", "yuv420"]
+
+def frame_size(frame, frame_format):
+    """
+    Returns the (width, height) of the picture stored in a frame.
+    """
+    h, w = frame.shape[:2]
+    if frame_format == "yuv420":
+        h = h * 2 // 3
+    return w, h
+
+def luma(frame, frame_format):
+    """
+    Returns the input of the motion analysis: the Y plane of a YUV420 frame as a view,
+    without any conversion, or a BGR frame as it is.
+    """
+    if frame_format == "yuv420":
+        return frame[:frame.shape[0] * 2 // 3]
+    return frame
+
+def to_bgr(frame, frame_format, out=None):
+    """
+    Converts a frame to BGR for warping and output. BGR frames are returned as they are.
+
+    Args:
+        frame (ndarray): Frame in the given format.
+        frame_format (str): One of FRAME_FORMATS.
+        out (ndarray or None): Preallocated BGR buffer of the picture size.
+
+    Returns:
+        ndarray: BGR frame.
+    """
+    if frame_format == "yuv420":
+        return cv.cvtColor(frame, cv.COLOR_YUV2BGR_I420, dst=out)
+    return frame
+
+def reduce_frame(frame, frame_format, width, gray=None, out=None):
+    """
+    Returns the grayscale analysis frame of the given width for a source that provides none.
+
+    Args:
+        frame (ndarray): Frame in the given format.
+        frame_format (str): One of FRAME_FORMATS.
+        width (int): Width of the analysis frame, the height keeps the aspect ratio.
+        gray (ndarray or None): Preallocated buffer for the full-size grayscale frame.
+        out (ndarray or None): Preallocated buffer for the analysis frame.
+
+    Returns:
+        ndarray: Grayscale analysis frame.
+    """
+    w, _ = frame_size(frame, frame_format)
+    return to_analysis_gray(luma(frame, frame_format), width / w, gray, out)
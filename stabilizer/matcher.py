@@ -0,0 +1,96 @@
+import cv2 as cv
+import numpy as np
+
+# FLANN index for binary descriptors (locality-sensitive hashing)
+FLANN_INDEX_LSH = 6
+
+
+def create_matcher(method, ratio=0.75):
+    """
+    Creates the descriptor matcher selected by 'matcher' in the configuration.
+
+    Args:
+        method (str): "bf" (brute force with cross check), "ratio" (brute force with
+            Lowe's ratio test) or "flann" (FLANN-LSH with ratio test).
+        ratio (float): Ratio of the best to the second best distance for the ratio test.
+
+    Returns:
+        Matcher with a match(prev_des, curr_des, max_count) method.
+    """
+    if method == "ratio":
+        return RatioTestMatcher(cv.BFMatcher(cv.NORM_HAMMING), ratio)
+    if method == "flann":
+        index_params = dict(algorithm=FLANN_INDEX_LSH, table_number=6, key_size=12, multi_probe_level=1)
+        return RatioTestMatcher(cv.FlannBasedMatcher(index_params, dict(checks=50)), ratio)
+    return CrossCheckMatcher()
+
+
+def select_best(matches, max_count):
+    """
+    Converts matches to index arrays, keeping only the max_count matches with the
+    smallest descriptor distance (in no particular order) if there are more.
+
+    Args:
+        matches (list): cv.DMatch objects.
+        max_count (int or None): Maximum number of matches to keep, all if None.
+
+    Returns:
+        tuple: (query_idx, train_idx) integer arrays.
+    """
+    if not matches:
+        empty = np.empty(0, dtype=np.intp)
+        return empty, empty
+
+    # One typed pass per field, the distances are only read when some matches are dropped
+    count = len(matches)
+    query_idx = np.fromiter((m.queryIdx for m in matches), dtype=np.intp, count=count)
+    train_idx = np.fromiter((m.trainIdx for m in matches), dtype=np.intp, count=count)
+    if max_count is not None and count > max_count:
+        distances = np.fromiter((m.distance for m in matches), dtype=np.float32, count=count)
+        keep = np.argpartition(distances, max_count - 1)[:max_count]
+        query_idx, train_idx = query_idx[keep], train_idx[keep]
+
+    return query_idx, train_idx
+
+
+class CrossCheckMatcher:
+    def __init__(self):
+        """
+        Brute-force Hamming matcher keeping only mutual best matches.
+        """
+        self.bfm = cv.BFMatcher(cv.NORM_HAMMING, crossCheck=True)
+
+    def match(self, prev_des, curr_des, max_count=None):
+        """
+        Matches the descriptors of the previous frame to those of the current one.
+
+        Returns:
+            tuple: (query_idx, train_idx) arrays indexing prev_des and curr_des.
+        """
+        return select_best(self.bfm.match(prev_des, curr_des), max_count)
+
+
+class RatioTestMatcher:
+    def __init__(self, matcher, ratio):
+        """
+        Keeps the best of the two nearest matches only if it is clearly better
+        than the second best (Lowe's ratio test).
+
+        Args:
+            matcher (cv.DescriptorMatcher): Matcher providing knnMatch.
+            ratio (float): Maximum ratio of the best to the second best distance.
+        """
+        self.matcher = matcher
+        self.ratio = ratio
+
+    def match(self, prev_des, curr_des, max_count=None):
+        """
+        Matches the descriptors of the previous frame to those of the current one.
+
+        Returns:
+            tuple: (query_idx, train_idx) arrays indexing prev_des and curr_des.
+        """
+        # The LSH index may return fewer than two neighbours for some descriptors
+        pairs = self.matcher.knnMatch(prev_des, curr_des, k=2)
+        good = [p[0] for p in pairs if len(p) == 2 and p[0].distance < self.ratio * p[1].distance]
+        return select_best(good, max_count)
@@ -0,0 +1,80 @@
+# Operating points from the configured quality downwards:
+# (factor of resize_ratio, factor of max_feature_count, RANSAC iteration limit)
+QUALITY_LADDER = [
+    (1.0, 1.0, 2000),
+    (1.0, 0.75, 1000),
+    (0.8, 0.75, 1000),
+    (0.8, 0.5, 500),
+    (0.65, 0.5, 500),
+    (0.5, 0.35, 250),
+]
+
+
+class QualityController:
+    # Weight of the newest frame in the moving average of the processing time
+    SMOOTHING = 0.1
+
+    # Lower the quality above this load (fraction of the frame budget), raise it below the lower one.
+    # The gap is wider than the cost difference between neighbouring levels, which prevents oscillation.
+    UPPER_LOAD = 1.0
+    LOWER_LOAD = 0.6
+
+    # Frames to wait after a change, so the average reflects the new operating point
+    COOLDOWN = 30
+
+    def __init__(self, target_fps, resize_ratio, max_feature_count):
+        """
+        Closed-loop controller choosing the motion estimation operating point that keeps
+        the per-frame processing time within the budget of the target frame rate.
+
+        Args:
+            target_fps (float): Frame rate to hold.
+            resize_ratio (float): Configured analysis downscale factor, used at the highest level.
+            max_feature_count (int): Configured number of features, used at the highest level.
+        """
+        self.budget = 1.0 / target_fps
+        self.points = []
+        for resize_factor, feature_factor, ransac_max_iters in QUALITY_LADDER:
+            point = (resize_ratio * resize_factor, max(int(max_feature_count * feature_factor), 10), ransac_max_iters)
+            if point not in self.points:
+                self.points.append(point)
+
+        self.level = 0
+        self.average = None
+        self.cooldown = self.COOLDOWN
+
+    @property
+    def operating_point(self):
+        """Current (resize_ratio, max_feature_count, ransac_max_iters)."""
+        return self.points[self.level]
+
+    def update(self, seconds):
+        """
+        Adds the processing time of one frame and moves one level down or up
+        if the average load stays outside the hysteresis band.
+
+        Args:
+            seconds (float): Processing time of the frame.
+
+        Returns:
+            tuple or None: The new operating point, or None if it did not change.
+        """
+        if self.average is None:
+            self.average = seconds
+        else:
+            self.average += self.SMOOTHING * (seconds - self.average)
+
+        if self.cooldown > 0:
+            self.cooldown -= 1
+            return None
+
+        load = self.average / self.budget
+        if load > self.UPPER_LOAD and self.level < len(self.points) - 1:
+            self.level += 1
+        elif load < self.LOWER_LOAD and self.level > 0:
+            self.level -= 1
+        else:
+            return None
+
+        self.cooldown = self.COOLDOWN
+        return self.operating_point
@@ -1,68 +1,216 @@
 import numpy as np
-from filterpy.kalman import KalmanFilter
 
 class MotionFilter:
-    def __init__(self, Q, R, max_x, max_y, max_r):
+    def __init__(self, Q, R, max_x, max_y, max_r, backend="builtin"):
         """
-        Initializes Kalman filters for each motion component (x, y, rotation).
+        Initializes Kalman filters for the motion components (x, y, rotation).
 
         Args:
             Q (float): Process noise covariance.
             R (float): Measurement noise covariance.
+            backend (str): "builtin" filters all components at once with Kalman3D,
+                "filterpy" uses an independent filterpy Kalman1D per component.
         """
-        # Max pixel shift
-        self.max_x = max_x
-        self.max_y = max_y
-
-        # Max rotation in radians
-        self.max_r = max_r
+        # Max pixel shift and max rotation in radians
+        self.limits = np.array([max_x, max_y, max_r], dtype=float)
        
-        # Cumulative raw and smoothed motion
-        self.x_raw_sum = 0
-        self.y_raw_sum = 0
-        self.r_raw_sum = 0
-
-        self.x_smooth_sum = 0
-        self.y_smooth_sum = 0
-        self.r_smooth_sum = 0
-
-        # Independent 1D Kalman filters
-        self.kalman_x = Kalman1D(Q, R)
-        self.kalman_y = Kalman1D(Q, R)
-        self.kalman_r = Kalman1D(Q, R)
+        # Cumulative raw and smoothed motion (x, y, rotation)
+        self.raw_sum = np.zeros(3)
+        self.smooth_sum = np.zeros(3)
+
+        # Preallocated output of compute_correction
+        self.correction = np.zeros(3)
+
+        if backend == "filterpy":
+            # Independent 1D Kalman filters
+            self.kalman = None
+            self.kalman_x = Kalman1D(Q, R)
+            self.kalman_y = Kalman1D(Q, R)
+            self.kalman_r = Kalman1D(Q, R)
+        else:
+            self.kalman = Kalman3D(Q, R)
     
     def cumulate(self, raw_motion):
         """Accumulates raw motion over time."""
-        self.x_raw_sum += raw_motion[0]
-        self.y_raw_sum += raw_motion[1]
-        self.r_raw_sum += raw_motion[2]
+        np.add(self.raw_sum, raw_motion, out=self.raw_sum)
 
     def smooth(self):
         """Applies Kalman filtering to each motion component."""
-        self.x_smooth_sum = self.kalman_x.update(self.x_raw_sum)
-        self.y_smooth_sum = self.kalman_y.update(self.y_raw_sum)
-        self.r_smooth_sum = self.kalman_r.update(self.r_raw_sum)
+        if self.kalman is not None:
+            self.kalman.update(self.raw_sum, out=self.smooth_sum)
+            return
+        self.smooth_sum[0] = self.kalman_x.update(self.raw_sum[0])
+        self.smooth_sum[1] = self.kalman_y.update(self.raw_sum[1])
+        self.smooth_sum[2] = self.kalman_r.update(self.raw_sum[2])
     
     def compute_correction(self):
         """
         Calculates the difference between smoothed and raw motion.
         Applies clamping to prevent overcorrection.
         """
-        dx_corr = (self.x_smooth_sum - self.x_raw_sum) 
-        dy_corr = (self.y_smooth_sum - self.y_raw_sum)
-        dr_corr = (self.r_smooth_sum - self.r_raw_sum)
-
-        dx_corr = np.clip(dx_corr, -self.max_x, self.max_x)
-        dy_corr = np.clip(dy_corr, -self.max_y, self.max_y)
-        dr_corr = np.clip(dr_corr, -self.max_r, self.max_r)
+        np.subtract(self.smooth_sum, self.raw_sum, out=self.correction)
+        np.clip(self.correction, -self.limits, self.limits, out=self.correction)
 
+        dx_corr, dy_corr, dr_corr = self.correction.tolist()
         return dx_corr, dy_corr, dr_corr
     
     def get_raw_and_smoothed_trajectory(self):
-        return self.x_raw_sum, self.y_raw_sum, self.r_raw_sum, self.x_smooth_sum, self.y_smooth_sum, self.r_smooth_sum
+        x_raw_sum, y_raw_sum, r_raw_sum = self.raw_sum.tolist()
+        x_smooth_sum, y_smooth_sum, r_smooth_sum = self.smooth_sum.tolist()
+        return x_raw_sum, y_raw_sum, r_raw_sum, x_smooth_sum, y_smooth_sum, r_smooth_sum
+
+class FixedLagSmoother:
+    def __init__(self, lag, max_x, max_y, max_r):
+        """
+        Smooths the cumulative trajectory with a centered moving average over
+        2 * lag + 1 frames. A frame is smoothed once the lag frames after it are known.
+
+        Args:
+            lag (int): Number of future frames in the window of a frame.
+        """
+        self.lag = lag
+        self.limits = np.array([max_x, max_y, max_r], dtype=float)
+
+        # Cumulative raw motion (x, y, rotation) of the last frame
+        self.raw_sum = np.zeros(3)
+
+        # Ring buffers of the cumulative raw motion and of its prefix sums, indexed by frame number.
+        # They cover every frame a window can still reach, so a window sum is a single difference
+        self.size = 2 * lag + 2
+        self.raw = np.zeros((self.size, 3))
+        self.prefix = np.zeros((self.size, 3))
+        self.count = 0
+
+        # Smoothed trajectory and preallocated output of compute_correction
+        self.smooth_sum = np.zeros(3)
+        self.correction = np.zeros(3)
+        self.frame_raw = np.zeros(3)
+
+    def add(self, raw_motion):
+        """
+        Appends the motion of the next frame, None counts as motionless.
+        """
+        if raw_motion is not None:
+            np.add(self.raw_sum, raw_motion, out=self.raw_sum)
+
+        i = self.count % self.size
+        self.raw[i] = self.raw_sum
+        if self.count > 0:
+            np.add(self.prefix[(self.count - 1) % self.size], self.raw_sum, out=self.prefix[i])
+        else:
+            self.prefix[i] = self.raw_sum
+        self.count += 1
+
+    def compute_correction(self, index):
+        """
+        Smooths frame index and calculates the difference between its smoothed and raw motion.
+        The window shrinks symmetrically near the first and the last added frame,
+        so it stays centered. Applies clamping to prevent overcorrection.
+
+        Args:
+            index (int): Frame number, at most lag frames before the last added frame.
+
+        Returns:
+            tuple: Corrective motion (dx, dy, dr).
+        """
+        half = min(self.lag, index, self.count - 1 - index)
+        first, last = index - half, index + half
+
+        np.copyto(self.smooth_sum, self.prefix[last % self.size])
+        if first > 0:
+            np.subtract(self.smooth_sum, self.prefix[(first - 1) % self.size], out=self.smooth_sum)
+        self.smooth_sum /= 2 * half + 1
+
+        np.copyto(self.frame_raw, self.raw[index % self.size])
+        np.subtract(self.smooth_sum, self.frame_raw, out=self.correction)
+        np.clip(self.correction, -self.limits, self.limits, out=self.correction)
+
+        dx_corr, dy_corr, dr_corr = self.correction.tolist()
+        return dx_corr, dy_corr, dr_corr
+
+    def get_raw_and_smoothed_trajectory(self):
+        """Trajectory of the frame passed to the last compute_correction call."""
+        x_raw_sum, y_raw_sum, r_raw_sum = self.frame_raw.tolist()
+        x_smooth_sum, y_smooth_sum, r_smooth_sum = self.smooth_sum.tolist()
+        return x_raw_sum, y_raw_sum, r_raw_sum, x_smooth_sum, y_smooth_sum, r_smooth_sum
+
+class Kalman3D:
+    def __init__(self, Q=1e-4, R=1e-1, dt=1.0, dim=3):
+        """
+        Constant-velocity Kalman filter for several independent components sharing
+        the same noise parameters. The covariance does not depend on the measurements,
+        so the gains are precomputed until they reach the steady state, after which
+        the filter is a fixed-gain alpha-beta filter. Gives the same results as one
+        Kalman1D per component.
+
+        Args:
+            Q (float): Process noise covariance.
+            R (float): Measurement noise covariance.
+            dim (int): Number of filtered components.
+        """
+        self.dt = dt
+        self.gains = kalman_gains(Q, R, dt)
+        self.step = 0
+
+        # Position and velocity of every component, updated in place
+        self.pos = np.zeros(dim)
+        self.vel = np.zeros(dim)
+        self.innovation = np.zeros(dim)
+        self.scratch = np.zeros(dim)
+
+    def update(self, measurement, out=None):
+        # Gain for this step, the last one is the steady-state gain
+        alpha, beta = self.gains[min(self.step, len(self.gains) - 1)]
+        self.step += 1
+
+        # Predict
+        np.multiply(self.vel, self.dt, out=self.scratch)
+        self.pos += self.scratch
+
+        # Update
+        np.subtract(measurement, self.pos, out=self.innovation)
+        np.multiply(self.innovation, beta, out=self.scratch)
+        self.vel += self.scratch
+        np.multiply(self.innovation, alpha, out=self.scratch)
+        self.pos += self.scratch
+
+        if out is None:
+            return self.pos.copy()
+        out[:] = self.pos
+        return out
+
+def kalman_gains(Q, R, dt=1.0, tol=1e-12, max_steps=100000):
+    """
+    Computes the Kalman gains of the constant-velocity model used by Kalman1D,
+    starting from the identity covariance, until they stop changing.
+
+    Returns:
+        ndarray: Gains (alpha, beta) of shape (N, 2), the last row is the steady-state gain.
+    """
+    F = np.array([[1, dt], [0, 1]])
+    Qm = Q * np.array([[dt**4/4, dt**3/2], [dt**3/2, dt**2]])
+    P = np.eye(2)
+
+    gains = []
+    for _ in range(max_steps):
+        P = F @ P @ F.T + Qm
+        K = P[:, 0] / (P[0, 0] + R)
+
+        # Joseph form, same as filterpy
+        I_KH = np.eye(2) - np.outer(K, [1, 0])
+        P = I_KH @ P @ I_KH.T + R * np.outer(K, K)
+
+        if gains and np.all(np.abs(K - gains[-1]) <= tol * np.abs(K)):
+            break
+        gains.append(K)
+
+    return np.array(gains)
    
 class Kalman1D:
     def __init__(self, Q=1e-4, R=1e-1, dt=1.0):
+        # Imported here so filterpy is only needed when this backend is selected
+        from filterpy.kalman import KalmanFilter
+
         self.dt = dt
         self.kf = KalmanFilter(dim_x=2, dim_z=1)
         self.kf.x = np.zeros((2, 1))
@@ -77,4 +225,70 @@ class Kalman1D:
     def update(self, measurement):
         self.kf.predict()
         self.kf.update(np.array([[measurement]]))
-        return self.kf.x[0, 0]
\ No newline at end of file
+        return self.kf.x[0, 0]
+
+def gaussian_smooth(trajectory, sigma):
+    """
+    Smooths a whole trajectory with a Gaussian kernel (non-causal).
+
+    Args:
+        trajectory (ndarray): Cumulative motion of shape (N, 3).
+        sigma (float): Standard deviation of the kernel in frames.
+
+    Returns:
+        ndarray: Smoothed trajectory of shape (N, 3).
+    """
+    radius = max(1, int(round(3 * sigma)))
+    t = np.arange(-radius, radius + 1)
+    kernel = np.exp(-0.5 * (t / sigma) ** 2)
+    kernel /= kernel.sum()
+
+    # Reflect the ends so the trajectory is not pulled towards zero at the borders
+    padded = np.pad(trajectory, ((radius, radius), (0, 0)), mode="reflect")
+    return np.stack([np.convolve(padded[:, i], kernel, mode="valid") for i in range(trajectory.shape[1])], axis=1)
+
+def rts_smooth(trajectory, Q, R):
+    """
+    Smooths a whole trajectory with a forward Kalman pass followed by a backward
+    Rauch-Tung-Striebel pass, using the same constant-velocity model as Kalman1D.
+    All motion components are processed together.
+
+    Args:
+        trajectory (ndarray): Cumulative motion of shape (N, 3).
+        Q (float): Process noise covariance.
+        R (float): Measurement noise covariance.
+
+    Returns:
+        ndarray: Smoothed trajectory of shape (N, 3).
+    """
+    n = len(trajectory)
+    F = np.array([[1.0, 1.0], [0.0, 1.0]])
+    Qm = Q * np.array([[0.25, 0.5], [0.5, 1.0]])
+
+    # Covariances do not depend on the measurements, so the gains are computed first
+    P = np.eye(2)
+    P_pred = np.empty((n, 2, 2))
+    P_filt = np.empty((n, 2, 2))
+    K = np.empty((n, 2))
+    for k in range(n):
+        P = F @ P @ F.T + Qm
+        P_pred[k] = P
+        K[k] = P[:, 0] / (P[0, 0] + R)
+        P = P - np.outer(K[k], P[0])
+        P_filt[k] = P
+
+    # Forward pass: state (position, velocity) for every component
+    x = np.zeros((2, trajectory.shape[1]))
+    x_filt = np.empty((n, 2, trajectory.shape[1]))
+    for k in range(n):
+        x = F @ x
+        x = x + np.outer(K[k], trajectory[k] - x[0])
+        x_filt[k] = x
+
+    # Backward pass
+    x_smooth = x_filt.copy()
+    for k in range(n - 2, -1, -1):
+        C = P_filt[k] @ F.T @ np.linalg.inv(P_pred[k + 1])
+        x_smooth[k] = x_filt[k] + C @ (x_smooth[k + 1] - F @ x_filt[k])
+
+    return x_smooth[:, 0]
\ No newline at end of file
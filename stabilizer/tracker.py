@@ -0,0 +1,132 @@
+import cv2 as cv
+from .estimator import MotionEstimator
+from .frame_features import analysis_size, to_analysis_gray
+from buffers import BufferPool
+
+
+class KLTMotionEstimator(MotionEstimator):
+    def __init__(self, first_frame, resize_ratio, static_scene_threshold, max_feature_count, min_track_count, pool=None,
+                 input_scale=1.0):
+        """
+        Initializes the motion estimator using corners tracked by pyramidal Lucas-Kanade optical flow.
+        Corners are detected only when too few tracks survive, otherwise they are followed
+        from frame to frame.
+
+        Args:
+            first_frame (ndarray): The initial frame to track motion from.
+            resize_ratio (float): Ratio to downscale frames for faster processing.
+            static_scene_threshold (float): Threshold for detecting if the scene is static.
+            max_feature_count (int): Maximum number of corners to detect.
+            min_track_count (int): Corners are re-detected when fewer tracks than this survive.
+            pool (BufferPool or None): Pool of the reused analysis buffers.
+            input_scale (float): Size of the analysed frames relative to the output frames,
+                translations are scaled back by it.
+        """
+        self.resize_ratio = resize_ratio
+        self.input_scale = input_scale
+        self.max_feature_count = max_feature_count
+        self.min_track_count = min_track_count
+        self.ransac_max_iters = 2000 # OpenCV's default
+        self.frame_shape = first_frame.shape
+        self.inlier_count = 0
+        self.pool = pool if pool is not None else BufferPool()
+
+        # Detect corners in the first frame
+        self.prev_gs = to_analysis_gray(first_frame, resize_ratio, *self.analysis_buffers(first_frame, None))
+        self.prev_pts = self.detect(self.prev_gs)
+
+        self.init_static_check(first_frame, static_scene_threshold)
+
+    def detect(self, gs):
+        """
+        Detects corners to track in a scaled grayscale frame.
+
+        Returns:
+            ndarray or None: Corner coordinates of shape (N, 1, 2).
+        """
+        return cv.goodFeaturesToTrack(gs, maxCorners=self.max_feature_count, qualityLevel=0.01, minDistance=7)
+
+    def estimate(self, curr_frame, logger):
+        """
+        Estimates 2D motion (translation + rotation) between the current and previous frame.
+
+        Args:
+            curr_frame (ndarray): The new frame to compare against the previous one.
+            logger (Logger): Logger instance to report warnings and scene status.
+
+        Returns:
+            tuple or None: (dx, dy, dr) motion or None if estimation failed.
+        """
+        self.inlier_count = 0
+
+        # Skip all tracking while the scene is static, keeping the last tracked frame
+        if self.check_static_scene(curr_frame, logger):
+            return 0, 0, 0
+
+        with logger.measure("features"):
+            buffers = self.analysis_buffers(curr_frame, self.prev_gs)
+            curr_gs = to_analysis_gray(curr_frame, self.resize_ratio, *buffers)
+
+        # Nothing to track, start again from the current frame
+        if self.prev_pts is None or len(self.prev_pts) < 10:
+            logger.log("Too few corners to track.", "WARN")
+            self.reset(curr_gs, logger)
+            return None
+
+        # Follow the corners from the previous frame into the current one
+        with logger.measure("tracking"):
+            curr_pts, status, _ = cv.calcOpticalFlowPyrLK(self.prev_gs, curr_gs, self.prev_pts, None)
+        tracked = status.ravel() == 1
+        prev_pts = self.prev_pts[tracked]
+        curr_pts = curr_pts[tracked]
+
+        if len(curr_pts) < 10:
+            logger.log("Too few tracked corners.", "WARN")
+            self.reset(curr_gs, logger)
+            return None
+
+        # Estimate the motion between the tracked points
+        motion = self.estimate_affine(prev_pts, curr_pts, logger)
+        if motion is None:
+            self.reset(curr_gs, logger)
+            return None
+        dx_raw, dy_raw, dr_raw, inliers = motion
+
+        # Keep only the tracks consistent with the global motion, re-detect when too few survive
+        tracks = curr_pts[inliers.ravel() == 1]
+        if len(tracks) < self.min_track_count:
+            with logger.measure("features"):
+                tracks = self.detect(curr_gs)
+
+        self.prev_gs = curr_gs
+        self.prev_pts = tracks
+        return dx_raw, dy_raw, dr_raw
+
+    def close(self):
+        """The tracker holds no threads, there is nothing to release."""
+
+    def set_operating_point(self, resize_ratio, max_feature_count, ransac_max_iters):
+        """
+        Changes the precision of the estimation at runtime. The previous frame and
+        its tracks are rescaled, so tracking continues at the new resolution.
+
+        Args:
+            resize_ratio (float): Ratio to downscale frames for faster processing.
+            max_feature_count (int): Maximum number of corners to detect.
+            ransac_max_iters (int): Maximum number of RANSAC iterations.
+        """
+        if resize_ratio != self.resize_ratio:
+            h, w = analysis_size(self.frame_shape, resize_ratio)
+            if self.prev_pts is not None:
+                self.prev_pts = self.prev_pts * (resize_ratio / self.resize_ratio)
+            self.prev_gs = cv.resize(self.prev_gs, (w, h), interpolation=cv.INTER_AREA)
+
+        self.resize_ratio = resize_ratio
+        self.max_feature_count = max_feature_count
+        self.ransac_max_iters = ransac_max_iters
+
+    def reset(self, curr_gs, logger):
+        """Restarts tracking from newly detected corners of the given frame."""
+        self.prev_gs = curr_gs
+        with logger.measure("features"):
+            self.prev_pts = self.detect(curr_gs)
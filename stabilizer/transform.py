@@ -1,7 +1,102 @@
 import cv2 as cv
 import numpy as np
 
-def warp_frame(frame, corrective_motion):
+def crop_window(w, h, margin_x, margin_y):
+    """
+    Computes the centered crop window left after removing the margins.
+
+    Args:
+        w (int): Frame width.
+        h (int): Frame height.
+        margin_x (int): Margin removed on the left and right side.
+        margin_y (int): Margin removed on the top and bottom side.
+
+    Returns:
+        tuple: (x, y, crop_w, crop_h) of the window in frame coordinates.
+    """
+    crop_w = w - 2 * margin_x
+    crop_h = h - 2 * margin_y
+
+    if crop_w <= 0 or crop_h <= 0:
+        raise ValueError("Margins too large for frame size.")
+
+    x = w // 2 - crop_w // 2
+    y = h // 2 - crop_h // 2
+    return x, y, crop_w, crop_h
+
+# Interpolation modes selectable by 'warp_interpolation'
+INTERPOLATIONS = {
+    "linear": cv.INTER_LINEAR,
+    "nearest": cv.INTER_NEAREST,
+}
+
+def shift_frame(frame, x, y, size, out=None, interpolation=cv.INTER_LINEAR, scratch=None):
+    """
+    Translates a frame by (x, y) pixels, the fast path of warp_frame for negligible
+    rotations. With nearest interpolation the frame is shifted by whole pixels with
+    array slicing. With linear interpolation, each axis with a sub-pixel part is then
+    blended with the next pixel in one weighted addition. Uncovered areas are black.
+
+    Args:
+        frame (np.ndarray): Original input frame.
+        x (float): Horizontal shift in pixels.
+        y (float): Vertical shift in pixels.
+        size (tuple): (width, height) of the output.
+        out (np.ndarray or None): Preallocated output of the given size.
+        interpolation (int): cv.INTER_NEAREST or cv.INTER_LINEAR.
+        scratch (np.ndarray or None): Buffer of at least the frame size for the horizontal
+            pass when both axes are blended. Allocated if None.
+
+    Returns:
+        np.ndarray: Shifted frame.
+    """
+    w, h = size
+    H, W = frame.shape[:2]
+    if out is None:
+        out = np.empty((h, w) + frame.shape[2:], dtype=frame.dtype)
+
+    if interpolation == cv.INTER_NEAREST:
+        ix, iy = int(round(x)), int(round(y))
+        fx = fy = 0.0
+    else:
+        ix, iy = int(np.floor(x)), int(np.floor(y))
+        fx, fy = x - ix, y - iy
+
+    # Output pixel (c, r) is taken from frame pixel (c - x, r - y). A blended axis also needs
+    # the previous frame pixel, so the covered area is one pixel smaller on that side
+    kx, ky = int(fx > 0), int(fy > 0)
+    c0, c1 = max(ix + kx, 0), min(W + ix, w)
+    r0, r1 = max(iy + ky, 0), min(H + iy, h)
+    if c0 >= c1 or r0 >= r1:
+        out[:] = 0
+        return out
+
+    # Black borders around the covered area
+    out[:r0] = 0
+    out[r1:] = 0
+    out[r0:r1, :c0] = 0
+    out[r0:r1, c1:] = 0
+
+    dst = out[r0:r1, c0:c1]
+    src = frame[r0 - iy - ky:r1 - iy, c0 - ix - kx:c1 - ix]
+    if not kx and not ky:
+        np.copyto(dst, src)
+        return out
+
+    if kx:
+        target = dst
+        if ky:
+            if scratch is None:
+                scratch = np.empty_like(frame)
+            target = scratch[:src.shape[0], :c1 - c0]
+        cv.addWeighted(src[:, 1:], 1 - fx, src[:, :-1], fx, 0, dst=target)
+        src = target
+    if ky:
+        cv.addWeighted(src[1:], 1 - fy, src[:-1], fy, 0, dst=dst)
+    return out
+
+def warp_frame(frame, corrective_motion, crop=None, out=None, interpolation=cv.INTER_LINEAR,
+               rotation_threshold=0.0, scratch=None):
     """
     Applies a 2D affine transformation (translation + rotation) to a frame
     using the provided corrective motion.
@@ -9,6 +104,13 @@ def warp_frame(frame, corrective_motion):
     Args:
         frame (np.ndarray): Original input frame (BGR).
         corrective_motion (tuple): (dx, dy, dtheta) in pixels and radians.
+        crop (tuple or None): Crop window (x, y, w, h) from crop_window. If given, only
+            this part of the warped frame is rendered, directly at the cropped size.
+        out (np.ndarray or None): Preallocated output of the rendered size.
+        interpolation (int): cv.INTER_LINEAR or cv.INTER_NEAREST.
+        rotation_threshold (float): Rotations smaller than this (in radians) are left out
+            and the frame is only shifted, which is much faster. 0 always warps.
+        scratch (np.ndarray or None): Buffer of the frame size used by the shift.
 
     Returns:
         np.ndarray: Warped (stabilized) frame.
@@ -18,6 +120,16 @@ def warp_frame(frame, corrective_motion):
     x = corrective_motion[0]
     y = corrective_motion[1]
     sin, cos = np.sin(corrective_motion[2]), np.cos(corrective_motion[2])
+
+    # Shift the output origin to the crop window
+    if crop is not None:
+        x -= crop[0]
+        y -= crop[1]
+        w, h = crop[2], crop[3]
+
+    # Negligible rotation, apply the translation alone
+    if abs(corrective_motion[2]) < rotation_threshold:
+        return shift_frame(frame, x, y, (w, h), out, interpolation, scratch)
     
     # Construct 2x3 affine transformation matrix
     T_corr = np.array(
@@ -29,6 +141,6 @@ def warp_frame(frame, corrective_motion):
     )
 
     # Apply affine transformation
-    smooth_frame = cv.warpAffine(frame, T_corr, (w, h))
+    smooth_frame = cv.warpAffine(frame, T_corr, (w, h), dst=out, flags=interpolation)
     
-    return smooth_frame
\ No newline at end of file
+    return smooth_frame
@@ -0,0 +1,205 @@
+"""
+Sweep of the smoother parameters over a recorded raw trajectory.
+
+Evaluates a grid of kalman_Q, kalman_R and correction limits on the raw motion
+saved by a run with 'motion_cache' enabled, without estimating motion again.
+All Kalman filters of the grid advance together as arrays, so hundreds of
+settings take about as long as one. For every setting the residual jitter of
+the stabilized trajectory and the share of the frame lost to cropping are
+reported, ranked from the smoothest setting within the crop loss limit.
+
+Usage:
+    python sweep.py [--config config.json] [--cache video.motion.npy] [--Q 1e-6 1e-5 ...]
+                    [--R 0.01 0.1 ...] [--max-shift 20 40 ...] [--max-rotation 2 5 ...]
+                    [--max-crop-loss 0.2] [--top 20] [--output sweep.csv]
+"""
+import argparse
+import csv
+
+import cv2 as cv
+import numpy as np
+
+from motion_cache import MotionCache, cache_path
+import utils
+
+
+def batch_kalman(trajectory, success, Q, R, dt=1.0):
+    """
+    Runs one constant-velocity Kalman filter per (Q, R) pair over the same trajectory,
+    all pairs at once. Equals Kalman3D, whose precomputed gains are those of the
+    covariance iterated here along with the state. Like in the stabilizer, the
+    filters start at the first frame, which is not filtered, and do not step on
+    frames whose motion could not be estimated.
+
+    Args:
+        trajectory (ndarray): Cumulative raw motion of shape (N, 3).
+        success (ndarray): Whether the motion of each frame was estimated, of shape (N,).
+        Q (ndarray): Process noise covariances of shape (C,).
+        R (ndarray): Measurement noise covariances of shape (C,).
+
+    Returns:
+        ndarray: Smoothed trajectories of shape (C, N, 3).
+    """
+    n = len(trajectory)
+    smoothed = np.empty((len(Q), n, 3))
+
+    # Position and velocity of every filter and component, starting at the first frame
+    pos = np.tile(trajectory[0], (len(Q), 1)) if n else np.zeros((len(Q), 3))
+    vel = np.zeros((len(Q), 3))
+    if n:
+        smoothed[:, 0] = pos
+
+    # Covariance of every filter, starting from the identity like kalman_gains
+    p00 = np.ones(len(Q))
+    p01 = np.zeros(len(Q))
+    p11 = np.ones(len(Q))
+    q00, q01, q11 = Q * dt**4 / 4, Q * dt**3 / 2, Q * dt**2
+
+    for k in range(1, n):
+        # A failed frame leaves the filters as they are
+        if not success[k]:
+            smoothed[:, k] = pos
+            continue
+
+        # Predict the covariance and compute the gains
+        p00 = p00 + 2 * dt * p01 + dt * dt * p11 + q00
+        p01 = p01 + dt * p11 + q01
+        p11 = p11 + q11
+        alpha = p00 / (p00 + R)
+        beta = p01 / (p00 + R)
+        p11 = p11 - beta * p01
+        p00, p01 = (1 - alpha) * p00, (1 - alpha) * p01
+
+        # Predict and update the state
+        pos += vel * dt
+        innovation = trajectory[k] - pos
+        vel += innovation * beta[:, None]
+        pos += innovation * alpha[:, None]
+        smoothed[:, k] = pos
+
+    return smoothed
+
+
+def evaluate(trajectory, success, smoothed, limits, size):
+    """
+    Computes the metrics of the stabilized trajectories for one set of correction limits.
+
+    Args:
+        trajectory (ndarray): Cumulative raw motion of shape (N, 3).
+        success (ndarray): Whether the motion of each frame was estimated, of shape (N,).
+        smoothed (ndarray): Smoothed trajectories of shape (C, N, 3).
+        limits (ndarray): Maximum corrections (x, y, rotation in radians).
+        size (tuple): (width, height) of the frames.
+
+    Returns:
+        tuple: (jitter_px, jitter_deg, crop_loss) arrays of shape (C,).
+    """
+    w, h = size
+    corrections = np.clip(smoothed - trajectory, -limits, limits)
+
+    # The stabilizer outputs the last stabilized frame again when estimation fails
+    shown = np.maximum.accumulate(np.where(success, np.arange(len(success)), 0))
+    corrections = corrections[:, shown]
+    stabilized = trajectory[shown] + corrections
+
+    # Residual jitter: second difference of the stabilized trajectory, zero for a steady pan
+    accel = np.diff(stabilized, n=2, axis=1)
+    jitter_px = np.sqrt(np.mean(accel[..., 0] ** 2 + accel[..., 1] ** 2, axis=1))
+    jitter_deg = np.degrees(np.sqrt(np.mean(accel[..., 2] ** 2, axis=1)))
+
+    # Margins hiding the borders uncovered by the largest corrections,
+    # a rotation moves the frame corners by about the angle times half the other side
+    rotation = np.abs(corrections[..., 2])
+    margin_x = np.max(np.abs(corrections[..., 0]) + rotation * h / 2, axis=1)
+    margin_y = np.max(np.abs(corrections[..., 1]) + rotation * w / 2, axis=1)
+    kept = np.clip(w - 2 * margin_x, 0, None) * np.clip(h - 2 * margin_y, 0, None)
+    crop_loss = 1 - kept / (w * h)
+
+    return jitter_px, jitter_deg, crop_loss
+
+
+def load_trajectory(path):
+    """
+    Loads the cumulative raw trajectory from a motion cache file, along with
+    which frames had their motion estimated. Failed frames do not move it.
+
+    Returns:
+        tuple: (trajectory, success) arrays of shape (N, 3) and (N,).
+    """
+    cache = MotionCache(path)
+    if not cache.is_loaded:
+        raise IOError(f"Motion cache not found: {path}")
+    motion, success, _ = cache.to_arrays(len(cache.records))
+    return np.cumsum(motion, axis=0), success
+
+
+def video_size(config):
+    capture = cv.VideoCapture(config["input_video_path"])
+    if not capture.isOpened():
+        raise IOError(f"Failed to open video file: {config['input_video_path']}")
+    size = int(capture.get(cv.CAP_PROP_FRAME_WIDTH)), int(capture.get(cv.CAP_PROP_FRAME_HEIGHT))
+    capture.release()
+    return size
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rank smoother settings on a recorded raw trajectory.")
+    parser.add_argument("--config", default="config.json", help="configuration of the recorded run")
+    parser.add_argument("--cache", default=None, help="motion cache file (default: the one of the configuration)")
+    parser.add_argument("--size", type=int, nargs=2, default=None, metavar=("WIDTH", "HEIGHT"),
+                        help="frame size (default: read from the input video)")
+    parser.add_argument("--Q", type=float, nargs="+", default=list(np.logspace(-7, -2, 11)), help="kalman_Q values")
+    parser.add_argument("--R", type=float, nargs="+", default=list(np.logspace(-3, 1, 9)), help="kalman_R values")
+    parser.add_argument("--max-shift", type=float, nargs="+", default=None,
+                        help="horizontal and vertical correction limits in px (default: the configured ones)")
+    parser.add_argument("--max-rotation", type=float, nargs="+", default=None,
+                        help="rotation correction limits in degrees (default: the configured one)")
+    parser.add_argument("--max-crop-loss", type=float, default=0.2, help="largest share of the frame lost to cropping")
+    parser.add_argument("--top", type=int, default=20, help="number of ranked settings to print")
+    parser.add_argument("--output", default=None, help="CSV file receiving all evaluated settings")
+    args = parser.parse_args()
+
+    config = utils.load_and_validate_config(args.config)
+    trajectory, success = load_trajectory(args.cache or cache_path(config))
+    size = tuple(args.size) if args.size else video_size(config)
+
+    # Every (Q, R) pair is one filter of the batch
+    Q, R = (a.ravel() for a in np.meshgrid(args.Q, args.R, indexing="ij"))
+    smoothed = batch_kalman(trajectory, success, Q, R)
+
+    shifts = [(s, s) for s in args.max_shift] if args.max_shift else [(config["max_horizontal_shift"], config["max_vertical_shift"])]
+    rotations = args.max_rotation or [config["max_rotation"]]
+
+    rows = []
+    for max_x, max_y in shifts:
+        for max_r in rotations:
+            limits = np.array([max_x, max_y, np.deg2rad(max_r)])
+            jitter_px, jitter_deg, crop_loss = evaluate(trajectory, success, smoothed, limits, size)
+            for i in range(len(Q)):
+                rows.append((Q[i], R[i], max_x, max_y, max_r, jitter_px[i], jitter_deg[i], crop_loss[i]))
+
+    # Smoothest first among the settings within the crop loss limit, the others after them
+    rows.sort(key=lambda row: (row[7] > args.max_crop_loss, row[5]))
+
+    raw_accel = np.diff(trajectory, n=2, axis=0)
+    print(f"{len(trajectory)} frames ({np.count_nonzero(~success)} failed), {len(rows)} settings, raw jitter "
+          f"{np.sqrt(np.mean(raw_accel[:, 0] ** 2 + raw_accel[:, 1] ** 2)):.3f} px, "
+          f"{np.degrees(np.sqrt(np.mean(raw_accel[:, 2] ** 2))):.4f} deg")
+    print(f"{'rank':>4} | {'kalman_Q':>9} | {'kalman_R':>9} | {'max x':>6} | {'max y':>6} | {'max r':>5} | "
+          f"{'jitter px':>9} | {'jitter deg':>10} | {'crop loss':>9}")
+    for rank, (q, r, max_x, max_y, max_r, jpx, jdeg, loss) in enumerate(rows[:args.top], 1):
+        flag = "" if loss <= args.max_crop_loss else " (over limit)"
+        print(f"{rank:>4} | {q:9.2e} | {r:9.2e} | {max_x:6g} | {max_y:6g} | {max_r:5g} | "
+              f"{jpx:9.3f} | {jdeg:10.4f} | {100 * loss:8.1f}%{flag}")
+
+    if args.output:
+        with open(args.output, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["kalman_Q", "kalman_R", "max_horizontal_shift", "max_vertical_shift", "max_rotation",
+                             "jitter_px", "jitter_deg", "crop_loss"])
+            writer.writerows(rows)
+        print(f"All settings saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
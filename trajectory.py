@@ -0,0 +1,88 @@
+import numpy as np
+
+from npy_stream import NpyStreamWriter
+
+# Cumulative raw and smoothed motion of one frame, as returned by Stabilizer.export_trajectory_data
+TRAJECTORY_DTYPE = np.dtype([
+    ("x_raw", "<f8"), ("y_raw", "<f8"), ("r_raw", "<f8"),
+    ("x_smooth", "<f8"), ("y_smooth", "<f8"), ("r_smooth", "<f8"),
+])
+
+
+class TrajectoryStore:
+    def __init__(self, path=None, keep=0, capacity=1024, keep_all=True):
+        """
+        Trajectory of every frame in a preallocated structured array. Without a path
+        the array doubles when full. With a path, full arrays are appended to a .npy
+        file and only the last keep records stay in memory, so memory is bounded.
+        Without a path and without keep_all, older records are dropped the same way.
+
+        Args:
+            path (str or None): .npy file the records are streamed to.
+            keep (int): Number of most recent records tail() must return.
+            capacity (int): Initial number of records of the array.
+            keep_all (bool): Whether data() must return every record when there is no path.
+        """
+        self.path = path
+        self.keep = keep
+        self.keep_all = keep_all
+        self.records = np.zeros(max(capacity, 2 * keep), dtype=TRAJECTORY_DTYPE)
+        self.size = 0 # Records in memory
+        self.written = 0 # Records in memory already written to the file
+        self.count = 0 # Records in total
+
+        self.writer = None
+        if path is not None:
+            self.writer = NpyStreamWriter(path, TRAJECTORY_DTYPE)
+
+    def __len__(self):
+        return self.count
+
+    def append(self, trajectory):
+        """
+        Appends the trajectory of the next frame: (x_raw, y_raw, r_raw, x_smooth, y_smooth, r_smooth).
+        """
+        if self.size == len(self.records):
+            self.make_room()
+        self.records[self.size] = tuple(trajectory)
+        self.size += 1
+        self.count += 1
+
+    def make_room(self):
+        if self.writer is None and self.keep_all:
+            records = np.zeros(2 * len(self.records), dtype=TRAJECTORY_DTYPE)
+            records[:self.size] = self.records[:self.size]
+            self.records = records
+            return
+
+        # Write the array out, if streaming, and keep only its end
+        self.flush()
+        self.records[:self.keep] = self.records[self.size - self.keep:self.size]
+        self.size = self.written = self.keep
+
+    def flush(self):
+        """Writes the records not written yet to the file, if any."""
+        if self.writer is not None and self.written < self.size:
+            self.writer.write(self.records[self.written:self.size])
+            self.written = self.size
+
+    def tail(self, n):
+        """Returns the last n records, at most keep unless every record is kept in memory."""
+        return self.records[max(self.size - n, 0):self.size]
+
+    def data(self):
+        """
+        Returns the records of all frames, memory-mapped from the file when streaming.
+        """
+        if self.path is None:
+            return self.records[:self.size]
+        self.close()
+        return np.load(self.path, mmap_mode="r")
+
+    def close(self):
+        """Writes the remaining records and the final header to the file."""
+        if self.writer is None:
+            return
+        self.flush()
+        self.writer.close()
+        self.writer = None
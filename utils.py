@@ -5,10 +5,13 @@ import sys
 import platform
 import os
 
+from stabilizer.transform import crop_window
+from stabilizer.frame_format import FRAME_FORMATS, frame_size, to_bgr
+
 def load_and_validate_config(path):
     """
     Load configuration from a JSON file, create an empty config file if missing,
-    then validate and set default parameters with proper types and value checks.
+    then validate it with validate_config.
     """
     # Create empty config file if it does not exist
     if not os.path.exists(path):
@@ -19,6 +22,14 @@ def load_and_validate_config(path):
     with open(path, 'r') as f:
         config = json.load(f)
 
+    return validate_config(config)
+
+
+def validate_config(config):
+    """
+    Validate a configuration dictionary in place, setting default parameters
+    with proper types and value checks. Returns the same dictionary.
+    """
     def set_and_validate(key, default, expected_type, condition=lambda x: True, description=""):
         """
         Helper function to set default config values and validate their type and condition.
@@ -29,10 +40,11 @@ def load_and_validate_config(path):
             raise ValueError(f"Invalid value for '{key}'. Expected {description}.")
         return value
 
-     # Validate source parameter (either 'camera' or 'video')
+     # Validate source parameter ('camera', 'video' or the name of a source backend)
+    from source import SOURCE_BACKENDS, source_backend
     source = config.setdefault("source_of_frames", "camera")
-    if source not in ["camera", "video"]:
-        raise ValueError("Invalid value for 'source_of_frames'. Expected 'camera' or 'video'.")
+    if source not in ["camera", "video"] and source not in SOURCE_BACKENDS:
+        raise ValueError(f"Invalid value for 'source_of_frames'. Expected 'camera', 'video' or one of {sorted(SOURCE_BACKENDS)}.")
 
     # If video source, validate video file path
     if source == "video":
@@ -40,6 +52,39 @@ def load_and_validate_config(path):
         if not isinstance(path, str) or not path:
             raise ValueError("Invalid value for 'input_video_path'. Expected non-empty string when 'source_of_frames' = 'video'.")
 
+    # If camera source, validate the camera backend
+    if source == "camera":
+        backend = config.setdefault("camera_backend", "auto")
+        if backend not in ["auto", "opencv", "picamera2"]:
+            raise ValueError("Invalid value for 'camera_backend'. Expected 'auto', 'opencv' or 'picamera2'.")
+        set_and_validate("camera_index", 0, int, lambda x: x >= 0, "non-negative integer")
+
+    # If raw frame replay, validate the recording path
+    if source == "raw":
+        path = config.get("input_raw_path")
+        if not isinstance(path, str) or not path:
+            raise ValueError("Invalid value for 'input_raw_path'. Expected non-empty string when 'source_of_frames' = 'raw'.")
+    set_and_validate("record_raw_to", None, (str, type(None)), description="string")
+
+    # If synthetic source, validate the size of the clip
+    if source == "synthetic":
+        res = config.setdefault("synthetic_resolution", [640, 360])
+        if (
+            not isinstance(res, (list, tuple)) or
+            len(res) != 2 or
+            not all(isinstance(x, int) and x > 0 for x in res)
+        ):
+            raise ValueError("Invalid value for 'synthetic_resolution'. Expected [width, height] with positive integers.")
+        set_and_validate("synthetic_frame_count", 300, int, lambda x: x > 1, "integer greater than 1")
+        set_and_validate("synthetic_fps", None, (int, float, type(None)), lambda x: x is None or x > 0, "positive number")
+
+    # Validate the latest-frame grabber, which drops frames and is meant for sources paced by a clock.
+    # Files, raw recordings and an unpaced synthetic clip deliver frames as fast as they are read
+    set_and_validate("camera_grabber", False, bool, description="boolean")
+    paced = source_backend(config) in ["opencv_device", "picamera2"] or (source == "synthetic" and config["synthetic_fps"] is not None)
+    if config["camera_grabber"] and not paced:
+        raise ValueError("Invalid value for 'camera_grabber'. The grabber requires a camera or a synthetic source with 'synthetic_fps'.")
+
     # If camera source on non-Windows systems, validate picamera2 parameters
     if source == "camera" and not IS_WINDOWS:
         res = config.setdefault("picamera2_resolution", [640, 360])
@@ -52,62 +97,188 @@ def load_and_validate_config(path):
 
         set_and_validate("picamera2_fps", 24, int, lambda x: x > 0, "positive integer")
 
+    # Validate the frame format, YUV420 frames come from Picamera2 or from a recording of them
+    frame_format = config.setdefault("frame_format", "bgr")
+    if frame_format not in FRAME_FORMATS:
+        raise ValueError(f"Invalid value for 'frame_format'. Expected one of {FRAME_FORMATS}.")
+    if frame_format == "yuv420" and source_backend(config) not in ["picamera2", "raw"]:
+        raise ValueError("Invalid value for 'frame_format'. 'yuv420' requires a Picamera2 camera or 'source_of_frames' = 'raw'.")
+
     # Validate display mode flags (booleans)
     set_and_validate("display_output", True, bool, description="boolean")
     for key in ["plot_trajectory", "crop_result", "show_combined"]:
         set_and_validate(key, False, bool, description="boolean")
 
+    # Validate trajectory recording and live plot parameters
+    set_and_validate("trajectory_output_path", None, (str, type(None)), description="string")
+    set_and_validate("live_plot", False, bool, description="boolean")
+    set_and_validate("live_plot_window", 300, int, lambda x: x > 1, "integer greater than 1")
+    set_and_validate("live_plot_fps", 2, (int, float), lambda x: x > 0, "positive number")
+
     # Validate margins for cropping (non-negative integers)
     set_and_validate("margin_x", 30, int, lambda x: x >= 0, "non-negative integer")
     set_and_validate("margin_y", 10, int, lambda x: x >= 0, "non-negative integer")
+    set_and_validate("fused_warp_crop", True, bool, description="boolean")
+
+    # Validate warp parameters
+    interpolation = config.setdefault("warp_interpolation", "linear")
+    if interpolation not in ["linear", "nearest"]:
+        raise ValueError("Invalid value for 'warp_interpolation'. Expected 'linear' or 'nearest'.")
+    set_and_validate("warp_rotation_threshold", 0, (int, float), lambda x: x >= 0, "non-negative number")
 
     # Validate stabilization parameters with ranges and types
     set_and_validate("static_scene_threshold", 0, (int, float), lambda x: x >= 0, "non-negative number")
     set_and_validate("max_feature_count", 300, int, lambda x: x > 0, "positive integer")
     set_and_validate("resize_ratio", 1.0, (int, float), lambda x: 0 < x <= 1.0, "positive number in range (0, 1]")
+    set_and_validate("analysis_width", None, (int, type(None)), lambda x: x is None or x > 0, "positive integer")
+    # Picamera2 cannot scale its lores stream up, other sources are checked against their first frame
+    if config["analysis_width"] is not None and source_backend(config) == "picamera2":
+        if config["analysis_width"] >= config["picamera2_resolution"][0]:
+            raise ValueError("Invalid value for 'analysis_width'. Expected a width smaller than that of 'picamera2_resolution'.")
+    set_and_validate("target_fps", None, (int, float, type(None)), lambda x: x is None or x > 0, "positive number")
+    set_and_validate("estimation_interval", 1, int, lambda x: x > 0, "positive integer")
+    set_and_validate("estimation_max_motion", None, (int, float, type(None)), lambda x: x is None or x > 0, "positive number")
+
+    # Validate motion cache parameters
+    set_and_validate("motion_cache", False, bool, description="boolean")
+    set_and_validate("motion_cache_dir", None, (str, type(None)), description="string")
+    if config["motion_cache"] and source != "video":
+        raise ValueError("Invalid value for 'motion_cache'. The cache requires 'source_of_frames' = 'video'.")
+
+    # Validate motion estimation method ('orb' matching or 'klt' tracking)
+    method = config.setdefault("motion_estimation_method", "orb")
+    if method not in ["orb", "klt"]:
+        raise ValueError("Invalid value for 'motion_estimation_method'. Expected 'orb' or 'klt'.")
+    set_and_validate("klt_min_track_count", 100, int, lambda x: x >= 10, "integer of at least 10")
+
+    # Validate tiled ORB detection parameters
+    grid = config.setdefault("feature_grid", None)
+    if grid is not None and (
+        not isinstance(grid, (list, tuple)) or
+        len(grid) != 2 or
+        not all(isinstance(x, int) and x > 0 for x in grid)
+    ):
+        raise ValueError("Invalid value for 'feature_grid'. Expected [columns, rows] with positive integers or null.")
+    if grid is not None and method != "orb":
+        raise ValueError("Invalid value for 'feature_grid'. Tiled detection requires 'motion_estimation_method' = 'orb'.")
+    set_and_validate("feature_grid_overlap", 32, int, lambda x: x >= 0, "non-negative integer")
+    set_and_validate("feature_threads", None, (int, type(None)), lambda x: x is None or x > 0, "positive integer")
+
+    # Validate descriptor matching parameters
+    matcher = config.setdefault("matcher", "bf")
+    if matcher not in ["bf", "ratio", "flann"]:
+        raise ValueError("Invalid value for 'matcher'. Expected 'bf', 'ratio' or 'flann'.")
+    # The KLT tracker does not match descriptors, only the default is accepted with it
+    if matcher != "bf" and method != "orb":
+        raise ValueError("Invalid value for 'matcher'. Descriptor matchers require 'motion_estimation_method' = 'orb'.")
+    set_and_validate("match_ratio", 0.75, (int, float), lambda x: 0 < x < 1, "number in range (0, 1)")
+    set_and_validate("max_match_count", None, (int, type(None)), lambda x: x is None or x >= 10, "integer of at least 10")
+
+    # Validate keyframe mode parameters
+    set_and_validate("keyframe_mode", False, bool, description="boolean")
+    set_and_validate("keyframe_min_inliers", 60, int, lambda x: x >= 10, "integer of at least 10")
+    set_and_validate("keyframe_min_overlap", 0.8, (int, float), lambda x: 0 <= x <= 1, "number in range [0, 1]")
+    # The KLT tracker follows the previous frame's points and has no keyframe
+    if config["keyframe_mode"] and method != "orb":
+        raise ValueError("Invalid value for 'keyframe_mode'. Keyframes require 'motion_estimation_method' = 'orb'.")
     
     set_and_validate("kalman_Q", 1e-5, (int, float), lambda x: x > 0, "positive number")
     set_and_validate("kalman_R", 5e-2, (int, float), lambda x: x > 0, "positive number")
+    backend = config.setdefault("smoother_backend", "builtin")
+    if backend not in ["builtin", "filterpy"]:
+        raise ValueError("Invalid value for 'smoother_backend'. Expected 'builtin' or 'filterpy'.")
 
     set_and_validate("max_horizontal_shift", 1000, int, lambda x: x >= 0, "non-negative integer")
     set_and_validate("max_vertical_shift", 1000, int, lambda x: x >= 0, "non-negative integer")
     set_and_validate("max_rotation", 90, int, lambda x: x >= 0, "non-negative integer")
+    set_and_validate("smoothing_lag", 0, int, lambda x: x >= 0, "non-negative integer")
+
+    # Validate processing mode and multi-threaded pipeline parameters
+    mode = config.setdefault("processing_mode", "serial")
+    if mode not in ["serial", "pipeline", "offline", "multistream"]:
+        raise ValueError("Invalid value for 'processing_mode'. Expected 'serial', 'pipeline', 'offline' or 'multistream'.")
+    if mode == "offline" and source != "video":
+        raise ValueError("Invalid value for 'processing_mode'. 'offline' requires 'source_of_frames' = 'video'.")
+    if config["smoothing_lag"] > 0 and mode not in ["serial", "multistream"]:
+        raise ValueError("Invalid value for 'smoothing_lag'. A lag requires 'processing_mode' = 'serial'.")
+    if config["live_plot"] and mode != "serial":
+        raise ValueError("Invalid value for 'live_plot'. The live plot requires 'processing_mode' = 'serial'.")
+    # Which frames the quality controller estimates depends on timing, so its motion cannot be cached
+    if config["motion_cache"] and config["target_fps"] is not None and mode != "offline":
+        raise ValueError("Invalid value for 'motion_cache'. The cache cannot be used with 'target_fps'.")
+
+    set_and_validate("pipeline_queue_size", 4, int, lambda x: x > 0, "positive integer")
+    set_and_validate("pipeline_warp_threads", 2, int, lambda x: x > 0, "positive integer")
+    set_and_validate("opencv_threads", None, (int, type(None)), lambda x: x is None or x >= 0, "non-negative integer")
+
+    # Validate offline (two-pass) mode parameters
+    set_and_validate("offline_workers", None, (int, type(None)), lambda x: x is None or x > 0, "positive integer")
+    set_and_validate("offline_chunk_size", 100, int, lambda x: x > 0, "positive integer")
+    set_and_validate("offline_max_frames_in_flight", 200, int, lambda x: x > 0, "positive integer")
+    smoother = config.setdefault("offline_smoother", "gaussian")
+    if smoother not in ["gaussian", "rts"]:
+        raise ValueError("Invalid value for 'offline_smoother'. Expected 'gaussian' or 'rts'.")
+    set_and_validate("offline_smoothing_sigma", 15, (int, float), lambda x: x > 0, "positive number")
 
     # Validate logging and saving options
     set_and_validate("log_message", False, bool, description="boolean")
     set_and_validate("measure_performance", False, bool, description="boolean")
     set_and_validate("save_log_to", None, (str, type(None)), description="string")
+    set_and_validate("log_history_size", 10000, int, lambda x: x > 0, "positive integer")
+    set_and_validate("metrics_output_path", None, (str, type(None)), description="string")
+    set_and_validate("metrics_interval", 100, int, lambda x: x > 0, "positive integer")
 
     set_and_validate("save_output_video_to", None, (str, type(None)), description="string")
     set_and_validate("output_video_fps", 25, int, lambda x: x > 0, "positive integer")
 
+    # Validate multi-stream parameters, every stream is validated as a configuration of its own
+    set_and_validate("stream_name", None, (str, type(None)), description="string")
+    set_and_validate("multistream_workers", None, (int, type(None)), lambda x: x is None or x > 0, "positive integer")
+    if mode == "multistream":
+        config["streams"] = validate_streams(config)
+
     return config
 
 
-def show_result(config, frame_smooth, frame_raw):
+def validate_streams(config):
     """
-    Display the stabilized frame alongside the raw frame if configured,
-    otherwise show only the stabilized frame.
-    Returns whether display is on and the resulting image to be shown.
+    Merge the overrides of every stream in 'streams' with the rest of the configuration
+    and validate the result. Streams run headless in serial or pipeline mode and must not
+    share output files. Returns the list of validated stream configurations.
     """
-    if config["show_combined"]:
-        raw_h, raw_w = frame_raw.shape[:2]
-        smooth_h, smooth_w = frame_smooth.shape[:2]
+    streams = config.get("streams")
+    if not isinstance(streams, list) or not streams or not all(isinstance(s, dict) for s in streams):
+        raise ValueError("Invalid value for 'streams'. Expected non-empty list of objects when 'processing_mode' = 'multistream'.")
 
-        if (raw_h, raw_w) != (smooth_h, smooth_w):
-            # Create black background matching raw frame size
-            background = np.zeros_like(frame_raw)
+    base = {key: value for key, value in config.items() if key not in ["streams", "multistream_workers"]}
+    stream_configs = []
+    for i, overrides in enumerate(streams):
+        stream = {**base, "processing_mode": "serial", "stream_name": f"stream{i}", **overrides}
+        if stream["processing_mode"] not in ["serial", "pipeline"]:
+            raise ValueError(f"Invalid value for 'processing_mode' of stream {i}. Expected 'serial' or 'pipeline'.")
 
-            # Center the stabilized frame within the background
-            margin_y = (raw_h - smooth_h) // 2
-            margin_x = (raw_w - smooth_w) // 2
+        # Worker processes cannot display or plot
+        stream["display_output"] = False
+        stream["plot_trajectory"] = False
+        stream["live_plot"] = False
+        stream_configs.append(validate_config(stream))
 
-            background[margin_y:margin_y+smooth_h, margin_x:margin_x+smooth_w] = frame_smooth
-            result = np.hstack((frame_raw, background))
-        else:
-            result = np.hstack((frame_raw, frame_smooth))
-    else:
-        result = frame_smooth
+    # Every stream writes its own files
+    for key in ["save_output_video_to", "save_log_to", "metrics_output_path", "trajectory_output_path", "record_raw_to"]:
+        paths = [stream[key] for stream in stream_configs if stream[key] is not None]
+        if len(paths) != len(set(paths)):
+            raise ValueError(f"Invalid value for '{key}'. Expected a different path for every stream.")
+
+    return stream_configs
+
+
+def show_result(config, frame_smooth, frame_raw, out=None):
+    """
+    Display the stabilized frame alongside the raw frame if configured,
+    otherwise show only the stabilized frame.
+    Returns whether display is on and the resulting image to be shown.
+    """
+    result = compose_result(config, frame_smooth, frame_raw, out)
 
     # Display preview if enabled
     if config["display_output"]:
@@ -116,6 +287,46 @@ def show_result(config, frame_smooth, frame_raw):
     return config["display_output"], result
 
 
+def compose_result(config, frame_smooth, frame_raw, out=None):
+    """
+    Place the stabilized frame next to the raw frame if configured,
+    otherwise return only the stabilized frame. The side-by-side image is
+    written into out if given, a zero-filled canvas twice as wide as the raw frame.
+    """
+    if not config["show_combined"]:
+        return frame_smooth
+
+    raw_w, raw_h = frame_size(frame_raw, config["frame_format"])
+    smooth_h, smooth_w = frame_smooth.shape[:2]
+
+    if out is not None:
+        # Borders around a smaller stabilized frame keep the zeros of the canvas
+        margin_y = (raw_h - smooth_h) // 2
+        margin_x = raw_w + (raw_w - smooth_w) // 2
+        if config["frame_format"] == "bgr":
+            out[:, :raw_w] = frame_raw
+        else:
+            to_bgr(frame_raw, config["frame_format"], out[:, :raw_w])
+        out[margin_y:margin_y+smooth_h, margin_x:margin_x+smooth_w] = frame_smooth
+        return out
+
+    # The raw frame is only converted to BGR for being shown
+    frame_raw = to_bgr(frame_raw, config["frame_format"])
+
+    if (raw_h, raw_w) != (smooth_h, smooth_w):
+        # Create black background matching raw frame size
+        background = np.zeros_like(frame_raw)
+
+        # Center the stabilized frame within the background
+        margin_y = (raw_h - smooth_h) // 2
+        margin_x = (raw_w - smooth_w) // 2
+
+        background[margin_y:margin_y+smooth_h, margin_x:margin_x+smooth_w] = frame_smooth
+        return np.hstack((frame_raw, background))
+
+    return np.hstack((frame_raw, frame_smooth))
+
+
 def crop_stabilized_frame(config, result):
     """
     Crop the stabilized frame based on configured margins to remove borders,
@@ -124,21 +335,8 @@ def crop_stabilized_frame(config, result):
     if not config["crop_result"]:
         return result
     
-    margin_x = config["margin_x"]
-    margin_y = config["margin_y"]
-
     h, w = result.shape[:2]
-    crop_w = w - 2 * margin_x
-    crop_h = h - 2 * margin_y
-
-    if crop_w <= 0 or crop_h <= 0:
-        raise ValueError("Margins too large for frame size.")
-
-    center_x = w // 2
-    center_y = h // 2
-
-    x1 = center_x - crop_w // 2
-    y1 = center_y - crop_h // 2
+    x1, y1, crop_w, crop_h = crop_window(w, h, config["margin_x"], config["margin_y"])
     x2 = x1 + crop_w
     y2 = y1 + crop_h
 
@@ -213,6 +411,9 @@ else:
 
     def check_exit_key():
         # Return True if ESC key is pressed (Linux)
+        # Without a terminal (e.g. in worker processes) no key can be pressed
+        if sys.stdin is None or not sys.stdin.isatty():
+            return False
         dr, _, _ = select.select([sys.stdin], [], [], 0)
         if dr:
             fd = sys.stdin.fileno()
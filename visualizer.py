@@ -1,48 +1,145 @@
-import matplotlib.pyplot as plt
+import time
+
 import numpy as np
 
+from trajectory import TrajectoryStore
+
+# Keys and labels of the trajectory components
+KEYS = ["x", "y", "r"]
+LABELS = ["X", "Y", "Angle (°)"]
+
 
 class TrajectoryPlotter:
+    # Most points drawn per line in the live view
+    LIVE_POINTS = 200
+
     def __init__(self, config):
         # Check if trajectory plotting is enabled in the config
         self.enabled = config["plot_trajectory"]
-        if not self.enabled:
-            return 
-        
-        # Initialize containers for raw and smoothed trajectory data (translation (x, y) + angle (r))
-        self.raw = {"x": [], "y": [], "r": []}
-        self.smooth = {"x": [], "y": [], "r": []}
+        self.live = config["live_plot"]
+        self.store = None
+        if not (self.enabled or self.live or config["trajectory_output_path"]):
+            return
+
+        # Raw and smoothed trajectory (translation (x, y) + angle (r)) of every frame,
+        # streamed to a file if a path is set. The live view alone only needs its window
+        self.window = config["live_plot_window"]
+        self.store = TrajectoryStore(config["trajectory_output_path"], keep=self.window if self.live else 0,
+                                     keep_all=self.enabled)
+
+        # The live view is redrawn at most live_plot_fps times per second
+        self.live_interval = 1 / config["live_plot_fps"]
+        self.last_draw = 0.0
+        self.figure = None
 
     def collect(self, trajectory):
-        # Skip if plotting is disabled
-        if not self.enabled:
+        # Skip if no trajectory is recorded
+        if self.store is None:
             return
-        
-        # Append new data for raw and smoothed trajectories
-        self.raw["x"].append(trajectory[0])
-        self.raw["y"].append(trajectory[1])
-        self.raw["r"].append(trajectory[2])
-        self.smooth["x"].append(trajectory[3])
-        self.smooth["y"].append(trajectory[4])
-        self.smooth["r"].append(trajectory[5])
+
+        self.store.append(trajectory)
+
+        if self.live:
+            now = time.perf_counter()
+            if now - self.last_draw >= self.live_interval:
+                self.last_draw = now
+                self.draw_live()
+
+    def init_live(self):
+        """
+        Opens the live view. The lines are animated, so they are left out of the
+        background, which is only redrawn when the axis limits change.
+        """
+        # Imported here so matplotlib is only loaded when plotting
+        import matplotlib.pyplot as plt
+
+        self.figure, self.axes = plt.subplots(len(KEYS), 1, figsize=(10, 8), sharex=True)
+        self.figure.suptitle("Camera Trajectories (Raw vs Smoothed)", fontsize=12)
+        self.lines = []
+        for ax, label in zip(self.axes, LABELS):
+            raw_line, = ax.plot([], [], label="Raw", animated=True)
+            smooth_line, = ax.plot([], [], label="Smooth", animated=True)
+            self.lines.append((raw_line, smooth_line))
+            ax.set_xlim(-self.window, 0)
+            ax.set_ylim(-1, 1)
+            ax.set_ylabel(label)
+            ax.legend(loc="upper left")
+            ax.grid(True)
+        self.axes[-1].set_xlabel("Frames ago")
+
+        plt.show(block=False)
+        self.draw_background()
+
+    def draw_background(self):
+        self.figure.canvas.draw()
+        self.background = self.figure.canvas.copy_from_bbox(self.figure.bbox)
+
+    def draw_live(self):
+        """
+        Redraws the last live_plot_window frames, decimated to at most LIVE_POINTS
+        per line, by blitting the lines onto the saved background.
+        """
+        if self.figure is None:
+            self.init_live()
+
+        data = self.store.tail(self.window)
+        step = -(-len(data) // self.LIVE_POINTS)
+        indices = np.arange(len(data) - 1, -1, -step)[::-1]
+        x = indices - (len(data) - 1)
+
+        # Grow the axis limits when the trajectory leaves them, which needs a full redraw.
+        # They grow by at least half their span, so drifting trajectories rarely cause one
+        series = []
+        rescaled = False
+        for key, ax in zip(KEYS, self.axes):
+            raw = data[f"{key}_raw"][indices]
+            smooth = data[f"{key}_smooth"][indices]
+            if key == "r":
+                raw, smooth = np.degrees(raw), np.degrees(smooth)
+            series.append((raw, smooth))
+
+            low, high = min(raw.min(), smooth.min()), max(raw.max(), smooth.max())
+            bottom, top = ax.get_ylim()
+            if low < bottom or high > top:
+                low, high = min(low, bottom), max(high, top)
+                margin = 0.25 * (high - low)
+                ax.set_ylim(low - margin, high + margin)
+                rescaled = True
+        if rescaled:
+            self.draw_background()
+
+        canvas = self.figure.canvas
+        canvas.restore_region(self.background)
+        for ax, (raw_line, smooth_line), (raw, smooth) in zip(self.axes, self.lines, series):
+            raw_line.set_data(x, raw)
+            smooth_line.set_data(x, smooth)
+            ax.draw_artist(raw_line)
+            ax.draw_artist(smooth_line)
+        canvas.blit(self.figure.bbox)
+        canvas.flush_events()
+
+    def close(self):
+        """Finishes the trajectory file, if any."""
+        if self.store is not None:
+            self.store.close()
 
     def display(self):
         # Skip if plotting is disabled
         if not self.enabled:
             return
-        
-        # Keys and labels for plotting
-        keys = ["x", "y", "r"]
-        labels = ["X", "Y", "Angle (°)"]
+
+        import matplotlib.pyplot as plt
+
+        data = self.store.data()
 
         # Create subplots for each trajectory component
-        fig, axs = plt.subplots(len(keys), 1, figsize=(10, 8), sharex=True)
+        fig, axs = plt.subplots(len(KEYS), 1, figsize=(10, 8), sharex=True)
         fig.suptitle("Camera Trajectories (Raw vs Smoothed)", fontsize=12)
 
         # Plot raw vs smoothed trajectories
-        for i, key in enumerate(keys):
-            raw_data = self.raw[key]
-            smooth_data = self.smooth[key]
+        for i, key in enumerate(KEYS):
+            raw_data = data[f"{key}_raw"]
+            smooth_data = data[f"{key}_smooth"]
 
             # Convert angles from radians to degrees
             if key == "r":
@@ -52,9 +149,9 @@ class TrajectoryPlotter:
             axs[i].plot(raw_data, label="Raw")
             axs[i].plot(smooth_data, label="Smooth")
             axs[i].legend()
-            axs[i].set_ylabel(labels[i])
+            axs[i].set_ylabel(LABELS[i])
             axs[i].grid(True)
         axs[2].set_xlabel("Frames")
 
         plt.tight_layout(rect=[0, 0, 1, 0.95])
-        plt.show()
\ No newline at end of file
+        plt.show()